@@ -5,6 +5,12 @@ from pathlib import Path
 import xml.etree.ElementTree as ET
 import json
 import os
+import sqlite3
+import base64
+import hashlib
+import hmac
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from colorama import Fore, Style, init
 import signal
 import platform
@@ -22,77 +28,524 @@ utenti_lock = threading.Lock()
 def setup_config():
     """Crea la cartella config e il file users.json se non esistono"""
     Path("config").mkdir(exist_ok=True)
-    # Se il file non esiste, crealo vuoto con struttura base
-    if not os.path.exists(CONFIG_FILE):
+    # Se il file non esiste, crealo vuoto con struttura base (non serve con SQLite)
+    if UTENTI_BACKEND == "json" and not os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump({"users": []}, f, indent=2)
 
+# Utenti in memoria {username: utente}: letti una volta da users.json (lo
+# snapshot) più il journal, riletti solo quando uno dei due cambia su disco
+# (mtime o dimensione diversi da quelli dell'ultima lettura o scrittura).
+# Registrazioni e aggiornamenti si aggiungono in coda al journal, una riga
+# JSON con username e campi modificati: il costo non dipende dal numero di
+# utenti e una scrittura non può cancellarne un'altra. Il thread di
+# salvataggio riporta il journal nello snapshot quando supera
+# JOURNAL_COMPATTA_BYTE
+JOURNAL_FILE = 'config/users.journal'
+JOURNAL_COMPATTA_BYTE = 1024 * 1024
+# Campi di una riga di registrazione (le altre righe aggiornano utenti esistenti)
+_RECORD_REGISTRAZIONE = {"username", "password", "data_registrazione"}
+_utenti = {}
+_versione_utenti = None
+_snapshot_lock = threading.Lock()   # Una scrittura dello snapshot alla volta (prima di config_lock)
+
+# Ultimi accessi: tenuti in memoria e scritti tutti insieme ogni
+# ACCESSI_FLUSH_INTERVALLO secondi e alla chiusura, invece di scrivere a
+# ogni login. Senza il thread di salvataggio si scrive subito
+ACCESSI_FLUSH_INTERVALLO = 5.0
+_accessi_in_sospeso = {}        # {username: ultimo_accesso non ancora su file}
+_thread_accessi = None
+_stop_accessi = threading.Event()
+
+
+def _stato_file(percorso):
+    """(mtime, dimensione) di un file, o None se non esiste"""
+    try:
+        stato = os.stat(percorso)
+    except FileNotFoundError:
+        return None
+    return stato.st_mtime_ns, stato.st_size
+
+def _versione_file():
+    """Versione su disco di snapshot e journal"""
+    return _stato_file(CONFIG_FILE), _stato_file(JOURNAL_FILE)
+
+def _applica_journal(utenti, rigorosa=False):
+    """
+    Applica agli utenti le righe del journal; scarta una riga finale scritta
+    a metà. Un utente nuovo nasce solo da una registrazione completa: gli
+    aggiornamenti di utenti che non ci sono più (es. tolti a mano dal file)
+    vengono ignorati. Con rigorosa=True il journal non viene toccato e una
+    riga completa illeggibile solleva ValueError invece di essere saltata
+    """
+    try:
+        with open(JOURNAL_FILE, 'rb') as f:
+            dati = f.read()
+    except FileNotFoundError:
+        return
+    fine = dati.rfind(b"\n") + 1
+    if fine < len(dati) and not rigorosa:
+        # Scrittura interrotta: le prossime righe non devono attaccarsi a questa
+        os.truncate(JOURNAL_FILE, fine)
+    for riga in dati[:fine].splitlines():
+        try:
+            record = json.loads(riga)
+        except ValueError:
+            if rigorosa:
+                raise ValueError(f"Riga illeggibile nel journal {JOURNAL_FILE}: {riga[:80]!r}") from None
+            continue
+        user = utenti.get(record.get('username'))
+        if user is not None:
+            user.update(record)
+        elif _RECORD_REGISTRAZIONE <= record.keys():
+            utenti[record['username']] = record
+
+def _aggiorna_da_file():
+    """Ricarica gli utenti se snapshot o journal sono cambiati su disco (da chiamare con config_lock)"""
+    global _utenti, _versione_utenti
+    versione = _versione_file()
+    if versione[0] is not None and versione == _versione_utenti:
+        return
+    try:
+        # Assicura che la cartella e il file esistano
+        setup_config()
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        utenti = {user['username']: user for user in data['users']}
+        _applica_journal(utenti)
+        _utenti = utenti
+    except Exception:
+        # File illeggibile (es. modificato a metà): si riprova alla prossima richiesta
+        if _versione_utenti is not None:
+            return
+        _utenti = {}
+    _versione_utenti = _versione_file()
+    # Gli accessi non ancora salvati valgono anche sul file riletto
+    for username, accesso in _accessi_in_sospeso.items():
+        if username in _utenti:
+            _utenti[username]['ultimo_accesso'] = accesso
+
+def _appendi_journal(record):
+    """Aggiunge i record [{username, campi...}] in coda al journal (da chiamare con config_lock)"""
+    global _versione_utenti
+    Path(os.path.dirname(JOURNAL_FILE) or '.').mkdir(parents=True, exist_ok=True)
+    righe = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in record)
+    with open(JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        f.write(righe)
+    # La propria scrittura non va riletta
+    _versione_utenti = _versione_file()
+
+def _scrivi_snapshot(utenti):
+    """Scrive lo snapshot degli utenti in una copia da sostituire al file; ne restituisce il nome"""
+    Path(os.path.dirname(CONFIG_FILE) or '.').mkdir(parents=True, exist_ok=True)
+    temporaneo = CONFIG_FILE + '.tmp'
+    with open(temporaneo, 'w', encoding='utf-8') as f:
+        json.dump({"users": utenti}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    return temporaneo
+
+def compatta_utenti():
+    """
+    Riporta il journal nello snapshot. Lo snapshot si scrive fuori dal lock,
+    le righe aggiunte nel frattempo restano nel nuovo journal. Dopo
+    un'interruzione il vecchio journal riapplicato allo snapshot nuovo dà
+    lo stesso risultato (ogni riga imposta valori, non li incrementa)
+    """
+    global _versione_utenti
+    if _db is not None:
+        return
+    with _snapshot_lock:
+        with config_lock:
+            _aggiorna_da_file()
+            _salva_accessi_bloccato()
+            utenti = [dict(user) for user in _utenti.values()]
+            compattati = os.path.getsize(JOURNAL_FILE) if os.path.exists(JOURNAL_FILE) else 0
+        snapshot = _scrivi_snapshot(utenti)
+        with config_lock:
+            coda = b""
+            if os.path.exists(JOURNAL_FILE):
+                with open(JOURNAL_FILE, 'rb') as f:
+                    f.seek(compattati)
+                    coda = f.read()
+            os.replace(snapshot, CONFIG_FILE)
+            temporaneo = JOURNAL_FILE + '.tmp'
+            with open(temporaneo, 'wb') as f:
+                f.write(coda)
+            os.replace(temporaneo, JOURNAL_FILE)
+            _versione_utenti = _versione_file()
+
+# Archivio utenti SQLite (per molti account): UTENTI_BACKEND = "sqlite" o
+# configura_utenti("sqlite"). Una tabella con indice univoco sullo username,
+# in modalità WAL: ogni funzione diventa una query e nessuno carica più
+# tutti gli utenti. Al primo avvio gli utenti di users.json (snapshot e
+# journal) vengono importati e i file rinominati in ".migrato"
+UTENTI_BACKEND = "json"                 # "json" | "sqlite"
+UTENTI_SQLITE_FILE = 'config/users.db'
+_CAMPI_UTENTE = ("username", "password", "ip", "porta", "data_registrazione", "ultimo_accesso")
+_db = None                              # Connessione condivisa (con config_lock), None con il file JSON
+
+_SCHEMA_UTENTI = """
+CREATE TABLE IF NOT EXISTS utenti (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    ip TEXT,
+    porta INTEGER,
+    data_registrazione TEXT,
+    ultimo_accesso TEXT,
+    altri TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS utenti_username ON utenti (username);
+"""
+
+def _riga_sql(user):
+    """Valori di un utente per la tabella (i campi sconosciuti finiscono in "altri" come JSON)"""
+    altri = {k: v for k, v in user.items() if k not in _CAMPI_UTENTE}
+    return tuple(user.get(campo) for campo in _CAMPI_UTENTE) + (json.dumps(altri) if altri else None,)
+
+def _utente_da_riga(riga):
+    """Utente nel formato del file JSON da una riga della tabella"""
+    user = {campo: valore for campo, valore in zip(_CAMPI_UTENTE, riga) if valore is not None}
+    if riga[-1]:
+        user.update(json.loads(riga[-1]))
+    return user
+
+def _inserisci_utenti(utenti):
+    """Inserisce gli utenti nella tabella (da chiamare in una transazione con config_lock)"""
+    _db.executemany(
+        f"INSERT INTO utenti ({', '.join(_CAMPI_UTENTE)}, altri) VALUES ({', '.join('?' * (len(_CAMPI_UTENTE) + 1))})",
+        [_riga_sql(user) for user in utenti])
+
+def configura_utenti(nome=None, percorso=None):
+    """
+    Sceglie dove tenere gli utenti ("json" o "sqlite", con percorso del
+    database). Da chiamare all'avvio: con "sqlite" importa una sola volta
+    gli utenti del file JSON
+    """
+    global _db, UTENTI_BACKEND, UTENTI_SQLITE_FILE
+    nome = (nome or UTENTI_BACKEND).lower()
+    if nome not in ("json", "sqlite"):
+        raise ValueError(f"Archivio utenti non valido: {nome} (usa json, sqlite)")
+    with config_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+        UTENTI_BACKEND = nome
+        if nome == "json":
+            return
+        UTENTI_SQLITE_FILE = percorso or UTENTI_SQLITE_FILE
+        Path(os.path.dirname(UTENTI_SQLITE_FILE) or '.').mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(UTENTI_SQLITE_FILE, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA_UTENTI)
+
+        _db = db
+        if os.path.exists(CONFIG_FILE) and _db.execute("SELECT COUNT(*) FROM utenti").fetchone()[0] == 0:
+            try:
+                _migra_da_json()
+            except Exception:
+                # Con un database vuoto la migrazione si ritenterebbe alla prossima
+                # registrazione: meglio non partire che perdere gli account
+                _db.close()
+                _db = None
+                UTENTI_BACKEND = "json"
+                raise
+
+def _migra_da_json():
+    """
+    Migrazione una tantum degli utenti del file JSON (snapshot e journal)
+    nel database vuoto (da chiamare con config_lock). Il file si legge senza
+    tolleranze: se è illeggibile, o se non vengono importati tutti i suoi
+    utenti, solleva un'eccezione e i file restano dove sono. Vengono
+    rinominati in ".migrato" solo dopo il commit della transazione
+    """
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    utenti = {user['username']: user for user in data['users']}
+    _applica_journal(utenti, rigorosa=True)
+    with _db:
+        _inserisci_utenti(utenti.values())
+        # Il controllo sta nella transazione: se fallisce il database resta vuoto
+        importati = _db.execute("SELECT COUNT(*) FROM utenti").fetchone()[0]
+        if importati != len(utenti):
+            raise RuntimeError(f"Migrazione utenti incompleta: {importati} importati su {len(utenti)}")
+    for vecchio in (CONFIG_FILE, JOURNAL_FILE):
+        if os.path.exists(vecchio):
+            os.replace(vecchio, vecchio + '.migrato')
+    _utenti.clear()
+
+# Password salvate come hash con sale: "pbkdf2_sha256$<iterazioni>$<sale>$<hash>"
+# o "scrypt$<n>$<r>$<p>$<sale>$<hash>" (sale e hash in base64). Il calcolo
+# gira in un pool di processi (avvia_pool_hash): i login non tengono la CPU
+# e il GIL dei thread dei client e al più HASH_PROCESSI hash sono in corso.
+# Le password in chiaro, o con un costo diverso da quello configurato,
+# vengono riscritte al primo login riuscito
+HASH_ALGORITMO = "pbkdf2_sha256"        # "pbkdf2_sha256" | "scrypt"
+HASH_ITERAZIONI = 600_000               # Costo di PBKDF2
+HASH_SCRYPT = (2 ** 14, 8, 1)           # Costo di scrypt: n, r, p
+HASH_PROCESSI = max(1, (os.cpu_count() or 2) // 2)
+_pool_hash = None
+
+
+def _parametri_hash():
+    """(algoritmo, parametri) degli hash da creare, secondo la configurazione"""
+    if HASH_ALGORITMO == "scrypt":
+        return "scrypt", tuple(HASH_SCRYPT)
+    return "pbkdf2_sha256", (HASH_ITERAZIONI,)
+
+def _deriva(password, algoritmo, parametri, sale):
+    """Hash della password con algoritmo, parametri e sale dati"""
+    if algoritmo == "scrypt":
+        n, r, p = parametri
+        return hashlib.scrypt(password.encode('utf-8'), salt=sale, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=32)
+    if algoritmo == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode('utf-8'), sale, parametri[0])
+    raise ValueError(f"Algoritmo di hash sconosciuto: {algoritmo}")
+
+def _crea_hash(password, algoritmo, parametri):
+    """Hash con un sale nuovo, nel formato salvato (gira nel pool)"""
+    sale = os.urandom(16)
+    valori = [algoritmo, *map(str, parametri), base64.b64encode(sale).decode('ascii'),
+              base64.b64encode(_deriva(password, algoritmo, parametri, sale)).decode('ascii')]
+    return "$".join(valori)
+
+def _leggi_hash(memorizzata):
+    """(algoritmo, parametri, sale, hash) di una password salvata, o None se è in chiaro"""
+    parti = memorizzata.split("$")
+    if parti[0] not in ("pbkdf2_sha256", "scrypt") or len(parti) < 4:
+        return None
+    try:
+        return parti[0], tuple(int(v) for v in parti[1:-2]), base64.b64decode(parti[-2]), base64.b64decode(parti[-1])
+    except ValueError:
+        # Una password in chiaro che somiglia a un hash
+        return None
+
+def _controlla_hash(password, memorizzata):
+    """True se la password corrisponde all'hash salvato (gira nel pool)"""
+    algoritmo, parametri, sale, atteso = _leggi_hash(memorizzata)
+    return hmac.compare_digest(_deriva(password, algoritmo, parametri, sale), atteso)
+
+def _nel_pool(funzione, *argomenti):
+    """Esegue la funzione nel pool di processi, o qui se il pool non è attivo"""
+    pool = _pool_hash
+    if pool is None:
+        return funzione(*argomenti)
+    return pool.submit(funzione, *argomenti).result()
+
+def _avvia_processo_hash():
+    """Inizializza un processo del pool: CTRL+C lo gestisce solo il server"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def avvia_pool_hash(processi=None):
+    """Avvia il pool di processi per gli hash delle password"""
+    global _pool_hash
+    if _pool_hash is None:
+        # "spawn": nessun fork di un processo con thread e lock già in uso
+        _pool_hash = ProcessPoolExecutor(max_workers=processi or HASH_PROCESSI,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_avvia_processo_hash)
+
+def ferma_pool_hash():
+    """Ferma il pool degli hash (i calcoli successivi tornano nel processo)"""
+    global _pool_hash
+    pool, _pool_hash = _pool_hash, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+def _password_salvata(username):
+    """Password salvata (hash o in chiaro) di un utente, o None se non esiste"""
+    with config_lock:
+        if _db is not None:
+            riga = _db.execute("SELECT password FROM utenti WHERE username = ?", (username,)).fetchone()
+            return riga[0] if riga else None
+        _aggiorna_da_file()
+        user = _utenti.get(username)
+        return user['password'] if user else None
+
+def _sostituisci_password(username, vecchia, nuova):
+    """Salva la nuova password se quella salvata è ancora vecchia"""
+    with config_lock:
+        if _db is not None:
+            with _db:
+                _db.execute("UPDATE utenti SET password = ? WHERE username = ? AND password = ?",
+                            (nuova, username, vecchia))
+            return
+        _aggiorna_da_file()
+        user = _utenti.get(username)
+        if user is not None and user['password'] == vecchia:
+            _appendi_journal([{"username": username, "password": nuova}])
+            user['password'] = nuova
+
 def carica_utenti():
-    """Carica gli utenti dal file JSON"""
+    """Carica gli utenti (una copia di quelli in memoria, nel formato del file JSON)"""
     with config_lock:
-        try:
-            # Assicura che la cartella e il file esistano
-            setup_config()
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {"users": []}
+        if _db is not None:
+            _salva_accessi_bloccato()
+            righe = _db.execute(f"SELECT {', '.join(_CAMPI_UTENTE)}, altri FROM utenti ORDER BY id").fetchall()
+            return {"users": [_utente_da_riga(riga) for riga in righe]}
+        _aggiorna_da_file()
+        return {"users": [dict(user) for user in _utenti.values()]}
 
 def salva_utenti(data):
-    """Salva gli utenti nel file JSON"""
+    """Salva gli utenti nel file JSON (sostituisce tutti gli utenti e svuota il journal)"""
+    global _utenti, _versione_utenti
+    with _snapshot_lock, config_lock:
+        _accessi_in_sospeso.clear()
+        if _db is not None:
+            with _db:
+                _db.execute("DELETE FROM utenti")
+                _inserisci_utenti(data['users'])
+            return
+        _utenti = {user['username']: dict(user) for user in data['users']}
+        os.replace(_scrivi_snapshot(list(_utenti.values())), CONFIG_FILE)
+        if os.path.exists(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
+        _versione_utenti = _versione_file()
+
+def numero_utenti():
+    """Numero di utenti registrati"""
     with config_lock:
-        # Assicura che la cartella esista prima di salvare
-        Path(os.path.dirname(CONFIG_FILE) or '.').mkdir(parents=True, exist_ok=True)
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        if _db is not None:
+            return _db.execute("SELECT COUNT(*) FROM utenti").fetchone()[0]
+        _aggiorna_da_file()
+        return len(_utenti)
+
+def elenco_utenti():
+    """Username degli utenti registrati, in ordine di registrazione"""
+    with config_lock:
+        if _db is not None:
+            return [username for username, in _db.execute("SELECT username FROM utenti ORDER BY id")]
+        _aggiorna_da_file()
+        return list(_utenti)
 
 def verifica_credenziali(username, password):
-    """Verifica se username e password sono corretti"""
-    data = carica_utenti()    
-    for user in data['users']:
-        if user['username'] == username and user['password'] == password:
-            return True
-    return False
+    """Verifica se username e password sono corretti (l'hash si calcola fuori dai lock)"""
+    memorizzata = _password_salvata(username)
+    if memorizzata is None:
+        return False
+    parametri = _leggi_hash(memorizzata)
+    if parametri is None:
+        corretta = hmac.compare_digest(memorizzata.encode('utf-8'), password.encode('utf-8'))
+    else:
+        corretta = _nel_pool(_controlla_hash, password, memorizzata)
+    # Password in chiaro o con un costo superato: si salva l'hash attuale
+    if corretta and (parametri is None or parametri[:2] != _parametri_hash()):
+        _sostituisci_password(username, memorizzata, _nel_pool(_crea_hash, password, *_parametri_hash()))
+    return corretta
 
 def username_esiste(username):
     """Controlla se un username esiste già"""
-    data = carica_utenti()
-    for user in data['users']:
-        if user['username'] == username:
-            return True
-    return False
+    with config_lock:
+        if _db is not None:
+            return _db.execute("SELECT 1 FROM utenti WHERE username = ?", (username,)).fetchone() is not None
+        _aggiorna_da_file()
+        return username in _utenti
 
 def registra_utente(username, password, ip, porta):
-    """Registra un nuovo utente"""
-    data = carica_utenti()
-    
+    """Registra un nuovo utente; False se lo username è già stato preso"""
     nuovo_utente = {
         "username": username,
-        "password": password,
+        "password": _nel_pool(_crea_hash, password, *_parametri_hash()),
         "ip": ip,
         "porta": porta,
         "data_registrazione": datetime.now().isoformat(),
         "ultimo_accesso": datetime.now().isoformat()
     }
     
-    data['users'].append(nuovo_utente)
-    salva_utenti(data)
+    with config_lock:
+        if _db is not None:
+            try:
+                with _db:
+                    _inserisci_utenti([nuovo_utente])
+            except sqlite3.IntegrityError:
+                return False
+            return True
+        _aggiorna_da_file()
+        # Due registrazioni dello stesso nome: vince la prima
+        if username in _utenti:
+            return False
+        _appendi_journal([nuovo_utente])
+        _utenti[username] = nuovo_utente
+        _accessi_in_sospeso.pop(username, None)
     return True
 
 def aggiorna_ultimo_accesso(username):
-    """Aggiorna la data di ultimo accesso"""
-    data = carica_utenti()
-    for user in data['users']:
-        if user['username'] == username:
+    """Aggiorna la data di ultimo accesso (su file al prossimo salvataggio degli accessi)"""
+    with config_lock:
+        if _db is not None:
+            _accessi_in_sospeso[username] = datetime.now().isoformat()
+        else:
+            _aggiorna_da_file()
+            user = _utenti.get(username)
+            if user is None:
+                return
             user['ultimo_accesso'] = datetime.now().isoformat()
-            break
-    salva_utenti(data)
+            _accessi_in_sospeso[username] = user['ultimo_accesso']
+        if _thread_accessi is None:
+            _salva_accessi_bloccato()
+
+def _salva_accessi_bloccato():
+    """Accessi in sospeso in coda al journal, in un'unica scrittura (da chiamare con config_lock)"""
+    if _accessi_in_sospeso and _db is not None:
+        with _db:
+            _db.executemany("UPDATE utenti SET ultimo_accesso = ? WHERE username = ?",
+                            [(accesso, username) for username, accesso in _accessi_in_sospeso.items()])
+        _accessi_in_sospeso.clear()
+    elif _accessi_in_sospeso:
+        # Utenti rimossi nel frattempo: il loro accesso non va nel journal
+        record = [{"username": username, "ultimo_accesso": accesso}
+                  for username, accesso in _accessi_in_sospeso.items() if username in _utenti]
+        if record:
+            _appendi_journal(record)
+        _accessi_in_sospeso.clear()
+
+def salva_accessi():
+    """Scrive su file gli ultimi accessi in sospeso, con un'unica scrittura"""
+    with config_lock:
+        if _db is None:
+            _aggiorna_da_file()
+        _salva_accessi_bloccato()
+
+def _ciclo_accessi(intervallo):
+    """Thread che salva gli accessi in sospeso e compatta il journal ogni intervallo secondi"""
+    while not _stop_accessi.wait(intervallo):
+        try:
+            salva_accessi()
+            if _db is None and os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) > JOURNAL_COMPATTA_BYTE:
+                compatta_utenti()
+        except Exception as e:
+            logger.console(f"Errore salvataggio utenti: {e}", "ERROR")
+
+def avvia_salvataggio_accessi(intervallo=None):
+    """Avvia il salvataggio periodico degli ultimi accessi e la compattazione del journal"""
+    global _thread_accessi
+    if _thread_accessi is not None:
+        return
+    _stop_accessi.clear()
+    _thread_accessi = threading.Thread(
+        target=_ciclo_accessi, args=(intervallo or ACCESSI_FLUSH_INTERVALLO,),
+        name="utenti-accessi", daemon=True)
+    _thread_accessi.start()
+
+def ferma_salvataggio_accessi(timeout=5):
+    """Ferma il salvataggio periodico e scrive gli accessi rimasti"""
+    global _thread_accessi
+    if _thread_accessi is None:
+        return
+    _stop_accessi.set()
+    _thread_accessi.join(timeout)
+    _thread_accessi = None
+    salva_accessi()
 
 
 def autenticazione(mio_socket, client_address, log_filename):
     """
     Gestisce l'autenticazione del client
-    Restituisce: (True, username) se successo, (False, None) altrimenti
+    Restituisce: (True, username, None) se successo, (False, None, None) altrimenti,
+    come server_5.autenticazione (qui il log del client non viene creato)
     """
     try:
         # Chiedi se ha già un account
@@ -114,14 +567,14 @@ def autenticazione(mio_socket, client_address, log_filename):
                         if username in utenti_connessi:
                             mio_socket.send("AUTH_FAIL|Utente già connesso da un altro client!".encode('utf-8'))
                             logger.log_to_xml(log_filename, "WARNING", "AUTH", f"Tentativo login con utente già connesso: {username}")
-                            return False, None
+                            return False, None, None
                     
                     aggiorna_ultimo_accesso(username)
                     mio_socket.send(f"AUTH_SUCCESS|Benvenuto {username}!".encode('utf-8'))
                     
                     logger.log_to_xml(log_filename, "INFO", "AUTH", f"Login effettuato: {username}")
                     
-                    return True, username
+                    return True, username, None
                 else:
                     tentativi_rimasti = 2 - tentativo
                     if tentativi_rimasti > 0:
@@ -131,7 +584,7 @@ def autenticazione(mio_socket, client_address, log_filename):
                     
                     logger.log_to_xml(log_filename, "WARNING", "AUTH", f"Tentativo login fallito per username: {username}")
             
-            return False, None
+            return False, None, None
             
         elif risposta == "NO":
             # REGISTRAZIONE
@@ -154,19 +607,21 @@ def autenticazione(mio_socket, client_address, log_filename):
             
             if len(password) < 4:
                 mio_socket.send("REG_FAIL|Password troppo corta (minimo 4 caratteri)".encode('utf-8'))
-                return False, None
+                return False, None, None
             
             # Registra utente
-            registra_utente(username, password, client_address[0], client_address[1])
+            if not registra_utente(username, password, client_address[0], client_address[1]):
+                mio_socket.send("REG_FAIL|Username già esistente, registrazione annullata".encode('utf-8'))
+                return False, None, None
             mio_socket.send(f"REG_SUCCESS|Account creato! Benvenuto {username}!".encode('utf-8'))
             
             logger.log_to_xml(log_filename, "INFO", "REGISTRATION", f"Nuovo utente registrato: {username}")
             
-            return True, username
+            return True, username, None
         else:
             mio_socket.send("AUTH_FAIL|Risposta non valida".encode('utf-8'))
-            return False, None
+            return False, None, None
             
     except Exception as e:
         logger.log_to_xml(log_filename, "ERROR", "AUTH_ERROR", f"Errore durante autenticazione: {e}")
-        return False, None
\ No newline at end of file
+        return False, None, None
\ No newline at end of file
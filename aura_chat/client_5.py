@@ -6,6 +6,8 @@ import os
 import sys
 import time
 import platform
+import zlib
+import codecs
 from colorama import Fore, Style, init
 
 # Inizializza colorama per Windows
@@ -27,6 +29,12 @@ SECRET_TOKEN = "AURACHAT"  # PAROLA CHIAVE IDENTIFICATORE DISCOVERY
 DISCOVERY_PORT = 9999
 DISCOVERY_TIMEOUT = 5  # Secondi da aspettare per risposte
 
+# Compressione dei trasferimenti LOG/EX chiesta al server dopo il login
+COMPRESSIONE = "zlib"  # zlib | gzip | None per ricevere i dati non compressi
+COMPRESSIONE_LIVELLO = 6  # 1 più veloce .. 9 più compresso
+COMPRESSIONI = {"zlib": 15, "gzip": 31}  # wbits per zlib.decompressobj
+BLOCCO_RICEZIONE = 64 * 1024
+
 def mostra_menu():
     """Mostra menu comandi disponibili"""
     print("\n" + "=" * 60)
@@ -40,13 +48,17 @@ def mostra_menu():
     print("                      3: Info rete del server")
     print("                      4: Info rete del client")
     print("                      5: Lista utenti per chat")
+    print("  STATS               → Statistiche della sessione in corso")
     print("  LOG [date]          → Scarica il tuo log personale")
     print("                      Format: YYYY-MM-DD (Es: 2026-01-01)")
     print("                      Default: Scarica il log di oggi")
+    print("  LOG <da> <a>        → Log di più giorni in un unico invio")
     print("  EX [fmt] [n] [tgt]  → Scarica/Esporta file di log")
     print("                        [fmt]: xml | csv | txt (Default xml)")
     print("                        [n]  : Numero righe da scaricare (Default all)")
+    print("                               oppure intervallo di entry K-J o K-")
     print("                        [tgt]: client | server (Default entambi)")
+    print("                        filtri: level=WARNING type=AUTH from=14:00 to=15:00")
     print(f"                        {Colori.GRIGIO}Esempio: EX csv 5 client{Colori.RESET}")
 
     # Chiusura
@@ -273,6 +285,46 @@ def get_info_client(mio_socket):
     )
     return info
 
+def negozia_compressione(mio_socket):
+    """
+    Chiede al server di comprimere i trasferimenti LOG/EX.
+    Un server che non la supporta risponde con un errore e si resta senza
+    """
+    if not COMPRESSIONE:
+        return
+    mio_socket.send(f"COMPRESS {COMPRESSIONE} {COMPRESSIONE_LIVELLO}".encode('utf-8'))
+    risposta = mio_socket.recv(1024).decode('utf-8', errors='ignore')
+    if risposta.startswith("COMPRESS_OK|"):
+        _, algoritmo, livello = risposta.split("|")
+        print(f"{Colori.GRIGIO}Trasferimenti compressi: {algoritmo} (livello {livello}){Colori.RESET}")
+
+def ricevi_file(mio_socket, dimensione, algoritmo, scrivi):
+    """
+    Riceve i dati annunciati da FILE_START passandoli a scrivi() man mano,
+    decomprimendoli in streaming se il server li manda compressi.
+    Restituisce gli eventuali byte arrivati dopo la fine del flusso compresso
+    (l'inizio del messaggio successivo)
+    """
+    if not algoritmo:
+        ricevuti = 0
+        while ricevuti < dimensione:
+            chunk = mio_socket.recv(min(BLOCCO_RICEZIONE, dimensione - ricevuti))
+            if not chunk: break
+            scrivi(chunk)
+            ricevuti += len(chunk)
+        return b""
+
+    # Il flusso zlib/gzip segnala da solo la propria fine
+    decompressore = zlib.decompressobj(COMPRESSIONI[algoritmo])
+    while not decompressore.eof:
+        chunk = mio_socket.recv(BLOCCO_RICEZIONE)
+        if not chunk: break
+        # Uscita limitata a un blocco alla volta per non esplodere in memoria
+        scrivi(decompressore.decompress(chunk, BLOCCO_RICEZIONE))
+        while decompressore.unconsumed_tail and not decompressore.eof:
+            scrivi(decompressore.decompress(decompressore.unconsumed_tail, BLOCCO_RICEZIONE))
+    return decompressore.unused_data
+
 def main():
     """Funzione principale del client"""
     print("=" * 60)
@@ -321,6 +373,7 @@ def main():
         sys.exit(1)
     
     print(f"\n{Colori.VERDE}Sei connesso come: {Colori.BLU}{username}{Colori.RESET}")
+    negozia_compressione(mio_socket)
     
     # Mostra menu
     mostra_menu()
@@ -356,10 +409,15 @@ def main():
 
             # --- BLOCCO RICEZIONE MODIFICATO (PER FILE MULTIPLI) ---
             streaming_log = False 
+            residuo = b"" # Byte già ricevuti dopo un flusso compresso
 
             while True: 
                 try:
-                    data = mio_socket.recv(8192).decode('utf-8', errors='ignore')
+                    if residuo:
+                        grezzi, residuo = residuo, b""
+                    else:
+                        grezzi = mio_socket.recv(8192)
+                    data = grezzi.decode('utf-8', errors='ignore')
                     
                     if not data:
                         print("\nServer disconnesso")
@@ -386,18 +444,20 @@ def main():
                     # 3. GESTIONE DOWNLOAD FILE (Comando EX)
                     elif data.startswith("FILE_START:"):
                         parti_header = data.split(":") 
-                        tipo_file = parti_header[1]      # "CLIENT" o "SERVER"
+                        tipo_file = parti_header[1]      # "CLIENT", "SERVER" o "DISPLAY" (LOG)
                         dimensione_totale = int(parti_header[2])
+                        algoritmo = parti_header[3] if len(parti_header) > 3 else None
 
-                        print(f"Ricezione file {tipo_file} ({dimensione_totale} bytes)...")
-                        mio_socket.send("READY".encode('utf-8'))
+                        if tipo_file == "DISPLAY":
+                            # LOG compresso: stampiamo il testo man mano che arriva
+                            mio_socket.send("READY".encode('utf-8'))
+                            print(f"\n{Colori.CIANO}--- INIZIO LOG ---{Colori.RESET}")
+                            decodifica = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+                            stampa = lambda pezzo: print(decodifica.decode(pezzo).replace(chr(9552),'-').replace(chr(9553),'|'), end="")
+                            residuo = ricevi_file(mio_socket, dimensione_totale, algoritmo, stampa)
+                            continue
 
-                        dati_ricevuti = b""
-                        while len(dati_ricevuti) < dimensione_totale:
-                            mancanti = dimensione_totale - len(dati_ricevuti)
-                            chunk = mio_socket.recv(min(4096, mancanti))
-                            if not chunk: break
-                            dati_ricevuti += chunk
+                        print(f"Ricezione file {tipo_file} ({dimensione_totale} bytes)...")
 
                         # Determiniamo estensione dal messaggio inviato prima
                         estensione = "xml"
@@ -406,8 +466,10 @@ def main():
 
                         nome_output = f"log_scaricato_{username}.{estensione}" if tipo_file == "CLIENT" else f"log_scaricato_server.{estensione}"
 
+                        # Scriviamo su disco mentre riceviamo (e decomprimiamo)
                         with open(nome_output, "wb") as f_out:
-                            f_out.write(dati_ricevuti)
+                            mio_socket.send("READY".encode('utf-8'))
+                            residuo = ricevi_file(mio_socket, dimensione_totale, algoritmo, f_out.write)
 
                         print(f"File salvato: {Colori.BLU}{nome_output}{Colori.RESET}")
                         continue # Molto importante: continua a cercare altri file o FINE_INVIO
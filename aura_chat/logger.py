@@ -1,6 +1,6 @@
 import socket
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 import xml.etree.ElementTree as ET
 import json
@@ -8,6 +8,23 @@ import os
 from colorama import Fore, Style, init
 import signal
 import platform
+import re
+import queue
+import time
+import struct
+import sqlite3
+import sys
+import glob
+import io
+import csv
+import gzip
+import shutil
+import zipfile
+import itertools
+from collections import OrderedDict, deque
+from array import array
+from xml.sax.saxutils import escape
+from contextlib import contextmanager
 
 # Inizializza colorama per Windows
 init(autoreset=True)
@@ -24,160 +41,3062 @@ class Colori:
     GRIGIO = Fore.LIGHTBLACK_EX
     BOLD = Style.BRIGHT
 
-# Lock per scrittura XML thread-safe
-xml_lock = threading.Lock()
+# --- REGISTRO DEI LOCK PER FILE ---
+# Un lock per ogni file di log: scritture su file diversi procedono in parallelo.
+# I lock dei file inattivi vengono rimossi dal registro
+LOCK_INATTIVO_SECONDI = 300      # Dopo quanto un lock non usato viene rimosso
+LOCK_PULIZIA_INTERVALLO = 60     # Ogni quanto controllare i lock inattivi
+
+_registro_lock = threading.Lock()
+_lock_per_file = {}              # {percorso assoluto: [Lock, utilizzatori, ultimo uso]}
+_ultima_pulizia_lock = time.monotonic()
+
+@contextmanager
+def lock_log(log_filename):
+    """Acquisisce il lock del singolo file di log (o del file derivato)"""
+    global _ultima_pulizia_lock
+    chiave = os.path.abspath(log_filename)
+    with _registro_lock:
+        voce = _lock_per_file.get(chiave)
+        if voce is None:
+            # Rientrante: chi scrive su un log ruotato prende il lock del log e del segmento,
+            # che per il primo segmento del giorno coincidono
+            voce = _lock_per_file[chiave] = [threading.RLock(), 0, 0.0]
+        voce[1] += 1
+    try:
+        with voce[0]:
+            yield
+    finally:
+        with _registro_lock:
+            voce[1] -= 1
+            adesso = time.monotonic()
+            voce[2] = adesso
+            if adesso - _ultima_pulizia_lock >= LOCK_PULIZIA_INTERVALLO:
+                _ultima_pulizia_lock = adesso
+                _rimuovi_lock_inattivi(adesso)
+
+def _rimuovi_lock_inattivi(adesso):
+    """Rimuove i lock senza utilizzatori e non usati di recente (con _registro_lock)"""
+    for chiave, (_, utilizzatori, ultimo_uso) in list(_lock_per_file.items()):
+        if utilizzatori == 0 and adesso - ultimo_uso >= LOCK_INATTIVO_SECONDI:
+            del _lock_per_file[chiave]
+
+# File di log tenuti aperti in append {log_filename: file binario}
+# I tag </session></log> vengono scritti solo alla chiusura (rollover o shutdown)
+file_aperti = {}
+
+CHIUSURA_SESSIONE = "  </session>\n"
+CHIUSURA_LOG = "</log>\n"
+
+# Caratteri di controllo non ammessi in XML 1.0 (es. codici colore ANSI)
+_caratteri_non_validi = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_escape_attributi = {'"': "&quot;", "\n": "&#10;", "\t": "&#9;"}
+
+def _attributi(attributi):
+    """Serializza un dizionario di attributi XML con escape"""
+    return "".join(
+        f' {nome}="{escape(str(valore), _escape_attributi)}"'
+        for nome, valore in attributi.items()
+    )
+
+def _testo(valore):
+    """Escape del testo di un elemento XML rimuovendo i caratteri non validi"""
+    return escape(_caratteri_non_validi.sub("", str(valore)))
+
+def _apri_sessione(attributi):
+    """Tag di apertura di una nuova sessione"""
+    return f"  <session{_attributi(attributi)}>\n"
+
+def _scrivi(f, testo):
+    """Scrive in coda al file e forza il flush, così i lettori vedono l'entry"""
+    f.write(testo.encode('utf-8'))
+    f.flush()
+
+def _crea_log(log_filename, attributi_log, attributi_sessione):
+    """Crea un nuovo file di log lasciando aperta la prima sessione"""
+    f = open(log_filename, "wb")
+    file_aperti[log_filename] = f
+    # Un eventuale indice rimasto da un file omonimo non è più valido
+    indici_aperti[log_filename] = open(log_filename + ".idx", "wb")
+    sessione_corrente[log_filename] = None
+    if _viste_attive(log_filename):
+        # Anche le viste di un file omonimo vanno rifatte
+        if os.path.exists(log_filename + ".viste"):
+            os.remove(log_filename + ".viste")
+        _apri_viste(log_filename)
+    _appendi(log_filename, "<?xml version='1.0' encoding='utf-8'?>\n"
+                           f"<log{_attributi(attributi_log)}>\n"
+                           + _apri_sessione(attributi_sessione))
+    return f
+
+# Ultimi punti "sani" di un log: fine di un'entry, apertura o chiusura di una sessione
+_pattern_punti_sani = re.compile(rb"</entry>|<session\b[^<>]*>|</session>")
+
+def _ultimo_punto_sano(f, dimensione):
+    """
+    (offset, tag) dell'ultimo elemento completo del file, cercato a ritroso
+    in una finestra che si allarga finché non lo trova: il costo dipende
+    dalla coda danneggiata, non dalla dimensione del log. (0, b"") se non c'è
+    """
+    finestra = 4096
+    while True:
+        inizio = max(0, dimensione - finestra)
+        f.seek(inizio)
+        ultimo = None
+        for ultimo in _pattern_punti_sani.finditer(f.read(dimensione - inizio)):
+            pass
+        if ultimo is not None:
+            return inizio + ultimo.end(), ultimo.group()
+        if inizio == 0:
+            return 0, b""
+        finestra *= 4
+
+def _ripara_log(log_filename, chiudi=False):
+    """
+    Ripara un file rimasto aperto (crash o kill del server): tronca dopo
+    l'ultimo elemento completo e lascia aperta l'ultima sessione, o chiude
+    il documento se chiudi=True. Un file senza nemmeno una sessione viene
+    messo da parte come ".corrotto" e sostituito da un log vuoto
+    """
+    inizio_sessione = _apri_sessione({
+        "start_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+    chiusura = CHIUSURA_SESSIONE + CHIUSURA_LOG if chiudi else ""
+    with open(log_filename, "r+b") as f:
+        fine, tag = _ultimo_punto_sano(f, f.seek(0, os.SEEK_END))
+        if fine == 0:
+            aggiunta = None
+        elif tag == b"</session>":
+            # La sessione era stata chiusa: ne apro una nuova
+            aggiunta = "\n" + (CHIUSURA_LOG if chiudi else inizio_sessione)
+        elif tag.endswith(b"/>"):
+            # Sessione vuota auto-chiusa: la riapro
+            if chiudi:
+                aggiunta = "\n" + CHIUSURA_LOG
+            else:
+                fine -= 2
+                aggiunta = ">\n"
+        else:
+            aggiunta = "\n" + chiusura
+        if aggiunta is not None:
+            f.truncate(fine)
+            f.seek(fine)
+            f.write(aggiunta.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            return
+
+    console(f"Log {log_filename} illeggibile, salvato come {log_filename}.corrotto", "ERROR")
+    os.replace(log_filename, log_filename + ".corrotto")
+    for derivato in (".idx", ".viste"):
+        if os.path.exists(log_filename + derivato):
+            os.remove(log_filename + derivato)
+    with open(log_filename, "wb") as f:
+        f.write(("<?xml version='1.0' encoding='utf-8'?>\n<log>\n"
+                 + inizio_sessione + chiusura).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+def _riapri_log(log_filename):
+    """
+    Riapre in append un file di log esistente.
+    Se era chiuso rimuove i tag finali (lettura della sola coda del file),
+    se era rimasto aperto da un crash lo ripara.
+    """
+    with open(log_filename, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        inizio_coda = max(0, f.tell() - 4096)
+        f.seek(inizio_coda)
+        coda = f.read()
+
+        chiuso = re.search(rb"\s*</session>\s*</log>\s*$", coda)
+        auto_chiuso = re.search(rb"(<session\b[^<>]*?)\s*/>\s*</log>\s*$", coda)
+        senza_sessioni = re.search(rb"</log>\s*$", coda)
+
+        if chiuso:
+            # Riapro l'ultima sessione
+            nuova_coda = b"\n"
+            fine = inizio_coda + chiuso.start()
+        elif auto_chiuso:
+            # Sessione vuota scritta da ElementTree come <session ... />
+            nuova_coda = auto_chiuso.group(1) + b">\n"
+            fine = inizio_coda + auto_chiuso.start()
+        elif senza_sessioni:
+            # Log senza sessioni: ne apro una
+            nuova_coda = _apri_sessione({
+                "start_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }).encode('utf-8')
+            fine = inizio_coda + senza_sessioni.start()
+        else:
+            nuova_coda = None
+
+        if nuova_coda is not None:
+            f.truncate(fine)
+            f.seek(fine)
+            f.write(nuova_coda)
+            return
+
+    # Nessun tag di chiusura: il file era rimasto aperto
+    _ripara_log(log_filename)
+
+def _file_log(log_filename):
+    """Restituisce il file aperto in append per il log (da chiamare con lock_log)"""
+    f = file_aperti.get(log_filename)
+    if f is None:
+        _riapri_log(log_filename)
+        f = open(log_filename, "ab")
+        file_aperti[log_filename] = f
+        _apri_indice(log_filename)
+        if _viste_attive(log_filename):
+            _apri_viste(log_filename)
+    return f
+
+def _appendi(log_filename, testo):
+    """Appende testo al log aggiornando l'indice; restituisce i byte scritti (con lock_log)"""
+    f = _file_log(log_filename)
+    dati = testo.encode('utf-8')
+    offset = f.tell()
+    f.write(dati)
+    f.flush()
+    _indicizza(log_filename, dati, offset)
+    _aggiorna_viste(log_filename, dati, offset)
+    return len(dati)
+
+def _scrivi_log(log_filename, testo):
+    """Appende al segmento attivo del log, ruotandolo se serve (da chiamare con lock_log)"""
+    segmento = _segmento_attivo(log_filename)
+    with lock_log(segmento):
+        return _appendi(segmento, testo)
+
+def _chiudi_segmento(segmento):
+    """Scrive i tag finali e rilascia file e indice di un segmento (con lock_log)"""
+    f = file_aperti.pop(segmento, None)
+    if f is not None:
+        _scrivi(f, CHIUSURA_SESSIONE + CHIUSURA_LOG)
+        f.close()
+    _chiudi_indice(segmento)
+    _chiudi_viste(segmento)
+
+def _chiudi_log_bloccato(log_filename):
+    """Chiude il segmento attivo e dimentica la rotazione del log (con lock_log)"""
+    stato = _rotazione.pop(log_filename, None)
+    segmento = stato["attivo"] if stato else log_filename
+    with lock_log(segmento):
+        _chiudi_segmento(segmento)
+
+# --- INDICE DEGLI OFFSET ---
+# Accanto a ogni log "X.xml" un file "X.xml.idx" con un record a lunghezza
+# fissa per ogni entry: offset dell'entry, offset del tag della sua sessione
+# e lunghezza in byte. L'entry K (da 1) si trova a (K-1) * dimensione record,
+# così tail-N, intervalli e "dall'entry K" leggono solo i byte necessari.
+
+_RECORD_INDICE = struct.Struct("<QQI")
+_BLOCCO_SCANSIONE = 1 << 20
+
+# Riconosce le aperture di sessione e le entry complete (con indentazione e a capo)
+_pattern_elementi = re.compile(rb"<session\b[^<>]*>|[ \t]*<entry\b.*?</entry>(?:\r?\n)?", re.S)
+
+indici_aperti = {}       # {log_filename: file .idx aperto in append}
+sessione_corrente = {}   # {log_filename: offset del tag della sessione aperta}
+
+def _scansiona(dati, base, sessione, fine_file=True):
+    """
+    Trova sessioni ed entry complete in un blocco di byte che inizia all'offset base.
+    Restituisce (record, ultima sessione, byte consumati)
+    """
+    record = []
+    consumati = 0
+    for match in _pattern_elementi.finditer(dati):
+        # Un'entry a fine blocco potrebbe non avere ancora l'a capo finale
+        if not fine_file and match.end() >= len(dati):
+            break
+        if match.group().startswith(b"<session"):
+            if not match.group().endswith(b"/>"):
+                sessione = base + match.start()
+        else:
+            record.append((base + match.start(), sessione or 0, match.end() - match.start()))
+        consumati = match.end()
+    return record, sessione, consumati
+
+def _indicizza(log_filename, dati, offset):
+    """Aggiunge all'indice le entry contenute nei byte appena scritti"""
+    record, sessione, _ = _scansiona(dati, offset, sessione_corrente.get(log_filename))
+    sessione_corrente[log_filename] = sessione
+    if record:
+        indice = indici_aperti[log_filename]
+        indice.write(b"".join(_RECORD_INDICE.pack(*r) for r in record))
+        indice.flush()
+
+def _ultimo_record(f_indice):
+    """Ultimo record dell'indice, o None se vuoto"""
+    f_indice.seek(0, os.SEEK_END)
+    dimensione = f_indice.tell() // _RECORD_INDICE.size * _RECORD_INDICE.size
+    if dimensione == 0:
+        return None
+    f_indice.seek(dimensione - _RECORD_INDICE.size)
+    return _RECORD_INDICE.unpack(f_indice.read(_RECORD_INDICE.size))
+
+def _allinea_indice(log_filename):
+    """
+    Porta l'indice in pari con il log: scarta i record oltre la fine del file
+    (log troncato da una riparazione) e indicizza le entry non ancora presenti,
+    leggendo solo la parte del log successiva all'ultimo record.
+    Restituisce l'offset dell'ultima sessione (da chiamare con lock_log)
+    """
+    percorso_indice = log_filename + ".idx"
+    # Un segmento compresso è chiuso: il suo indice non può essere oltre la fine
+    dimensione_log = os.path.getsize(log_filename) if os.path.exists(log_filename) else None
+    with open(percorso_indice, "a+b") as f_indice:
+        # Record parziali (crash durante la scrittura dell'indice) o oltre la fine del log
+        dimensione = f_indice.tell() // _RECORD_INDICE.size * _RECORD_INDICE.size
+        f_indice.truncate(dimensione)
+        ultimo = _ultimo_record(f_indice)
+        while dimensione_log is not None and ultimo is not None and ultimo[0] + ultimo[2] > dimensione_log:
+            f_indice.truncate(f_indice.tell() - _RECORD_INDICE.size)
+            ultimo = _ultimo_record(f_indice)
+
+        inizio, sessione = (ultimo[0] + ultimo[2], ultimo[1]) if ultimo else (0, None)
+        with _apri_dati(log_filename) as f_log:
+            f_log.seek(inizio)
+            resto = b""
+            while True:
+                blocco = f_log.read(_BLOCCO_SCANSIONE)
+                dati = resto + blocco
+                record, sessione, consumati = _scansiona(dati, inizio, sessione, fine_file=not blocco)
+                f_indice.seek(0, os.SEEK_END)
+                f_indice.write(b"".join(_RECORD_INDICE.pack(*r) for r in record))
+                if not blocco:
+                    break
+                resto = dati[consumati:]
+                inizio += consumati
+    return sessione
+
+def _apri_indice(log_filename):
+    """Allinea e apre in append l'indice di un log appena riaperto"""
+    sessione_corrente[log_filename] = _allinea_indice(log_filename)
+    indici_aperti[log_filename] = open(log_filename + ".idx", "ab")
+
+def _chiudi_indice(log_filename):
+    """Chiude l'indice di un log che viene chiuso"""
+    sessione_corrente.pop(log_filename, None)
+    indice = indici_aperti.pop(log_filename, None)
+    if indice is not None:
+        indice.close()
+
+def ricostruisci_indice(log_filename):
+    """Ricostruisce da zero l'indice di un segmento esistente, anche compresso"""
+    with lock_log(log_filename):
+        if os.path.exists(log_filename + ".idx"):
+            os.remove(log_filename + ".idx")
+        sessione = _allinea_indice(log_filename)
+        if log_filename in indici_aperti:
+            indici_aperti[log_filename].close()
+            indici_aperti[log_filename] = open(log_filename + ".idx", "ab")
+            sessione_corrente[log_filename] = sessione
+    return os.path.getsize(log_filename + ".idx") // _RECORD_INDICE.size
+
+def _conta_segmento(segmento, fino_a=None):
+    """Entry di un segmento secondo l'indice, limitate ai primi fino_a byte"""
+    with lock_log(segmento):
+        _allinea_indice(segmento)
+        with open(segmento + ".idx", "rb") as f_indice:
+            ultimo_record = _ultimo_record(f_indice)
+            totale = f_indice.tell() // _RECORD_INDICE.size
+            # Entry scritte dopo lo snapshot: poche, in coda all'indice
+            while fino_a is not None and totale and ultimo_record[0] + ultimo_record[2] > fino_a:
+                totale -= 1
+                f_indice.seek((totale - 1) * _RECORD_INDICE.size)
+                ultimo_record = _RECORD_INDICE.unpack(f_indice.read(_RECORD_INDICE.size))
+    return totale
+
+def conta_entry(log_filename, snapshot=None):
+    """Numero di entry del log (tutti i segmenti del giorno) secondo gli indici"""
+    segmenti, dimensione, _ = snapshot or snapshot_log(log_filename)
+    return sum(_conta_segmento(segmento, dimensione if segmento == segmenti[-1] else None)
+               for segmento in segmenti)
+
+def _estrai_segmento(segmento, primo, ultimo):
+    """
+    Documento XML con le entry [primo, ultimo) di un segmento: legge solo
+    l'intestazione, i tag delle sessioni coinvolte e le entry scelte
+    """
+    with lock_log(segmento), open(segmento + ".idx", "rb") as f_indice, _apri_dati(segmento) as f_log:
+        # Intestazione: dichiarazione XML e tag <log ...>
+        intestazione = f_log.read(4096)
+        fine_radice = intestazione.index(b">", intestazione.index(b"<log")) + 1
+        parti = [intestazione[:fine_radice] + b"\n"]
+
+        if primo < ultimo:
+            f_indice.seek(primo * _RECORD_INDICE.size)
+            record = list(_RECORD_INDICE.iter_unpack(
+                f_indice.read((ultimo - primo) * _RECORD_INDICE.size)))
+
+            # Tag delle sessioni in ordine di offset (i segmenti compressi si leggono in avanti)
+            tag_sessioni = {}
+            for sessione in sorted({r[1] for r in record}):
+                f_log.seek(sessione)
+                tag = f_log.read(4096)
+                tag_sessioni[sessione] = b"  " + tag[:tag.index(b">") + 1] + b"\n"
+
+            # Le entry scelte sono contigue a meno dei tag di sessione: una sola lettura
+            inizio_blocco = record[0][0]
+            f_log.seek(inizio_blocco)
+            blocco = f_log.read(record[-1][0] + record[-1][2] - inizio_blocco)
+
+            sessione_aperta = None
+            for offset, sessione, lunghezza in record:
+                if sessione != sessione_aperta:
+                    if sessione_aperta is not None:
+                        parti.append(CHIUSURA_SESSIONE.encode('utf-8'))
+                    parti.append(tag_sessioni[sessione])
+                    sessione_aperta = sessione
+                parti.append(blocco[offset - inizio_blocco:offset - inizio_blocco + lunghezza])
+            parti.append(CHIUSURA_SESSIONE.encode('utf-8'))
+
+        parti.append(CHIUSURA_LOG.encode('utf-8'))
+    return b"".join(parti)
+
+def estrai_entry(log_filename, ultime=0, da=None, a=None, snapshot=None):
+    """
+    Estrae un sottoinsieme delle entry come documento XML completo, usando gli indici.
+    ultime=N: ultime N entry; da=K: dall'entry K (da 1) in poi; da=K, a=J: da K a J inclusi.
+    La numerazione attraversa tutti i segmenti del giorno; le entry scritte
+    dopo lo snapshot sono escluse
+    """
+    segmenti, dimensione, _ = snapshot or snapshot_log(log_filename)
+    conteggi = [_conta_segmento(segmento, dimensione if segmento == segmenti[-1] else None)
+                for segmento in segmenti]
+    totale = sum(conteggi)
+
+    if da is not None:
+        primo = max(da, 1) - 1
+        ultimo = totale if a is None else min(a, totale)
+    else:
+        primo = max(totale - ultime, 0) if ultime else 0
+        ultimo = totale
+
+    frammenti = []
+    precedenti = 0
+    for segmento, conteggio in zip(segmenti, conteggi):
+        da_qui, fino_qui = max(primo - precedenti, 0), min(ultimo - precedenti, conteggio)
+        if da_qui < fino_qui:
+            frammenti.append(_estrai_segmento(segmento, da_qui, fino_qui))
+        precedenti += conteggio
+    if not frammenti:
+        frammenti.append(_estrai_segmento(segmenti[-1], 0, 0))
+    return b"".join(_unisci_documenti([[frammento] for frammento in frammenti]))
+
+# --- VISTE TXT E CSV DEI LOG DEI CLIENT ---
+# Per i log dei client lo scrittore tiene aggiornate anche le versioni già
+# convertite di ogni segmento, "X.xml.txt" e "X.xml.csv" (senza l'intestazione
+# CSV e l'a capo finale del TXT, aggiunti in lettura). "X.xml.viste" registra
+# fin dove arrivano: offset nel log dopo l'ultimo elemento convertito e
+# dimensione delle due viste. Se restano indietro (crash, log scritto senza
+# viste) vengono riallineate convertendo solo la parte mancante, o rifatte da
+# zero se non sono coerenti. LOG ed EX txt/csv le inviano come semplici file.
+# Lo stato viene registrato anche durante la scrittura (VISTE_CHECKPOINT_BYTE),
+# così dopo un crash il riallineamento riparte dall'ultimo checkpoint
+
+VISTE_CLIENT = True             # False: TXT e CSV convertiti dall'XML a ogni richiesta
+VISTE_CHECKPOINT_BYTE = 1 << 20 # Ogni quanti byte di log registrare lo stato delle viste
+
+viste_aperte = {}               # {segmento: {"txt": file, "csv": file, "fine": offset nel log, "salvato": offset}}
+
+def _viste_attive(segmento):
+    """True se il segmento (o log) ha le viste TXT/CSV"""
+    return VISTE_CLIENT and os.path.basename(segmento).startswith("client_")
+
+def _leggi_stato_viste(segmento):
+    """(fine, dimensione txt, dimensione csv) registrati per le viste, o None"""
+    try:
+        with open(segmento + ".viste") as f:
+            fine, dimensione_txt, dimensione_csv = (int(valore) for valore in f.read().split())
+        return fine, dimensione_txt, dimensione_csv
+    except (OSError, ValueError):
+        return None
+
+def _salva_stato_viste(segmento, fine, dimensione_txt, dimensione_csv):
+    """Registra fin dove arrivano le viste (sostituzione atomica)"""
+    temporaneo = segmento + ".viste.tmp"
+    with open(temporaneo, "w") as f:
+        f.write(f"{fine} {dimensione_txt} {dimensione_csv}\n")
+    os.replace(temporaneo, segmento + ".viste")
+
+def _dimensione_file(percorso):
+    """Dimensione di un file; None se esiste solo compresso, -1 se non esiste"""
+    if os.path.exists(percorso):
+        return os.path.getsize(percorso)
+    return None if os.path.exists(percorso + ".gz") else -1
+
+def _rendi_viste(dati, txt_vuota, fine_file=True):
+    """
+    Converte le sessioni e le entry complete di un blocco di XML.
+    Restituisce (byte txt, byte csv, byte del blocco consumati)
+    """
+    txt, righe_csv = [], []
+    consumati = 0
+    for match in _pattern_elementi.finditer(dati):
+        if not fine_file and match.end() >= len(dati):
+            break
+        elemento = match.group()
+        if elemento.startswith(b"<session"):
+            if not elemento.endswith(b"/>"):
+                elemento += b"</session>"
+            attributi = ET.fromstring(elemento).attrib
+            if "continua" in attributi:
+                # Sessione del segmento precedente: niente nuova intestazione
+                consumati = match.end()
+                continue
+            if txt or not txt_vuota:
+                txt.append("\n")
+            txt.append(_intestazione_txt(attributi))
+        else:
+            dati_entry = _dati_entry(ET.fromstring(elemento))
+            txt.append(_riga_txt(dati_entry))
+            righe_csv.append(_riga_csv(dati_entry))
+        consumati = match.end()
+    return "".join(txt).encode('utf-8'), "".join(righe_csv).encode('utf-8'), consumati
+
+def _allinea_viste(segmento):
+    """
+    Porta le viste in pari con il segmento e restituisce
+    (fine, dimensione txt, dimensione csv) (da chiamare con lock_log)
+    """
+    stato = _leggi_stato_viste(segmento)
+    compresso = not os.path.exists(segmento)
+    dimensione_txt = _dimensione_file(segmento + ".txt")
+    dimensione_csv = _dimensione_file(segmento + ".csv")
+
+    # Un segmento compresso è chiuso: le sue viste erano complete alla chiusura
+    if compresso and stato is not None and dimensione_txt != -1 and dimensione_csv != -1:
+        return stato
+    if (stato is None or compresso or dimensione_txt is None or dimensione_csv is None
+            or dimensione_txt < stato[1] or dimensione_csv < stato[2]
+            or stato[0] > os.path.getsize(segmento)):
+        stato = (0, 0, 0)
+
+    fine, dimensione_txt, dimensione_csv = stato
+    with open(segmento + ".txt", "ab") as f_txt, open(segmento + ".csv", "ab") as f_csv, \
+            _apri_dati(segmento) as f_log:
+        # Quello che c'è oltre la dimensione registrata è stato scritto dopo l'ultima chiusura
+        f_txt.truncate(dimensione_txt)
+        f_csv.truncate(dimensione_csv)
+        f_log.seek(fine)
+        resto = b""
+        while True:
+            blocco = f_log.read(_BLOCCO_SCANSIONE)
+            dati = resto + blocco
+            txt, righe_csv, consumati = _rendi_viste(dati, dimensione_txt == 0, fine_file=not blocco)
+            f_txt.write(txt)
+            f_csv.write(righe_csv)
+            dimensione_txt += len(txt)
+            dimensione_csv += len(righe_csv)
+            fine += consumati
+            if not blocco:
+                break
+            resto = dati[consumati:]
+
+    _salva_stato_viste(segmento, fine, dimensione_txt, dimensione_csv)
+    return fine, dimensione_txt, dimensione_csv
+
+def _apri_viste(segmento):
+    """Riallinea e apre in append le viste di un segmento aperto in scrittura"""
+    try:
+        fine, _, _ = _allinea_viste(segmento)
+        viste_aperte[segmento] = {
+            "txt": open(segmento + ".txt", "ab"),
+            "csv": open(segmento + ".csv", "ab"),
+            "fine": fine,
+            "salvato": fine,
+        }
+    except Exception as e:
+        # Senza viste il log resta scrivibile: le richieste convertiranno dall'XML
+        console(f"Viste TXT/CSV non disponibili per {segmento}: {e}", "ERROR")
+
+def _aggiorna_viste(segmento, dati, offset):
+    """Aggiunge alle viste gli elementi appena scritti nel segmento"""
+    viste = viste_aperte.get(segmento)
+    if viste is None:
+        return
+    txt, righe_csv, consumati = _rendi_viste(dati, viste["txt"].tell() == 0)
+    if consumati:
+        # Il flush lo fa chi legge (sotto lo stesso lock), non ogni scrittura
+        viste["txt"].write(txt)
+        viste["csv"].write(righe_csv)
+        viste["fine"] = offset + consumati
+        if viste["fine"] - viste["salvato"] >= VISTE_CHECKPOINT_BYTE:
+            viste["txt"].flush()
+            viste["csv"].flush()
+            _salva_stato_viste(segmento, viste["fine"], viste["txt"].tell(), viste["csv"].tell())
+            viste["salvato"] = viste["fine"]
+
+def _chiudi_viste(segmento):
+    """Chiude le viste di un segmento registrando fin dove arrivano"""
+    viste = viste_aperte.pop(segmento, None)
+    if viste is None:
+        return
+    _salva_stato_viste(segmento, viste["fine"], viste["txt"].tell(), viste["csv"].tell())
+    viste["txt"].close()
+    viste["csv"].close()
+
+def _dimensione_vista(segmento, formato):
+    """Byte della vista di un segmento aggiornata a ora (da chiamare con lock_log)"""
+    viste = viste_aperte.get(segmento)
+    if viste is not None:
+        viste[formato].flush()
+        return viste[formato].tell()
+    _, dimensione_txt, dimensione_csv = _allinea_viste(segmento)
+    return dimensione_txt if formato == "txt" else dimensione_csv
+
+def prepara_vista(log_filename, formato):
+    """
+    (genera, dimensione) del log in TXT o CSV servito dalle viste: stessi byte
+    della conversione dell'XML, letti come file. ET.ParseError se una vista
+    da rifare incontra un'entry illeggibile
+    """
+    parti = []
+    for segmento in segmenti_log(log_filename):
+        with lock_log(segmento):
+            dimensione = _dimensione_vista(segmento, formato)
+        if dimensione:
+            parti.append((f"{segmento}.{formato}", dimensione))
+
+    # TXT: una riga vuota prima di ogni segmento che inizia con una sessione
+    # (non con le entry di una sessione proseguita) e alla fine; CSV: intestazione
+    if formato == "csv":
+        inizio, chiusura = INTESTAZIONE_CSV.encode('utf-8'), b""
+        separatori = [b""] * len(parti)
+    else:
+        inizio, chiusura = b"", b"\n" if parti else b""
+        separatori = [b"" if i == 0 or next(_leggi_segmento(percorso, 1)) == b"[" else b"\n"
+                      for i, (percorso, _) in enumerate(parti)]
+    dimensione = (len(inizio) + sum(d for _, d in parti)
+                  + sum(len(s) for s in separatori) + len(chiusura))
+
+    def genera():
+        if inizio:
+            yield inizio
+        for separatore, (percorso, dimensione_parte) in zip(separatori, parti):
+            if separatore:
+                yield separatore
+            yield from _leggi_segmento(percorso, dimensione_parte)
+        if chiusura:
+            yield chiusura
+    return genera, dimensione
+
+def chiudi_log(log_filename):
+    """Chiude sessione e radice del log e rilascia il file (rollover o shutdown)"""
+    # Ultime entry della sessione: ripetizioni ancora in sospeso, quante
+    # ne sono state scartate da livello e campionamento e le statistiche
+    scrivi_ripetute(log_filename, tutte=True)
+    _riepilogo_scartate(log_filename)
+    _riepilogo_statistiche(log_filename)
+    if scrittore_attivo():
+        # La chiusura passa dalla coda, dopo le entry ancora in attesa
+        _accoda((log_filename, None))
+        return
+    with lock_log(log_filename):
+        _backend.chiudi(log_filename)
+
+def chiudi_tutti_i_log():
+    """Chiude tutti i log aperti, da chiamare allo shutdown del server"""
+    for log_filename in _backend.aperti():
+        chiudi_log(log_filename)
+
+# --- RECUPERO ALL'AVVIO ---
+# Un crash può lasciare segmenti senza i tag finali o con un'entry scritta a
+# metà, e nessuno li riaprirebbe più se il giorno è passato: LOG ed EX
+# fallirebbero su quel giorno. Il recupero controlla solo la coda di ogni
+# segmento e ripara quelli danneggiati, con indice e viste riallineati dal
+# loro ultimo punto valido: il tempo dipende dalle code danneggiate
+
+def _log_chiuso(segmento):
+    """True se il segmento termina con </log>"""
+    with open(segmento, "rb") as f:
+        f.seek(max(0, f.seek(0, os.SEEK_END) - 64))
+        return f.read().rstrip().endswith(b"</log>")
+
+def _recupera_segmenti(cartella="logs"):
+    """
+    Ripara i segmenti lasciati aperti o troncati da un crash e rimuove i
+    file temporanei rimasti a metà. Restituisce i segmenti riparati
+    """
+    if not os.path.isdir(cartella):
+        return []
+    for temporaneo in glob.glob(os.path.join(cartella, "*.gz.tmp")) + \
+            glob.glob(os.path.join(cartella, "*.viste.tmp")) + \
+            glob.glob(os.path.join(cartella, "archivio_*.zip.tmp")):
+        os.remove(temporaneo)
+
+    riparati = []
+    for segmento in sorted(glob.glob(os.path.join(cartella, "*.xml"))):
+        with lock_log(segmento):
+            if segmento in file_aperti:
+                continue
+            try:
+                if os.path.exists(segmento + ".gz"):
+                    # Compressione interrotta dopo aver scritto il .gz completo
+                    os.remove(segmento)
+                    continue
+                if _log_chiuso(segmento):
+                    continue
+                _ripara_log(segmento, chiudi=True)
+                _allinea_indice(segmento)
+                if _viste_attive(segmento):
+                    _allinea_viste(segmento)
+                riparati.append(segmento)
+            except Exception as e:
+                console(f"Errore recupero log {segmento}: {e}", "ERROR")
+    return riparati
 
 def setup_xml_log():
-    """Configura il file XML di log"""
-    Path("logs").mkdir(exist_ok=True)
-    log_filename = f"logs/server_{datetime.now().strftime('%Y-%m-%d')}.xml"
+    """Configura il log del server (file XML con l'archivio predefinito)"""
+    data = datetime.now().strftime('%Y-%m-%d')
+    log_filename = f"logs/server_{data}.xml"
+    stato = {
+        "prefisso": "logs/server_",
+        "data": data,
+        "base": log_filename,
+        "attributi_log": {"server_name": socket.gethostname(), "date": data},
+        "attributi_sessione": {"start_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')},
+    }
     
-    if not os.path.exists(log_filename):
-        root = ET.Element("log")
-        root.set("server_name", socket.gethostname())
-        root.set("date", datetime.now().strftime('%Y-%m-%d'))
-        
-        session = ET.SubElement(root, "session")
-        session.set("start_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        
-        tree = ET.ElementTree(root)
-        ET.indent(tree, space="  ")
-        tree.write(log_filename, encoding='utf-8', xml_declaration=True)
+    with lock_log(log_filename):
+        # Riprende l'ultima sessione del giorno, o crea il log
+        _backend.apri(log_filename, stato, nuova_sessione=False)
+    _apri_statistiche(log_filename)
     
     return log_filename
 
 def setup_client_log(username, client_address):
     """
-    Configura il file XML di log per un client specifico
+    Configura il log di un client specifico
     Gestito dal SERVER, non dal client
     """
-    Path("logs").mkdir(exist_ok=True)
-    log_filename = f"logs/client_{username}_{datetime.now().strftime('%Y-%m-%d')}.xml"
+    data = datetime.now().strftime('%Y-%m-%d')
+    log_filename = f"logs/client_{username}_{data}.xml"
+    stato = {
+        "prefisso": f"logs/client_{username}_",
+        "data": data,
+        "base": log_filename,
+        "attributi_log": {
+            "client_username": username,
+            "client_address": f"{client_address[0]}:{client_address[1]}",
+            "date": data,
+        },
+        "attributi_sessione": {
+            "start_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "login_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        },
+    }
     
-    if not os.path.exists(log_filename):
-        root = ET.Element("log")
-        root.set("client_username", username)
-        root.set("client_address", f"{client_address[0]}:{client_address[1]}")
-        root.set("date", datetime.now().strftime('%Y-%m-%d'))
-        
-        session = ET.SubElement(root, "session")
-        session.set("start_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        session.set("login_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        
-        tree = ET.ElementTree(root)
-        ET.indent(tree, space="  ")
-        tree.write(log_filename, encoding='utf-8', xml_declaration=True)
-    else:
-        # Se esiste già, aggiungi una nuova sessione
-        with xml_lock:
-            tree = ET.parse(log_filename)
-            root = tree.getroot()
-            
-            session = ET.SubElement(root, "session")
-            session.set("start_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            session.set("login_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            
-            ET.indent(tree, space="  ")
-            tree.write(log_filename, encoding='utf-8', xml_declaration=True)
+    # Le operazioni ancora in coda per questo log (es. chiusura della sessione
+    # precedente) vanno scritte prima di aprire la nuova sessione
+    flush_log()
+    with lock_log(log_filename):
+        # Se esiste già, chiudi la sessione corrente e aggiungine una nuova in coda
+        _backend.apri(log_filename, stato, nuova_sessione=True)
+    _apri_statistiche(log_filename)
     
     return log_filename
 
+# --- ROTAZIONE DEI LOG ---
+# Ogni log è diviso in segmenti: "X_<data>.xml", poi "X_<data>.1.xml", "X_<data>.2.xml"...
+# Si passa a un nuovo segmento a mezzanotte (nuovo giorno) e quando quello attivo
+# supera ROTAZIONE_MAX_BYTE. I segmenti chiusi vengono compressi in ".xml.gz" in
+# background; l'indice resta "<segmento>.xml.idx" e gli offset si riferiscono ai
+# dati non compressi. Chi scrive continua a usare il nome restituito dal setup
+
+ROTAZIONE_MAX_BYTE = 50 * 1024 * 1024   # Dimensione massima di un segmento
+ROTAZIONE_GZIP = True                   # Comprime i segmenti chiusi
+
+# {log: {"prefisso", "data", "base", "attivo", "attributi_log", "attributi_sessione"}}
+_rotazione = {}
+
+def _percorso_segmento(base, numero):
+    """Nome del segmento numero N del log di un giorno (il primo è il file base)"""
+    return base if numero == 0 else f"{base[:-len('.xml')]}.{numero}.xml"
+
+def segmenti_log(base):
+    """Segmenti esistenti del log di un giorno in ordine, compressi o no (nomi .xml)"""
+    segmenti = []
+    while True:
+        segmento = _percorso_segmento(base, len(segmenti))
+        if not (os.path.exists(segmento) or os.path.exists(segmento + ".gz")):
+            return segmenti
+        segmenti.append(segmento)
+
+def giorno_del_log(log_filename):
+    """
+    File base del giorno su cui sta scrivendo un log (cambia dopo la
+    mezzanotte). Vale solo per chi scrive: le letture usano il file richiesto
+    """
+    stato = _rotazione.get(log_filename)
+    return stato["base"] if stato else log_filename
+
+def _segmento_di(log_filename):
+    """Segmento attivo di un log, senza controllare la rotazione"""
+    stato = _rotazione.get(log_filename)
+    return stato["attivo"] if stato else log_filename
+
+def _attiva_segmento(stato, nuova_sessione, continua=False):
+    """
+    Sceglie il segmento su cui scrivere per il giorno stato["base"]: riprende
+    l'ultimo se non è compresso né pieno, altrimenti ne crea uno nuovo
+    (da chiamare con il lock del log). continua=True: la sessione aperta
+    prosegue nel nuovo segmento (rotazione per dimensione), e il suo tag lo
+    dice con continua="1" perché le letture la mostrino come una sola
+    """
+    attributi = stato["attributi_sessione"]
+    if continua:
+        attributi = dict(attributi, continua="1")
+    segmenti = segmenti_log(stato["base"])
+    ultimo = segmenti[-1] if segmenti else None
+    if ultimo and os.path.exists(ultimo) and os.path.getsize(ultimo) < ROTAZIONE_MAX_BYTE:
+        with lock_log(ultimo):
+            if nuova_sessione:
+                _appendi(ultimo, CHIUSURA_SESSIONE + _apri_sessione(attributi))
+            else:
+                _file_log(ultimo)
+        stato["attivo"] = ultimo
+    else:
+        nuovo = _percorso_segmento(stato["base"], len(segmenti))
+        with lock_log(nuovo):
+            _crea_log(nuovo, stato["attributi_log"], attributi)
+        stato["attivo"] = nuovo
+
+def _nuovo_giorno(stato):
+    """Porta lo stato di un log al giorno corrente; True se è cambiato (mezzanotte)"""
+    oggi = datetime.now().strftime('%Y-%m-%d')
+    if stato["data"] == oggi:
+        return False
+    stato["data"] = oggi
+    stato["base"] = f"{stato['prefisso']}{oggi}.xml"
+    stato["attributi_log"]["date"] = oggi
+    # Il log del nuovo giorno inizia con una sessione che parte adesso
+    stato["attributi_sessione"] = dict(stato["attributi_sessione"],
+                                       start_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    return True
+
+def _segmento_attivo(log_filename):
+    """Segmento su cui scrivere, ruotando a mezzanotte o a dimensione massima (con lock_log)"""
+    stato = _rotazione.get(log_filename)
+    if stato is None:
+        return log_filename
+
+    f = file_aperti.get(stato["attivo"])
+    pieno = f is not None and f.tell() >= ROTAZIONE_MAX_BYTE
+    nuovo_giorno = _nuovo_giorno(stato)
+    if not nuovo_giorno and not pieno:
+        return stato["attivo"]
+
+    vecchio = stato["attivo"]
+    with lock_log(vecchio):
+        _chiudi_segmento(vecchio)
+    _attiva_segmento(stato, nuova_sessione=True, continua=not nuovo_giorno)
+
+    if ROTAZIONE_GZIP:
+        threading.Thread(target=_comprimi_segmento, args=(vecchio,), name="log-gzip", daemon=True).start()
+    return stato["attivo"]
+
+def _comprimi_file(percorso):
+    """Comprime un file in percorso.gz e rimuove l'originale"""
+    temporaneo = percorso + ".gz.tmp"
+    with open(percorso, "rb") as sorgente, gzip.open(temporaneo, "wb") as destinazione:
+        shutil.copyfileobj(sorgente, destinazione, DIMENSIONE_BLOCCO)
+    os.replace(temporaneo, percorso + ".gz")
+    os.remove(percorso)
+
+def _comprimi_segmento(segmento):
+    """Comprime un segmento chiuso (e le sue viste) in .gz e rimuove l'originale"""
+    try:
+        with lock_log(segmento):
+            if segmento in file_aperti or not os.path.exists(segmento):
+                return
+            _comprimi_file(segmento)
+            for vista in (segmento + ".txt", segmento + ".csv"):
+                if os.path.exists(vista):
+                    _comprimi_file(vista)
+    except Exception as e:
+        console(f"Errore compressione segmento {segmento}: {e}", "ERROR")
+
+def _apri_dati(segmento):
+    """
+    Apre in lettura i dati di un segmento, compresso o no (gli offset sono
+    gli stessi), o già spostato nell'archivio del mese
+    """
+    try:
+        return open(segmento, "rb")
+    except FileNotFoundError:
+        pass
+    try:
+        return gzip.open(segmento + ".gz", "rb")
+    except FileNotFoundError:
+        return _apri_archiviato(segmento)
+
+def _entry_xml(timestamp, level, log_type, message, extra=None):
+    """Serializza un'entry XML (extra: attributi aggiuntivi, es. count/first/last)"""
+    entry_attr = {
+        "timestamp": timestamp,
+        "level": level,
+        "type": log_type,
+    }
+    if extra:
+        entry_attr.update(extra)
+    return (f"    <entry{_attributi(entry_attr)}>\n"
+            f"      <message>{_testo(message)}</message>\n"
+            f"    </entry>\n")
+
+def _nuova_entry(level, log_type, message):
+    """
+    Entry (timestamp, level, type, message, extra) con il timestamp del momento
+    della chiamata, l'istante monotono in nanosecondi (ns) e la richiesta in corso (req)
+    """
+    extra = {"ns": time.monotonic_ns()}
+    richiesta = richiesta_corrente()
+    if richiesta:
+        extra["req"] = richiesta
+    return (datetime.now().strftime('%H:%M:%S'), level, log_type, message, extra)
+
+# --- ARCHIVIAZIONE MENSILE E CONSERVAZIONE ---
+# Ogni utente lascia in logs/ un file (più indice, viste, segmenti) per ogni
+# giorno, per sempre. Un job in background sposta i giorni più vecchi di
+# ARCHIVIA_DOPO_GIORNI in "logs/archivio_<AAAA-MM>.zip", un archivio per mese:
+# un membro compresso per segmento, con la directory centrale dello zip come
+# indice per leggerne uno senza estrarre gli altri (indici e viste non
+# servono più: LOG converte l'XML al volo). Oltre CONSERVA_GIORNI file e
+# membri vengono eliminati. L'archivio si aggiorna su una copia che poi lo
+# sostituisce, quindi un'interruzione non lo lascia mai a metà. I log
+# ".corrotto" messi da parte dal recupero non vengono toccati
+
+ARCHIVIA_DOPO_GIORNI = 30       # Giorni dopo cui un log va nell'archivio del mese (0 = mai)
+CONSERVA_GIORNI = 0             # Giorni dopo cui un log viene eliminato (0 = per sempre)
+MANUTENZIONE_INTERVALLO = 3600  # Secondi tra due passate del job
+
+# Nomi dei file di log di un giorno: segmenti, .gz, indici, viste...
+# (segmento: il file .xml a cui appartengono, e il suo lock_log)
+_pattern_file_giorno = re.compile(r"^(?P<segmento>(?P<nome>.+_(?P<giorno>\d{4}-\d{2}-\d{2}))(?:\.\d+)?\.xml)(?:\..+)?$")
+
+_indice_archivi = {}            # {archivio: ((mtime, dimensione), nomi dei membri)}
+_thread_manutenzione = None
+_stop_manutenzione = threading.Event()
+
+def _giorno_del_file(percorso):
+    """Data "AAAA-MM-GG" del giorno a cui appartiene un file di log, o None"""
+    corrispondenza = _pattern_file_giorno.match(os.path.basename(percorso))
+    return corrispondenza["giorno"] if corrispondenza else None
+
+def _archivio_del_giorno(percorso):
+    """Archivio mensile che contiene (o conterrà) un file di log, o None"""
+    giorno = _giorno_del_file(percorso)
+    if giorno is None:
+        return None
+    return os.path.join(os.path.dirname(percorso), f"archivio_{giorno[:7]}.zip")
+
+def _membri_archivio(archivio):
+    """Nomi dei membri di un archivio, dalla directory centrale letta una volta per versione"""
+    try:
+        stato = os.stat(archivio)
+    except FileNotFoundError:
+        return frozenset()
+    chiave = (stato.st_mtime_ns, stato.st_size)
+    voce = _indice_archivi.get(archivio)
+    if voce is None or voce[0] != chiave:
+        with zipfile.ZipFile(archivio) as zf:
+            voce = (chiave, frozenset(zf.namelist()))
+        _indice_archivi[archivio] = voce
+    return voce[1]
+
+def _segmenti_archiviati(base):
+    """Segmenti del log di un giorno presenti nell'archivio del mese, in ordine (nomi .xml)"""
+    archivio = _archivio_del_giorno(base)
+    membri = _membri_archivio(archivio) if archivio else frozenset()
+    segmenti = []
+    while True:
+        segmento = _percorso_segmento(base, len(segmenti))
+        if os.path.basename(segmento) not in membri:
+            return segmenti
+        segmenti.append(segmento)
+
+def _apri_archiviato(segmento):
+    """Apre in lettura un segmento dall'archivio del mese (FileNotFoundError se non c'è)"""
+    archivio = _archivio_del_giorno(segmento)
+    if archivio is None or not os.path.exists(archivio):
+        raise FileNotFoundError(f"Segmento {segmento} inesistente")
+    # Il membro resta leggibile anche dopo la chiusura dello ZipFile
+    with zipfile.ZipFile(archivio) as zf:
+        try:
+            return zf.open(os.path.basename(segmento))
+        except KeyError:
+            raise FileNotFoundError(f"Segmento {segmento} inesistente") from None
+
+def _sincronizza_file(percorso):
+    """fsync di un file già scritto"""
+    with open(percorso, "rb+") as f:
+        os.fsync(f.fileno())
+
+def _archivia_giorni(archivio, giorni):
+    """Aggiunge all'archivio i segmenti dei giorni [(base, file)], su una copia che poi lo sostituisce"""
+    temporaneo = archivio + ".tmp"
+    if os.path.exists(archivio):
+        shutil.copyfile(archivio, temporaneo)
+    elif os.path.exists(temporaneo):
+        os.remove(temporaneo)
+    with zipfile.ZipFile(temporaneo, "a", zipfile.ZIP_DEFLATED) as zf:
+        presenti = set(zf.namelist())
+        for base, _ in giorni:
+            for segmento in segmenti_log(base):
+                membro = os.path.basename(segmento)
+                if membro in presenti:
+                    # Già archiviato da una passata interrotta prima di eliminare i file
+                    continue
+                with _apri_dati(segmento) as sorgente, zf.open(membro, "w") as destinazione:
+                    shutil.copyfileobj(sorgente, destinazione, DIMENSIONE_BLOCCO)
+    _sincronizza_file(temporaneo)
+    os.replace(temporaneo, archivio)
+
+def _scadi_archivio(archivio, elimina_prima):
+    """Elimina da un archivio i membri dei giorni scaduti; restituisce quanti giorni"""
+    membri = _membri_archivio(archivio)
+    scaduti = {}                # {membro: nome del giorno}
+    for membro in membri:
+        corrispondenza = _pattern_file_giorno.match(membro)
+        if corrispondenza and corrispondenza["giorno"] < elimina_prima:
+            scaduti[membro] = corrispondenza["nome"]
+    if not scaduti:
+        return 0
+    giorni = len(set(scaduti.values()))
+    if len(scaduti) == len(membri):
+        os.remove(archivio)
+        return giorni
+
+    temporaneo = archivio + ".tmp"
+    with zipfile.ZipFile(archivio) as vecchio, \
+            zipfile.ZipFile(temporaneo, "w", zipfile.ZIP_DEFLATED) as nuovo:
+        for info in vecchio.infolist():
+            if info.filename in scaduti:
+                continue
+            with vecchio.open(info) as sorgente, nuovo.open(info.filename, "w") as destinazione:
+                shutil.copyfileobj(sorgente, destinazione, DIMENSIONE_BLOCCO)
+    _sincronizza_file(temporaneo)
+    os.replace(temporaneo, archivio)
+    return giorni
+
+def _conserva_file(cartella, archivia_prima, elimina_prima):
+    """
+    Sposta negli archivi mensili i giorni precedenti archivia_prima ed
+    elimina file e membri dei giorni precedenti elimina_prima (date
+    "AAAA-MM-GG" o None). I giorni con un log ancora aperto restano dove
+    sono. Restituisce (giorni archiviati, giorni eliminati)
+    """
+    if not os.path.isdir(cartella):
+        return 0, 0
+    gruppi = {}
+    for voce in os.scandir(cartella):
+        corrispondenza = _pattern_file_giorno.match(voce.name)
+        # I log illeggibili messi da parte (".corrotto") restano finché qualcuno
+        # non li guarda: né archiviati né eliminati
+        if corrispondenza and voce.is_file() and not voce.name.endswith(".corrotto"):
+            base = os.path.join(cartella, corrispondenza["nome"] + ".xml")
+            gruppi.setdefault(base, []).append(voce.path)
+    in_uso = {stato["base"] for stato in list(_rotazione.values())}
+
+    archiviati, eliminati = 0, 0
+    da_archiviare = {}
+    for base, percorsi in sorted(gruppi.items()):
+        giorno = _giorno_del_file(base)
+        if base in in_uso or any(percorso in file_aperti for percorso in percorsi):
+            continue
+        if elimina_prima and giorno < elimina_prima:
+            if _elimina_file_giorno(percorsi):
+                eliminati += 1
+        elif archivia_prima and giorno < archivia_prima:
+            da_archiviare.setdefault(_archivio_del_giorno(base), []).append((base, percorsi))
+
+    for archivio, giorni in sorted(da_archiviare.items()):
+        try:
+            _archivia_giorni(archivio, giorni)
+        except Exception as e:
+            console(f"Errore archiviazione log in {archivio}: {e}", "ERROR")
+            continue
+        # I file si eliminano solo quando l'archivio che li contiene è su disco
+        for base, percorsi in giorni:
+            if _elimina_file_giorno(percorsi):
+                archiviati += 1
+
+    if elimina_prima:
+        for archivio in sorted(glob.glob(os.path.join(cartella, "archivio_*.zip"))):
+            try:
+                eliminati += _scadi_archivio(archivio, elimina_prima)
+            except Exception as e:
+                console(f"Errore conservazione log in {archivio}: {e}", "ERROR")
+    return archiviati, eliminati
+
+def _elimina_file_giorno(percorsi):
+    """
+    Elimina i file di un giorno, ognuno con il lock_log del suo segmento (lo
+    stesso di chi lo scrive, comprime o legge). False se nel frattempo un
+    segmento è stato riaperto: i suoi file restano
+    """
+    segmenti = {}
+    for percorso in percorsi:
+        segmento = os.path.join(os.path.dirname(percorso),
+                                _pattern_file_giorno.match(os.path.basename(percorso))["segmento"])
+        segmenti.setdefault(segmento, []).append(percorso)
+    for segmento, file_segmento in sorted(segmenti.items()):
+        with lock_log(segmento):
+            if segmento in file_aperti:
+                return False
+            for percorso in file_segmento:
+                try:
+                    os.remove(percorso)
+                except FileNotFoundError:
+                    # Già compresso o rimosso: resta per la prossima passata
+                    pass
+    return True
+
+def _prepara_export_archiviato(segmenti, formato, ultime, intervallo, filtro):
+    """
+    Esportazione di un giorno archiviato: i segmenti si leggono dai membri
+    dell'archivio, senza indici né viste, con filtri e intervalli applicati
+    in un'unica passata
+    """
+    sorgente = lambda: _unisci_documenti([_leggi_segmento(segmento) for segmento in segmenti])
+    if intervallo is None and filtro is None and not ultime and formato == "xml":
+        return sorgente, None
+    if intervallo is not None:
+        # Come con gli indici: le entry numerate da 1, poi il filtro
+        scelta, ultime = (lambda: _filtro_intervallo(intervallo[0], intervallo[1], filtro)), 0
+    else:
+        scelta = lambda: filtro
+    genera = {"csv": genera_csv, "txt": genera_txt}.get(formato, genera_xml)
+    return (lambda: genera(sorgente(), scelta(), ultime)), None
+
+def _filtro_intervallo(da, a, filtro=None):
+    """Filtro che sceglie le entry da da ad a (numerate da 1, a None = fino alla fine) che soddisfano filtro"""
+    contatore = itertools.count(1)
+
+    def scelta(entry):
+        numero = next(contatore)
+        return da <= numero and (a is None or numero <= a) and (filtro is None or filtro(entry))
+    return scelta
+
+def esegui_manutenzione(oggi=None):
+    """
+    Una passata di archiviazione e conservazione dei log secondo
+    ARCHIVIA_DOPO_GIORNI e CONSERVA_GIORNI. Restituisce (giorni archiviati,
+    giorni eliminati)
+    """
+    oggi = oggi or datetime.now().date()
+    archivia_prima = (oggi - timedelta(days=ARCHIVIA_DOPO_GIORNI)).isoformat() if ARCHIVIA_DOPO_GIORNI else None
+    elimina_prima = (oggi - timedelta(days=CONSERVA_GIORNI)).isoformat() if CONSERVA_GIORNI else None
+    return _backend.conserva(archivia_prima, elimina_prima)
+
+def _ciclo_manutenzione(intervallo):
+    """Thread del job: una passata all'avvio e poi ogni intervallo secondi"""
+    while True:
+        try:
+            archiviati, eliminati = esegui_manutenzione()
+            if archiviati or eliminati:
+                console(f"Manutenzione log: {archiviati} giorni archiviati, {eliminati} eliminati")
+        except Exception as e:
+            console(f"Errore manutenzione log: {e}", "ERROR")
+        if _stop_manutenzione.wait(intervallo):
+            return
+
+def avvia_manutenzione(intervallo=None):
+    """Avvia il job di archiviazione e conservazione dei log in background"""
+    global _thread_manutenzione
+    if _thread_manutenzione is not None and _thread_manutenzione.is_alive():
+        return
+    _stop_manutenzione.clear()
+    _thread_manutenzione = threading.Thread(
+        target=_ciclo_manutenzione, args=(intervallo or MANUTENZIONE_INTERVALLO,),
+        name="log-manutenzione", daemon=True)
+    _thread_manutenzione.start()
+
+def ferma_manutenzione(timeout=10):
+    """Ferma il job di manutenzione (attende la fine della passata in corso)"""
+    global _thread_manutenzione
+    if _thread_manutenzione is None:
+        return
+    _stop_manutenzione.set()
+    _thread_manutenzione.join(timeout)
+    _thread_manutenzione = None
+
+# --- ID DELLE RICHIESTE ---
+# Ogni comando di un client riceve un ID, valido nel suo thread finché non
+# arriva il comando successivo: tutte le entry scritte nel frattempo, nel log
+# del client e in quello del server, lo riportano nell'attributo req.
+# Con gli attributi ns si ricostruisce la durata di ogni richiesta
+
+_richiesta = threading.local()
+_prefisso_richieste = f"{int(time.time()):x}"   # Distingue gli ID tra un avvio e l'altro
+_contatore_richieste = itertools.count(1)
+
+def nuova_richiesta():
+    """Assegna un nuovo ID di richiesta al thread corrente e lo restituisce"""
+    _richiesta.id = f"{_prefisso_richieste}-{next(_contatore_richieste)}"
+    return _richiesta.id
+
+def richiesta_corrente():
+    """ID della richiesta del thread corrente (None se non ce n'è una)"""
+    return getattr(_richiesta, "id", None)
+
+def fine_richiesta():
+    """Le entry successive del thread non appartengono più a nessuna richiesta"""
+    _richiesta.id = None
+
+# --- ECO A CONSOLE ---
+# Le righe per il terminale passano da una coda propria svuotata da un thread
+# dedicato: un terminale lento (pipe, SSH) non blocca mai i thread dei client
+# né le scritture del log. A coda piena o oltre il limite le righe si scartano
+
+CONSOLE_ATTIVA = True           # False per i server senza terminale
+CONSOLE_LIVELLO = "INFO"        # Livello minimo mostrato: "INFO" | "WARNING" | "ERROR"
+CONSOLE_CODA_MAX = 1000         # Righe in attesa di essere stampate
+CONSOLE_RIGHE_AL_SECONDO = 100  # Limite di stampa (0 = nessun limite)
+
+_LIVELLI = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+_TIPI_A_CONSOLE = ["CONNECTION", "ERROR", "DISCONNECTION", "AUTH", "REGISTRATION"]
+
+_coda_console = None
+_thread_console = None
+_console_lock = threading.Lock()
+
+statistiche_console = {"stampate": 0, "scartate": 0, "limitate": 0}
+
+def configura_console(attiva=None, livello=None, righe_al_secondo=None):
+    """Cambia a runtime le impostazioni dell'eco a console"""
+    global CONSOLE_ATTIVA, CONSOLE_LIVELLO, CONSOLE_RIGHE_AL_SECONDO
+    if attiva is not None:
+        CONSOLE_ATTIVA = attiva
+    if livello is not None:
+        CONSOLE_LIVELLO = livello.upper()
+    if righe_al_secondo is not None:
+        CONSOLE_RIGHE_AL_SECONDO = righe_al_secondo
+
+def _livello_a_console(level):
+    """True se il livello supera il filtro della console"""
+    return CONSOLE_ATTIVA and _LIVELLI.get(level, 20) >= _LIVELLI.get(CONSOLE_LIVELLO, 20)
+
+def console(testo, level="INFO"):
+    """Mette in coda una riga per il terminale senza mai bloccare il chiamante"""
+    global _coda_console, _thread_console
+    if not _livello_a_console(level):
+        return
+    with _console_lock:
+        if _thread_console is None:
+            _coda_console = queue.Queue(maxsize=CONSOLE_CODA_MAX)
+            _thread_console = threading.Thread(target=_ciclo_console, args=(_coda_console,),
+                                               name="console", daemon=True)
+            _thread_console.start()
+        try:
+            _coda_console.put_nowait(testo)
+        except queue.Full:
+            statistiche_console["scartate"] += 1
+
+def _ciclo_console(coda):
+    """Thread della console: stampa le righe rispettando CONSOLE_RIGHE_AL_SECONDO"""
+    disponibili, ultimo = float(CONSOLE_RIGHE_AL_SECONDO), time.monotonic()
+    saltate = 0
+    while True:
+        try:
+            testo = coda.get(timeout=1.0)
+        except queue.Empty:
+            testo = ""
+        if testo is None:
+            if saltate:
+                print(f"{Colori.GRIGIO}... {saltate} righe non mostrate (limite console){Colori.RESET}")
+            break
+
+        if testo and CONSOLE_RIGHE_AL_SECONDO:
+            adesso = time.monotonic()
+            disponibili = min(float(CONSOLE_RIGHE_AL_SECONDO),
+                              disponibili + (adesso - ultimo) * CONSOLE_RIGHE_AL_SECONDO)
+            ultimo = adesso
+            if disponibili < 1:
+                saltate += 1
+                statistiche_console["limitate"] += 1
+                continue
+            disponibili -= 1
+
+        try:
+            if saltate:
+                print(f"{Colori.GRIGIO}... {saltate} righe non mostrate (limite console){Colori.RESET}")
+                saltate = 0
+            if testo:
+                print(testo)
+                statistiche_console["stampate"] += 1
+        except Exception:
+            pass
+
+def ferma_console(timeout=5):
+    """Stampa le righe ancora in coda e ferma il thread della console"""
+    global _thread_console
+    with _console_lock:
+        thread, coda = _thread_console, _coda_console
+        _thread_console = None
+    if thread is None:
+        return
+    try:
+        coda.put(None, timeout=timeout)
+    except queue.Full:
+        return
+    thread.join(timeout)
+
+def _stampa_console(level, log_type, message):
+    """Eco a console delle entry più importanti"""
+    # Filtri prima di formattare: le entry scartate non costano nulla
+    if log_type not in _TIPI_A_CONSOLE or not _livello_a_console(level):
+        return
+
+    if level == "INFO":
+        level_colored = Colori.VERDE + level + Colori.RESET
+    elif level == "WARNING":
+        level_colored = Colori.GIALLO + level + Colori.RESET
+    elif level == "ERROR":
+        level_colored = Colori.ROSSO + level + Colori.RESET
+    else:
+        level_colored = level
+        
+    console(f"[{datetime.now().strftime('%H:%M:%S')}] [{level_colored}] {message}", level)
+
+# --- LIVELLO MINIMO E CAMPIONAMENTO ---
+# Le entry sotto LOG_LIVELLO o escluse dal campionamento per tipo vengono
+# scartate prima di qualunque formattazione. Quante ne sono state scartate
+# viene registrato in un'entry LOG_SUMMARY alla chiusura della sessione
+
+LOG_LIVELLO = "INFO"            # Livello minimo registrato: "DEBUG" | "INFO" | "WARNING" | "ERROR"
+LOG_CAMPIONAMENTO = {}          # {tipo: N}: registra 1 entry ogni N, es. {"RESPONSE": 100}
+
+_soglia_livello = _LIVELLI[LOG_LIVELLO]
+_contatori_campionamento = {}   # {(log, tipo): entry viste}
+_scartate = {}                  # {log: {tipo: entry scartate nella sessione}}
+_campionamento_lock = threading.Lock()
+
+def configura_log(livello=None, campionamento=None):
+    """Cambia a runtime il livello minimo e/o il campionamento per tipo ({tipo: N})"""
+    global LOG_LIVELLO, LOG_CAMPIONAMENTO, _soglia_livello
+    if livello is not None:
+        _soglia_livello = _LIVELLI[livello.upper()]
+        LOG_LIVELLO = livello.upper()
+    if campionamento is not None:
+        LOG_CAMPIONAMENTO = {tipo.upper(): n for tipo, n in campionamento.items()}
+        with _campionamento_lock:
+            _contatori_campionamento.clear()
+
+def _da_registrare(log_filename, level, log_type):
+    """True se l'entry va scritta; altrimenti la conta tra le scartate della sessione"""
+    ogni = LOG_CAMPIONAMENTO.get(log_type)
+    sotto_soglia = _LIVELLI.get(level, 20) < _soglia_livello
+    if not sotto_soglia and not (ogni and ogni > 1):
+        return True
+
+    with _campionamento_lock:
+        if not sotto_soglia:
+            chiave = (log_filename, log_type)
+            viste = _contatori_campionamento.get(chiave, 0)
+            _contatori_campionamento[chiave] = viste + 1
+            # La prima di ogni gruppo di N viene tenuta
+            if viste % ogni == 0:
+                return True
+        scartate = _scartate.setdefault(log_filename, {})
+        scartate[log_type] = scartate.get(log_type, 0) + 1
+    return False
+
+def _riepilogo_scartate(log_filename):
+    """Registra quante entry sono state scartate nella sessione e azzera i contatori"""
+    with _campionamento_lock:
+        scartate = _scartate.pop(log_filename, None)
+        for chiave in [chiave for chiave in _contatori_campionamento if chiave[0] == log_filename]:
+            del _contatori_campionamento[chiave]
+    if scartate:
+        dettaglio = ", ".join(f"{tipo}: {n}" for tipo, n in sorted(scartate.items()))
+        messaggio = f"Entry non registrate nella sessione ({sum(scartate.values())}): {dettaglio}"
+        _scrivi_entry(log_filename, _nuova_entry("INFO", "LOG_SUMMARY", messaggio),
+                      "INFO", "LOG_SUMMARY", messaggio)
+
 def log_to_xml(log_filename, level, log_type, message):
-    """Scrive un'entry nel file XML di log in modo thread-safe"""
-    with xml_lock:
+    """Scrive un'entry nel file XML di log in modo thread-safe (solo append)"""
+    # Prima di formattare: un'entry scartata costa solo un paio di confronti
+    if not _da_registrare(log_filename, level, log_type):
+        return
+    _registra(log_filename, level, log_type, message)
+
+def _registra(log_filename, level, log_type, message):
+    """Formatta e scrive un'entry, compattando le ripetizioni"""
+    riepilogo, ripetuta = _ripetizione(log_filename, level, log_type, message)
+    if riepilogo:
+        _scrivi_riepilogo(*riepilogo)
+    if not ripetuta:
+        _scrivi_entry(log_filename, _nuova_entry(level, log_type, message),
+                      level, log_type, message)
+    _controlla_ripetute()
+
+def _scrivi_entry(log_filename, entry, level, log_type, message):
+    """Passa un'entry all'archivio (o la accoda in modalità asincrona)"""
+    _conta_entry(log_filename, level, log_type)
+    if scrittore_attivo():
+        # Modalità asincrona: il chiamante non aspetta il disco
+        _accoda((log_filename, entry))
+        _stampa_console(level, log_type, message)
+        return
+
+    with lock_log(log_filename):
+        try:
+            _conta_byte(log_filename, _backend.scrivi(log_filename, [entry]))
+            _stampa_console(level, log_type, message)
+        except Exception as e:
+            console(f"Errore scrittura log: {e}", "ERROR")
+
+# --- STATISTICHE DI SESSIONE ---
+# Per ogni sessione aperta (log del server o di un client) contatori in
+# memoria aggiornati a ogni entry: entry per livello e per tipo, byte scritti
+# dall'archivio e comandi serviti. Si leggono in ogni momento con
+# statistiche_sessione() e alla chiusura diventano un'unica entry
+# SESSION_STATS, senza rileggere il log
+
+_statistiche = {}               # {log: {"inizio", "entry", "byte", "livelli", "tipi", "comandi"}}
+_statistiche_lock = threading.Lock()
+
+def _apri_statistiche(log_filename):
+    """Azzera i contatori all'apertura di una sessione"""
+    with _statistiche_lock:
+        _statistiche[log_filename] = {"inizio": time.monotonic(), "entry": 0, "byte": 0,
+                                      "livelli": {}, "tipi": {}, "comandi": {}}
+
+def _conta_entry(log_filename, level, log_type):
+    """Conta un'entry registrata nella sessione del log"""
+    with _statistiche_lock:
+        statistiche = _statistiche.get(log_filename)
+        if statistiche is not None:
+            statistiche["entry"] += 1
+            statistiche["livelli"][level] = statistiche["livelli"].get(level, 0) + 1
+            statistiche["tipi"][log_type] = statistiche["tipi"].get(log_type, 0) + 1
+
+def _conta_byte(log_filename, byte):
+    """Aggiunge i byte scritti dall'archivio per la sessione del log"""
+    with _statistiche_lock:
+        statistiche = _statistiche.get(log_filename)
+        if statistiche is not None:
+            statistiche["byte"] += byte or 0
+
+def conta_comando(log_filename, comando):
+    """Conta un comando servito nella sessione del log"""
+    with _statistiche_lock:
+        statistiche = _statistiche.get(log_filename)
+        if statistiche is not None:
+            statistiche["comandi"][comando] = statistiche["comandi"].get(comando, 0) + 1
+
+def statistiche_sessione(log_filename):
+    """Copia dei contatori della sessione aperta del log, con la durata in secondi; None se non è aperta"""
+    with _statistiche_lock:
+        statistiche = _statistiche.get(log_filename)
+        if statistiche is None:
+            return None
+        copia = {chiave: dict(valore) if isinstance(valore, dict) else valore
+                 for chiave, valore in statistiche.items()}
+    copia["durata"] = time.monotonic() - copia.pop("inizio")
+    return copia
+
+def formatta_statistiche(statistiche):
+    """Riepilogo su una riga dei contatori restituiti da statistiche_sessione"""
+    def elenco(conteggi):
+        return " ".join(f"{nome}={n}" for nome, n in sorted(conteggi.items())) or "-"
+    minuti, secondi = divmod(int(statistiche["durata"]), 60)
+    return (f"{statistiche['entry']} entry, {statistiche['byte']} byte, "
+            f"{sum(statistiche['comandi'].values())} comandi, durata {minuti // 60}:{minuti % 60:02d}:{secondi:02d}"
+            f" | livelli: {elenco(statistiche['livelli'])} | tipi: {elenco(statistiche['tipi'])}"
+            f" | comandi: {elenco(statistiche['comandi'])}")
+
+def _riepilogo_statistiche(log_filename):
+    """Registra le statistiche della sessione che si chiude in un'entry SESSION_STATS"""
+    if log_filename not in _statistiche:
+        return
+    if scrittore_attivo():
+        # I byte delle entry in coda si contano quando lo scrittore le scrive
+        flush_log()
+    statistiche = statistiche_sessione(log_filename)
+    with _statistiche_lock:
+        _statistiche.pop(log_filename, None)
+    if statistiche is not None:
+        messaggio = f"Statistiche sessione: {formatta_statistiche(statistiche)}"
+        _scrivi_entry(log_filename, _nuova_entry("INFO", "SESSION_STATS", messaggio),
+                      "INFO", "SESSION_STATS", messaggio)
+
+# --- COMPATTAZIONE DELLE RIPETIZIONI ---
+# Un'entry identica (level, type, message) a una già scritta nello stesso log
+# per la stessa richiesta (req) da meno di LOG_DEDUP_SECONDI non viene
+# scritta: si conta. Le entry di comandi diversi restano distinte, ognuna con
+# il suo req. Alla scadenza
+# della finestra (o alla chiusura della sessione) le ripetizioni diventano una
+# sola entry con gli attributi count, first e last. La prima occorrenza è
+# sempre scritta subito, quindi la somma dei count (1 se assente) dà il totale
+
+LOG_DEDUP_SECONDI = 10          # Finestra di compattazione (0 = disattivata)
+
+_ripetute = {}                  # {log: {(level, type, message, req): [inizio, ripetizioni, first, last, ns di last]}}
+_ripetute_lock = threading.Lock()
+_ultimo_controllo_ripetute = 0.0
+
+def _ripetizione(log_filename, level, log_type, message):
+    """
+    Registra l'entry nella finestra del log. Restituisce (riepilogo, ripetuta):
+    ripetuta=True se l'entry va solo contata, riepilogo è quello di una
+    finestra scaduta della stessa entry da scrivere prima di lei (o None)
+    """
+    if not LOG_DEDUP_SECONDI:
+        return None, False
+    chiave = (level, log_type, message, richiesta_corrente())
+    adesso = time.monotonic()
+    ora = datetime.now().strftime('%H:%M:%S')
+    ora_ns = time.monotonic_ns()
+    with _ripetute_lock:
+        finestra = _ripetute.setdefault(log_filename, {})
+        corrente = finestra.get(chiave)
+        if corrente is not None and adesso - corrente[0] <= LOG_DEDUP_SECONDI:
+            corrente[1] += 1
+            if corrente[1] == 1:
+                corrente[2] = ora
+            corrente[3] = ora
+            corrente[4] = ora_ns
+            return None, True
+        finestra[chiave] = [adesso, 0, None, None, None]
+    if corrente is not None and corrente[1]:
+        return (log_filename, chiave, corrente), False
+    return None, False
+
+def _estrai_ripetute(log_filename=None, tutte=False):
+    """Toglie dalle finestre quelle scadute (o tutte) del log indicato o di tutti i log"""
+    adesso = time.monotonic()
+    riepiloghi = []
+    with _ripetute_lock:
+        for log in ([log_filename] if log_filename else list(_ripetute)):
+            finestra = _ripetute.get(log, {})
+            for chiave, corrente in list(finestra.items()):
+                if tutte or adesso - corrente[0] > LOG_DEDUP_SECONDI:
+                    del finestra[chiave]
+                    if corrente[1]:
+                        riepiloghi.append((log, chiave, corrente))
+            if not finestra:
+                _ripetute.pop(log, None)
+    return riepiloghi
+
+def _scrivi_riepilogo(log_filename, chiave, corrente):
+    """Scrive l'entry che riassume le ripetizioni di una finestra"""
+    level, log_type, message, richiesta = chiave
+    _, ripetizioni, first, last, last_ns = corrente
+    extra = {"ns": last_ns}
+    if richiesta:
+        extra["req"] = richiesta
+    extra.update(count=ripetizioni, first=first, last=last)
+    _scrivi_entry(log_filename, (last, level, log_type, message, extra),
+                  level, log_type, f"{message} (ripetuta {ripetizioni} volte)")
+
+def _controlla_ripetute():
+    """Al più una volta al secondo scrive i riepiloghi delle finestre scadute"""
+    global _ultimo_controllo_ripetute
+    adesso = time.monotonic()
+    if not _ripetute or adesso - _ultimo_controllo_ripetute < 1.0:
+        return
+    _ultimo_controllo_ripetute = adesso
+    for riepilogo in _estrai_ripetute():
+        _scrivi_riepilogo(*riepilogo)
+
+def scrivi_ripetute(log_filename=None, tutte=False):
+    """Scrive subito i riepiloghi in sospeso (tutte=True anche delle finestre ancora aperte)"""
+    for riepilogo in _estrai_ripetute(log_filename, tutte):
+        _scrivi_riepilogo(*riepilogo)
+
+# --- SCRITTURA ASINCRONA A BATCH ---
+# I chiamanti mettono le entry in una coda limitata, un thread dedicato
+# le scrive a blocchi raggruppandole per file
+
+LOG_ASINCRONO = False           # Attiva la modalità asincrona all'avvio del server
+LOG_CODA_MAX = 10000            # Numero massimo di entry in attesa
+LOG_BATCH_MAX = 500             # Oltre questa soglia il thread viene svegliato subito
+LOG_FLUSH_INTERVALLO = 0.5      # Secondi massimi prima che un'entry finisca su disco
+LOG_FSYNC = "mai"               # "mai" | "batch" (fsync a ogni batch) | "periodico"
+LOG_FSYNC_INTERVALLO = 5.0      # Secondi tra due fsync in modalità "periodico"
+LOG_OVERFLOW = "block"          # Coda piena: "block" | "drop" | "spill" (su file)
+LOG_SPILL_FILE = "logs/.spill_log.jsonl"
+
+_coda_log = None
+_thread_scrittore = None
+_evento_flush = threading.Event()
+_stop_scrittore = False
+_config_scrittore = {}
+
+# Overflow "spill": finché il file di spill non è svuotato anche le nuove
+# entry finiscono lì, così l'ordine di scrittura resta quello di arrivo.
+# Il file resta aperto per tutto l'overflow e va su disco una volta per batch
+_spill_lock = threading.Lock()
+_spill = None                   # File di spill aperto (None: nessun overflow in corso)
+
+# Log scritti dall'ultima sincronizzazione (politiche "batch" e "periodico")
+_file_da_sincronizzare = set()
+
+# Contatori dello scrittore asincrono
+statistiche_scrittore = {"scritte": 0, "batch": 0, "scartate": 0, "spill": 0}
+
+def scrittore_attivo():
+    """True se la modalità asincrona è attiva"""
+    return _thread_scrittore is not None
+
+def _accoda(elemento):
+    """
+    Mette un elemento in coda applicando la politica di overflow.
+    Elementi: (log, entry) da scrivere, (log, None) per chiudere il log,
+    (None, Event) come marcatore di flush
+    """
+    overflow = _config_scrittore.get("overflow", LOG_OVERFLOW)
+
+    if overflow == "spill" and elemento[0] is not None:
+        with _spill_lock:
+            if _spill is not None:
+                _scrivi_spill(elemento)
+                return
+            try:
+                _coda_log.put_nowait(elemento)
+            except queue.Full:
+                _scrivi_spill(elemento)
+                _evento_flush.set()
+                return
+    elif overflow == "drop" and elemento[0] is not None and elemento[1] is not None:
+        try:
+            _coda_log.put_nowait(elemento)
+        except queue.Full:
+            statistiche_scrittore["scartate"] += 1
+            return
+    else:
+        _coda_log.put(elemento)
+
+    if _coda_log.qsize() >= _config_scrittore.get("batch_max", LOG_BATCH_MAX):
+        _evento_flush.set()
+
+def _scrivi_spill(elemento):
+    """
+    Aggiunge al file di spill un'entry che non entra in coda (da chiamare con
+    _spill_lock); la prima dell'overflow apre il file, che resta aperto
+    """
+    global _spill
+    if _spill is None:
+        _spill = open(_config_scrittore["spill_file"], "a", encoding="utf-8")
+    _spill.write(json.dumps(elemento) + "\n")
+    statistiche_scrittore["spill"] += 1
+
+def _leggi_spill():
+    """Recupera e svuota il file di spill, riattivando la coda"""
+    global _spill
+    with _spill_lock:
+        if _spill is None:
+            return []
+        # Unico flush dell'overflow: le entry fin qui erano nel buffer del file
+        _spill.close()
+        _spill = None
+        spill_file = _config_scrittore["spill_file"]
+        with open(spill_file, "r", encoding="utf-8") as f:
+            # JSON restituisce liste: le entry tornano tuple, le chiusure restano None
+            elementi = [(log_filename, tuple(entry) if entry is not None else None)
+                        for log_filename, entry in (json.loads(riga) for riga in f if riga.strip())]
+        os.remove(spill_file)
+    return elementi
+
+def _scrivi_batch(elementi, ultimo_fsync):
+    """
+    Scrive un batch raggruppando le entry per log: una scrittura (e al più
+    una sincronizzazione) per log, ognuna sotto il lock del proprio log.
+    Restituisce l'istante dell'ultima sincronizzazione e i marcatori di flush
+    """
+    operazioni = {}              # {log: [entry | None (chiusura), ...]} in ordine
+    marcatori = []
+    for log_filename, dato in elementi:
+        if log_filename is None:
+            marcatori.append(dato)
+        else:
+            operazioni.setdefault(log_filename, []).append(dato)
+
+    politica = _config_scrittore.get("fsync", LOG_FSYNC)
+    for log_filename, dati in operazioni.items():
+        try:
+            with lock_log(log_filename):
+                entries = []
+                for dato in dati:
+                    if dato is not None:
+                        entries.append(dato)
+                        continue
+                    # Chiusura: prima le entry in attesa per quel log
+                    if entries:
+                        _conta_byte(log_filename, _backend.scrivi(log_filename, entries))
+                        entries = []
+                    _backend.chiudi(log_filename)
+                if entries:
+                    _conta_byte(log_filename, _backend.scrivi(log_filename, entries))
+                    if politica != "mai":
+                        _file_da_sincronizzare.add(log_filename)
+                statistiche_scrittore["scritte"] += sum(1 for dato in dati if dato is not None)
+        except Exception as e:
+            console(f"Errore scrittura log: {e}", "ERROR")
+
+    adesso = time.monotonic()
+    if politica == "batch" or (
+        politica == "periodico"
+        and adesso - ultimo_fsync >= _config_scrittore.get("fsync_intervallo", LOG_FSYNC_INTERVALLO)
+    ):
+        _backend.sincronizza(list(_file_da_sincronizzare))
+        _file_da_sincronizzare.clear()
+        ultimo_fsync = adesso
+
+    statistiche_scrittore["batch"] += 1
+    return ultimo_fsync, marcatori
+
+def _ciclo_scrittore():
+    """Thread scrittore: si sveglia a intervalli (o su richiesta) e svuota la coda"""
+    ultimo_fsync = time.monotonic()
+    while True:
+        _evento_flush.wait(_config_scrittore.get("flush_intervallo", LOG_FLUSH_INTERVALLO))
+        _evento_flush.clear()
+        fermarsi = _stop_scrittore
+
+        elementi = []
+        while True:
+            try:
+                elementi.append(_coda_log.get_nowait())
+            except queue.Empty:
+                break
+        # Le entry finite nello spill sono successive a quelle in coda
+        elementi.extend(_leggi_spill())
+
+        if elementi:
+            try:
+                ultimo_fsync, marcatori = _scrivi_batch(elementi, ultimo_fsync)
+            except Exception as e:
+                console(f"Errore scrittura log: {e}", "ERROR")
+                marcatori = [dato for file, dato in elementi if file is None]
+            for evento in marcatori:
+                evento.set()
+
+        if fermarsi and _coda_log.empty() and _spill is None:
+            break
+
+def avvia_scrittore_asincrono(flush_intervallo=None, fsync=None, overflow=None,
+                              dimensione_coda=None, batch_max=None, spill_file=None):
+    """Attiva la modalità asincrona: da qui log_to_xml mette solo in coda"""
+    global _coda_log, _thread_scrittore, _stop_scrittore, _config_scrittore
+    if scrittore_attivo():
+        return
+
+    _config_scrittore = {
+        "flush_intervallo": flush_intervallo if flush_intervallo is not None else LOG_FLUSH_INTERVALLO,
+        "fsync": fsync or LOG_FSYNC,
+        "fsync_intervallo": LOG_FSYNC_INTERVALLO,
+        "overflow": overflow or LOG_OVERFLOW,
+        "batch_max": batch_max or LOG_BATCH_MAX,
+        "spill_file": spill_file or LOG_SPILL_FILE,
+    }
+    if _config_scrittore["overflow"] not in ("block", "drop", "spill"):
+        raise ValueError(f"Politica di overflow non valida: {_config_scrittore['overflow']}")
+    if _config_scrittore["fsync"] not in ("mai", "batch", "periodico"):
+        raise ValueError(f"Politica di fsync non valida: {_config_scrittore['fsync']}")
+
+    if _config_scrittore["overflow"] == "spill":
+        # Con gli archivi senza file la cartella dei log potrebbe non esistere
+        spill_file = _config_scrittore["spill_file"]
+        Path(os.path.dirname(spill_file) or ".").mkdir(exist_ok=True)
+        if os.path.exists(spill_file):
+            # Lasciato da un processo interrotto: le sue entry (di sessioni ormai
+            # chiuse, forse con l'ultima riga a metà) non vanno mescolate alle nuove
+            orfano = f"{spill_file}.{datetime.now():%Y%m%d-%H%M%S}.orfano"
+            os.replace(spill_file, orfano)
+            console(f"Spill di un'esecuzione interrotta spostato in {orfano}", "WARNING")
+    _coda_log = queue.Queue(maxsize=dimensione_coda or LOG_CODA_MAX)
+    _stop_scrittore = False
+    _thread_scrittore = threading.Thread(target=_ciclo_scrittore, name="log-writer", daemon=True)
+    _thread_scrittore.start()
+
+def richiedi_flush():
+    """Sveglia lo scrittore senza attendere (sicuro anche da un signal handler)"""
+    _evento_flush.set()
+
+def flush_log(timeout=None):
+    """Attende che le entry accodate fin qui siano su disco"""
+    # Anche i riepiloghi delle ripetizioni con la finestra già chiusa
+    scrivi_ripetute()
+    if not scrittore_attivo():
+        return True
+    evento = threading.Event()
+    _coda_log.put((None, evento))
+    _evento_flush.set()
+    return evento.wait(timeout)
+
+def ferma_scrittore_asincrono(timeout=10):
+    """Svuota la coda, ferma il thread scrittore e torna alla scrittura sincrona"""
+    global _thread_scrittore, _stop_scrittore
+    if not scrittore_attivo():
+        return
+    _stop_scrittore = True
+    _evento_flush.set()
+    _thread_scrittore.join(timeout)
+    _thread_scrittore = None
+
+    # Entry accodate da thread che hanno visto lo scrittore ancora attivo
+    elementi = []
+    while True:
+        try:
+            elementi.append(_coda_log.get_nowait())
+        except queue.Empty:
+            break
+    elementi.extend(_leggi_spill())
+    if elementi:
+        _, marcatori = _scrivi_batch(elementi, time.monotonic())
+        for evento in marcatori:
+            evento.set()
+
+# --- CONVERSIONE IN STREAMING ---
+# I convertitori leggono il log a blocchi con un parser incrementale
+# (lo stesso di ET.iterparse), liberano ogni entry appena convertita e
+# producono blocchi di byte già codificati: memoria limitata qualunque sia
+# la dimensione del log e nessun file temporaneo
+
+DIMENSIONE_BLOCCO = 64 * 1024
+
+def snapshot_log(log_filename):
+    """
+    Fissa sotto lock la parte di log da leggere: (segmenti del giorno, byte
+    scritti finora nell'ultimo, coda di chiusura da aggiungere se è ancora
+    aperto). Due letture dello stesso snapshot producono gli stessi byte
+    """
+    segmenti = segmenti_log(log_filename)
+    if not segmenti:
+        raise FileNotFoundError(f"Nessun segmento per il log {log_filename}")
+    ultimo = segmenti[-1]
+    with lock_log(ultimo):
+        if os.path.exists(ultimo):
+            dimensione = os.path.getsize(ultimo)
+            chiuso = _log_chiuso(ultimo)
+        else:
+            # Già compresso, quindi chiuso
+            dimensione, chiuso = None, True
+    coda = b"" if chiuso else (CHIUSURA_SESSIONE + CHIUSURA_LOG).encode('utf-8')
+    return tuple(segmenti), dimensione, coda
+
+def _leggi_segmento(segmento, dimensione=None):
+    """Blocchi di byte di un segmento (compresso o no), al più dimensione byte"""
+    with _apri_dati(segmento) as f:
+        mancanti = dimensione
+        while mancanti is None or mancanti > 0:
+            blocco = f.read(DIMENSIONE_BLOCCO if mancanti is None else min(DIMENSIONE_BLOCCO, mancanti))
+            if not blocco:
+                break
+            if mancanti is not None:
+                mancanti -= len(blocco)
+            yield blocco
+
+def _senza_intestazione(blocchi):
+    """Toglie dichiarazione XML e tag <log ...> iniziali da un documento a blocchi"""
+    buffer = b""
+    for blocco in blocchi:
+        if buffer is None:
+            yield blocco
+            continue
+        buffer += blocco
+        inizio = buffer.find(b"<log")
+        fine = buffer.find(b">", inizio) if inizio != -1 else -1
+        if fine != -1:
+            resto = buffer[fine + 1:].lstrip(b"\r\n")
+            buffer = None
+            if resto:
+                yield resto
+
+def _senza_chiusura_log(blocchi):
+    """Toglie il tag </log> finale da un documento a blocchi"""
+    trattenuti = b""
+    for blocco in blocchi:
+        dati = trattenuti + blocco
+        trattenuti = dati[-64:]
+        if dati[:-64]:
+            yield dati[:-64]
+    fine = trattenuti.rfind(b"</log>")
+    yield trattenuti[:fine] if fine != -1 else trattenuti
+
+def _unisci_documenti(documenti):
+    """
+    Unisce più documenti di log (ognuno fornito a blocchi) in un unico XML:
+    intestazione del primo, sessioni di tutti, chiusura dell'ultimo
+    """
+    for i, blocchi in enumerate(documenti):
+        if i > 0:
+            blocchi = _senza_intestazione(blocchi)
+        if i < len(documenti) - 1:
+            blocchi = _senza_chiusura_log(blocchi)
+        yield from blocchi
+
+def blocchi_log(log_filename, snapshot=None):
+    """Legge il log a blocchi fino allo snapshot, unendo i segmenti del giorno e chiudendo i tag se serve"""
+    segmenti, dimensione, coda = snapshot or snapshot_log(log_filename)
+    documenti = [_leggi_segmento(segmento) for segmento in segmenti[:-1]]
+    documenti.append(itertools.chain(_leggi_segmento(segmenti[-1], dimensione), [coda]))
+    return _unisci_documenti(documenti)
+
+def _eventi_log(blocchi):
+    """
+    Scorre sessioni ed entry di un XML fornito a blocchi.
+    Produce ("log", attributi) per la radice, ("session", attributi) all'inizio di ogni sessione e
+    ("entry", (timestamp, level, type, message, extra)) per ogni entry, con
+    extra gli altri attributi (es. count/first/last delle ripetizioni),
+    rimuovendo dall'albero gli elementi già letti
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    sessione = None
+    for blocco in blocchi:
+        parser.feed(blocco)
+        for evento, elem in parser.read_events():
+            if evento == "start" and elem.tag == "log":
+                yield "log", dict(elem.attrib)
+            elif evento == "start" and elem.tag == "session":
+                attributi = dict(elem.attrib)
+                # Una sessione proseguita in un nuovo segmento resta una sola,
+                # a meno che la lettura non inizi proprio da lì
+                if attributi.pop("continua", None) is None or sessione is None:
+                    yield "session", attributi
+                sessione = elem
+            elif evento == "end" and elem.tag == "entry":
+                yield "entry", _dati_entry(elem)
+                elem.clear()
+                if sessione is not None:
+                    sessione.remove(elem)
+            elif evento == "end" and elem.tag == "session":
+                elem.clear()
+    parser.close()
+
+def _dati_entry(elem):
+    """(timestamp, level, type, message, extra) di un elemento <entry>"""
+    message_elem = elem.find("message")
+    message = message_elem.text if message_elem is not None else ""
+    extra = {nome: valore for nome, valore in elem.attrib.items()
+             if nome not in ("timestamp", "level", "type")}
+    return (
+        elem.get("timestamp", ""),
+        elem.get("level", ""),
+        elem.get("type", ""),
+        message or "",
+        extra,
+    )
+
+def _orario(valore, fine=False):
+    """Normalizza "H:MM" o "HH:MM:SS" nel formato dei timestamp; senza secondi, alle copre tutto il minuto"""
+    parti = valore.split(":")
+    if not 2 <= len(parti) <= 3 or not all(p.isdigit() and len(p) <= 2 for p in parti):
+        raise ValueError(f"Orario non valido: {valore} (usa HH:MM o HH:MM:SS)")
+    ore, minuti = int(parti[0]), int(parti[1])
+    secondi = int(parti[2]) if len(parti) == 3 else (59 if fine else 0)
+    if ore > 23 or minuti > 59 or secondi > 59:
+        raise ValueError(f"Orario non valido: {valore}")
+    return f"{ore:02d}:{minuti:02d}:{secondi:02d}"
+
+def crea_filtro(livello=None, tipo=None, dalle=None, alle=None):
+    """
+    Predicato sulle entry (timestamp, level, type, message, extra) per le esportazioni.
+    livello e tipo accettano più valori separati da virgola (tipo anche "AUTH*"
+    come prefisso), dalle/alle sono orari inclusi. None se non c'è nessun criterio.
+    I criteri restano in filtro.criteri, per gli archivi che filtrano da sé.
+    ValueError se un orario non è valido
+    """
+    livelli = {v.upper() for v in livello.split(",") if v} if livello else None
+    tipi, prefissi = set(), ()
+    if tipo:
+        valori = [v.upper() for v in tipo.split(",") if v]
+        tipi = {v for v in valori if not v.endswith("*")}
+        prefissi = tuple(v[:-1] for v in valori if v.endswith("*"))
+    dalle = _orario(dalle) if dalle else None
+    alle = _orario(alle, fine=True) if alle else None
+
+    if not (livelli or tipi or prefissi or dalle or alle):
+        return None
+
+    def filtro(entry):
+        timestamp, level, log_type = entry[:3]
+        if livelli and level.upper() not in livelli:
+            return False
+        if (tipi or prefissi) and log_type.upper() not in tipi and not log_type.upper().startswith(prefissi):
+            return False
+        if dalle and timestamp < dalle:
+            return False
+        if alle and timestamp > alle:
+            return False
+        return True
+    filtro.criteri = {"livelli": livelli, "tipi": tipi, "prefissi": prefissi, "dalle": dalle, "alle": alle}
+    return filtro
+
+def _eventi_filtrati(eventi, filtro=None, ultime=0):
+    """
+    Tiene solo le entry che soddisfano il filtro (le sessioni senza entry
+    scelte spariscono); con ultime=N solo le ultime N entry scelte.
+    Un'unica passata, con memoria limitata a N entry
+    """
+    if filtro is None and not ultime:
+        yield from eventi
+        return
+
+    scelte = deque(maxlen=ultime) if ultime else None
+    sessione, sessione_emessa = None, True
+    for tipo, dati in eventi:
+        if tipo == "log":
+            yield tipo, dati
+        elif tipo == "session":
+            sessione, sessione_emessa = dati, False
+        elif filtro is None or filtro(dati):
+            if scelte is not None:
+                scelte.append((sessione, dati))
+                continue
+            if not sessione_emessa:
+                yield "session", sessione
+                sessione_emessa = True
+            yield "entry", dati
+
+    if scelte:
+        sessione_precedente = None
+        for sessione, dati in scelte:
+            if sessione is not sessione_precedente:
+                yield "session", sessione
+                sessione_precedente = sessione
+            yield "entry", dati
+
+def _a_blocchi(righe):
+    """Raggruppa le righe di testo in blocchi codificati di circa DIMENSIONE_BLOCCO"""
+    buffer = []
+    dimensione = 0
+    for riga in righe:
+        buffer.append(riga)
+        dimensione += len(riga)
+        if dimensione >= DIMENSIONE_BLOCCO:
+            yield "".join(buffer).encode('utf-8')
+            buffer = []
+            dimensione = 0
+    if buffer:
+        yield "".join(buffer).encode('utf-8')
+
+def _righe_xml(eventi):
+    """Righe di un documento XML di log ricostruito dagli eventi"""
+    yield "<?xml version='1.0' encoding='utf-8'?>\n"
+    radice, in_sessione = False, False
+    for tipo, dati in eventi:
+        if tipo == "log":
+            radice = True
+            yield f"<log{_attributi(dati)}>\n"
+            continue
+        if not radice:
+            radice = True
+            yield "<log>\n"
+        if tipo == "session":
+            if in_sessione:
+                yield CHIUSURA_SESSIONE
+            in_sessione = True
+            yield _apri_sessione(dati)
+        else:
+            yield _entry_xml(*dati)
+    if not radice:
+        yield "<log>\n"
+    if in_sessione:
+        yield CHIUSURA_SESSIONE
+    yield CHIUSURA_LOG
+
+INTESTAZIONE_CSV = "timestamp,level,type,message,count,first,last,ns,req\n"
+
+def _campi_csv(dati):
+    """Colonne CSV di un'entry"""
+    timestamp, level, log_type, message, extra = dati
+    # count/first/last solo per le entry che riassumono delle ripetizioni,
+    # ns/req assenti nei log scritti prima della loro introduzione
+    return (timestamp, level, log_type, message,
+            extra.get("count", 1), extra.get("first", ""), extra.get("last", ""),
+            extra.get("ns", ""), extra.get("req", ""))
+
+def _riga_csv(dati):
+    """Riga CSV di una singola entry"""
+    riga = io.StringIO()
+    csv.writer(riga, lineterminator="\n").writerow(_campi_csv(dati))
+    return riga.getvalue()
+
+def _intestazione_txt(attributi):
+    """Intestazione TXT di una sessione"""
+    return (f"Sessione iniziata: {attributi.get('start_time', '')}, Login: {attributi.get('login_time', '')}\n"
+            + "-" * 50 + "\n")
+
+def _riga_txt(dati):
+    """Riga TXT di un'entry"""
+    timestamp, level, log_type, message, extra = dati
+    if "count" in extra:
+        message = f"{message} (ripetuta {extra['count']} volte dalle {extra.get('first', '')} alle {extra.get('last', '')})"
+    riferimenti = " ".join(f"{nome}={extra[nome]}" for nome in ("req", "ns") if nome in extra)
+    if riferimenti:
+        message = f"[{riferimenti}] {message}"
+    return f"[{timestamp}] [{level}] [{log_type}] {message}\n"
+
+def _righe_csv(eventi):
+    """Righe CSV (con quoting standard del modulo csv) delle entry del log"""
+    riga = io.StringIO()
+    writer = csv.writer(riga, lineterminator="\n")
+    yield INTESTAZIONE_CSV
+    for tipo, dati in eventi:
+        if tipo == "entry":
+            writer.writerow(_campi_csv(dati))
+            yield riga.getvalue()
+            riga.seek(0)
+            riga.truncate()
+
+def _righe_txt(eventi):
+    """Righe del formato TXT leggibile, con un'intestazione per sessione"""
+    in_sessione = False
+    for tipo, dati in eventi:
+        if tipo == "session":
+            if in_sessione:
+                yield "\n"
+            in_sessione = True
+            yield _intestazione_txt(dati)
+        elif tipo == "entry":
+            yield _riga_txt(dati)
+    if in_sessione:
+        yield "\n"
+
+def genera_xml(blocchi, filtro=None, ultime=0):
+    """Riscrive un log XML fornito a blocchi tenendo solo le entry scelte"""
+    return _a_blocchi(_righe_xml(_eventi_filtrati(_eventi_log(blocchi), filtro, ultime)))
+
+def genera_csv(blocchi, filtro=None, ultime=0):
+    """Converte in CSV un log XML fornito a blocchi, producendo blocchi di byte"""
+    return _a_blocchi(_righe_csv(_eventi_filtrati(_eventi_log(blocchi), filtro, ultime)))
+
+def genera_txt(blocchi, filtro=None, ultime=0):
+    """Converte in TXT un log XML fornito a blocchi, producendo blocchi di byte"""
+    return _a_blocchi(_righe_txt(_eventi_filtrati(_eventi_log(blocchi), filtro, ultime)))
+
+def genera_txt_giorni(giorni):
+    """
+    TXT dei log di più giorni [(data, file), ...] in un unico flusso, con
+    un'intestazione per giorno. Un giorno illeggibile non interrompe gli altri
+    """
+    for giorno, log_filename in giorni:
+        yield f"===== {giorno} =====\n".encode('utf-8')
+        try:
+            genera, _ = prepara_export(log_filename, "txt")
+            yield from genera()
+        except ET.ParseError as e:
+            yield f"ERRORE: log non leggibile ({e})\n\n".encode('utf-8')
+
+def prepara_export(log_filename, formato="xml", ultime=0, intervallo=None, snapshot=None, filtro=None):
+    """
+    Prepara l'esportazione di un log: restituisce (genera, dimensione) dove
+    genera() produce ogni volta gli stessi blocchi di byte e dimensione è
+    None se va contata. Con un filtro (vedi crea_filtro) ultime=N vale per
+    le entry che lo soddisfano, con un intervallo (da, a) il filtro si
+    applica alle entry dell'intervallo
+    """
+    return _backend.prepara_export(log_filename, formato, ultime, intervallo, snapshot, filtro)
+
+def _prepara_export_xml(log_filename, formato="xml", ultime=0, intervallo=None, snapshot=None, filtro=None):
+    """
+    Esportazione dai file XML: dimensione nota solo per l'XML di un unico
+    segmento e per le viste dei client. Con un filtro il log, o l'intervallo
+    richiesto, viene letto in un'unica passata
+    """
+    if (formato in ("txt", "csv") and not ultime and intervallo is None and filtro is None
+            and _viste_attive(log_filename)):
+        # Log completo di un client: già convertito dallo scrittore
+        return prepara_vista(log_filename, formato)
+
+    snapshot = snapshot or snapshot_log(log_filename)
+    if filtro is not None:
+        if intervallo is not None:
+            frammento = estrai_entry(log_filename, da=intervallo[0], a=intervallo[1], snapshot=snapshot)
+            sorgente, ultime = (lambda: iter([frammento])), 0
+        else:
+            sorgente = lambda: blocchi_log(log_filename, snapshot)
+        genera = {"csv": genera_csv, "txt": genera_txt}.get(formato, genera_xml)
+        return (lambda: genera(sorgente(), filtro, ultime)), None
+
+    if ultime or intervallo is not None:
+        if intervallo is not None:
+            frammento = estrai_entry(log_filename, da=intervallo[0], a=intervallo[1], snapshot=snapshot)
+        else:
+            frammento = estrai_entry(log_filename, ultime=ultime, snapshot=snapshot)
+        sorgente = lambda: iter([frammento])
+        dimensione = len(frammento)
+    else:
+        sorgente = lambda: blocchi_log(log_filename, snapshot)
+        # Nota solo con un unico segmento non compresso
+        segmenti, dimensione_ultimo, coda = snapshot
+        dimensione = dimensione_ultimo + len(coda) if len(segmenti) == 1 and dimensione_ultimo is not None else None
+
+    if formato == "csv":
+        return (lambda: genera_csv(sorgente())), None
+    if formato == "txt":
+        return (lambda: genera_txt(sorgente())), None
+    return sorgente, dimensione
+
+# --- CACHE CONDIVISA DELLE ESPORTAZIONI ---
+# Le esportazioni (soprattutto del log del server, uguale per tutti gli utenti)
+# vengono tenute in memoria con chiave (log, versione, formato, N), dove la
+# versione cambia a ogni scrittura (per i file XML: dimensione e mtime):
+# se il log non è cambiato le richieste successive ricevono i byte già pronti.
+# Richieste contemporanee della stessa esportazione fanno una sola conversione
+
+EXPORT_CACHE_BYTE_MAX = 64 * 1024 * 1024      # Budget totale della cache
+EXPORT_CACHE_VOCE_MAX = 8 * 1024 * 1024       # Esportazioni più grandi non vengono tenute
+
+_cache_export = OrderedDict()                 # {chiave: bytes}, dalla meno recente
+_cache_export_byte = 0
+_cache_export_lock = threading.Lock()
+_export_in_corso = {}                         # {chiave: [Event, bytes | None]}
+
+statistiche_cache_export = {"hit": 0, "miss": 0, "attese": 0, "rimosse": 0}
+
+def export_in_cache(log_filename, formato="xml", ultime=0, intervallo=None):
+    """
+    Restituisce i byte dell'esportazione dalla cache, convertendo una sola volta
+    per richieste concorrenti. None se l'esportazione supera EXPORT_CACHE_VOCE_MAX
+    (il chiamante la invia in streaming)
+    """
+    global _cache_export_byte
+    snapshot, versione = _backend.versione(log_filename)
+    chiave = (_backend.nome, os.path.abspath(log_filename), versione, formato, ultime, intervallo)
+
+    with _cache_export_lock:
+        dati = _cache_export.get(chiave)
+        if dati is not None:
+            _cache_export.move_to_end(chiave)
+            statistiche_cache_export["hit"] += 1
+            return dati
+        attesa = _export_in_corso.get(chiave)
+        if attesa is None:
+            attesa = _export_in_corso[chiave] = [threading.Event(), None]
+            statistiche_cache_export["miss"] += 1
+            conversione_mia = True
+        else:
+            statistiche_cache_export["attese"] += 1
+            conversione_mia = False
+
+    if not conversione_mia:
+        # Un altro thread sta già convertendo la stessa esportazione
+        attesa[0].wait()
+        return attesa[1]
+
+    dati = None
+    try:
+        genera, _ = prepara_export(log_filename, formato, ultime, intervallo, snapshot)
+        blocchi = []
+        dimensione = 0
+        for blocco in genera():
+            dimensione += len(blocco)
+            if dimensione > EXPORT_CACHE_VOCE_MAX:
+                blocchi = None
+                break
+            blocchi.append(blocco)
+        if blocchi is not None:
+            dati = b"".join(blocchi)
+    finally:
+        with _cache_export_lock:
+            if dati is not None:
+                _cache_export[chiave] = dati
+                _cache_export_byte += len(dati)
+                # Evizione LRU fino a rientrare nel budget
+                while _cache_export_byte > EXPORT_CACHE_BYTE_MAX and _cache_export:
+                    _, vecchi = _cache_export.popitem(last=False)
+                    _cache_export_byte -= len(vecchi)
+                    statistiche_cache_export["rimosse"] += 1
+            del _export_in_corso[chiave]
+        attesa[1] = dati
+        attesa[0].set()
+    return dati
+
+# --- ARCHIVI DEI LOG ---
+# Dove finiscono le entry lo decide l'archivio attivo (LOG_BACKEND): "xml"
+# (i file descritti sopra, predefinito), "sqlite" (un database in modalità
+# WAL, con indici per log, livello, tipo e orario: i filtri di EX diventano
+# query), "consolidato" (un unico segmento al giorno per tutti i log, con un
+# indice per log) o "memoria" (nessun accesso al disco, per test e benchmark).
+# Livello, campionamento, ripetizioni, ID delle richieste e scrittura
+# asincrona restano comuni: agli archivi arrivano entry
+# (timestamp, level, type, message, extra). I nomi dei log restano
+# "logs/<prefisso><data>.xml" anche dove non ci sono file
+
+LOG_BACKEND = "xml"                     # "xml" | "sqlite" | "consolidato" | "memoria"
+LOG_SQLITE_FILE = "logs/log.db"
+
+class BackendLog:
+    """
+    Interfaccia di un archivio di log. apri, scrivi e chiudi vengono
+    chiamati con lock_log del log
+    """
+    nome = ""
+
+    def apri(self, log_filename, stato, nuova_sessione):
+        """Crea il log del giorno stato["base"] o ne riprende l'ultima sessione (o ne apre una nuova)"""
+        raise NotImplementedError
+
+    def scrivi(self, log_filename, entries):
+        """Aggiunge le entry alla sessione aperta del log; restituisce i byte scritti"""
+        raise NotImplementedError
+
+    def giorno(self, log_filename):
+        """
+        Log del giorno su cui sta scrivendo un log aperto (cambia dopo la
+        mezzanotte); le letture usano invece il log richiesto
+        """
+        return log_filename
+
+    def chiudi(self, log_filename):
+        """Chiude la sessione aperta del log"""
+        raise NotImplementedError
+
+    def sincronizza(self, logs):
+        """Rende durevoli le scritture dei log indicati (politiche di fsync)"""
+
+    def aperti(self):
+        """Log aperti, da chiudere allo shutdown"""
+        raise NotImplementedError
+
+    def esiste(self, log_filename):
+        """True se il log esiste"""
+        raise NotImplementedError
+
+    def versione(self, log_filename):
+        """(snapshot da passare a prepara_export, chiave che cambia a ogni scrittura)"""
+        raise NotImplementedError
+
+    def prepara_export(self, log_filename, formato, ultime, intervallo, snapshot, filtro):
+        """(genera, dimensione) dell'esportazione, come prepara_export"""
+        raise NotImplementedError
+
+    def recupera(self):
+        """Riparazione all'avvio dopo un crash; restituisce cosa è stato riparato"""
+        return []
+
+    def conserva(self, archivia_prima, elimina_prima):
+        """
+        Archivia i log dei giorni precedenti archivia_prima ed elimina quelli
+        precedenti elimina_prima (date "AAAA-MM-GG" o None); restituisce
+        (giorni archiviati, giorni eliminati)
+        """
+        return 0, 0
+
+class BackendXML(BackendLog):
+    """Un file XML per log e giorno, con segmenti, indici e viste"""
+    nome = "xml"
+
+    def apri(self, log_filename, stato, nuova_sessione):
+        Path(os.path.dirname(stato["base"]) or ".").mkdir(exist_ok=True)
+        # Riapre (e se serve ripara) l'ultimo segmento del giorno, o lo crea
+        _attiva_segmento(stato, nuova_sessione)
+        _rotazione[log_filename] = stato
+
+    def scrivi(self, log_filename, entries):
+        return _scrivi_log(log_filename, "".join(_entry_xml(*entry) for entry in entries))
+
+    def chiudi(self, log_filename):
+        _chiudi_log_bloccato(log_filename)
+
+    def sincronizza(self, logs):
+        for log_filename in logs:
+            segmento = _segmento_di(log_filename)
+            with lock_log(segmento):
+                f = file_aperti.get(segmento)
+                if f is not None:
+                    os.fsync(f.fileno())
+
+    def giorno(self, log_filename):
+        return giorno_del_log(log_filename)
+
+    def aperti(self):
+        return list(_rotazione) + list(file_aperti)
+
+    def esiste(self, log_filename):
+        return bool(segmenti_log(log_filename) or _segmenti_archiviati(log_filename))
+
+    def versione(self, log_filename):
+        if not segmenti_log(log_filename):
+            segmenti = _segmenti_archiviati(log_filename)
+            if segmenti:
+                # Un giorno archiviato cambia solo con l'archivio
+                return None, (tuple(segmenti), os.stat(_archivio_del_giorno(log_filename)).st_mtime_ns)
+        snapshot = snapshot_log(log_filename)
+        ultimo = snapshot[0][-1]
+        mtime = os.stat(ultimo if os.path.exists(ultimo) else ultimo + ".gz").st_mtime_ns
+        return snapshot, (snapshot, mtime)
+
+    def prepara_export(self, log_filename, formato, ultime, intervallo, snapshot, filtro):
+        if snapshot is None and not segmenti_log(log_filename):
+            segmenti = _segmenti_archiviati(log_filename)
+            if segmenti:
+                return _prepara_export_archiviato(segmenti, formato, ultime, intervallo, filtro)
+        return _prepara_export_xml(log_filename, formato, ultime, intervallo, snapshot, filtro)
+
+    def recupera(self):
+        return _recupera_segmenti()
+
+    def conserva(self, archivia_prima, elimina_prima):
+        return _conserva_file("logs", archivia_prima, elimina_prima)
+
+def _eventi_archivio(attributi_log, sessioni, entries, tutte):
+    """
+    Eventi di un log da {id: attributi} delle sessioni (in ordine) e
+    (id sessione, entry) in ordine. tutte=True include le sessioni senza entry
+    """
+    yield "log", attributi_log
+    ordine = iter(sessioni.items())
+    corrente = None
+    for sessione, entry in entries:
+        if sessione != corrente:
+            if tutte:
+                for id_sessione, attributi in ordine:
+                    yield "session", attributi
+                    if id_sessione == sessione:
+                        break
+            else:
+                yield "session", sessioni[sessione]
+            corrente = sessione
+        yield "entry", entry
+    if tutte:
+        for _, attributi in ordine:
+            yield "session", attributi
+
+class _ArchivioRecord(BackendLog):
+    """
+    Base degli archivi che tengono log, sessioni ed entry come record:
+    le sottoclassi forniscono lettura e scrittura dei record, qui il
+    cambio di giorno e la conversione nei formati di esportazione
+    """
+
+    def __init__(self):
+        self._stato = {}        # {log: stato del setup + "sessione" aperta}
+
+    def apri(self, log_filename, stato, nuova_sessione):
+        stato = dict(stato)
+        self._crea(stato["base"], stato["attributi_log"])
+        sessione = None if nuova_sessione else self._ultima_sessione(stato["base"])
+        if sessione is None:
+            sessione = self._nuova_sessione(stato["base"], stato["attributi_sessione"])
+        stato["sessione"] = sessione
+        self._stato[log_filename] = stato
+
+    def scrivi(self, log_filename, entries):
+        stato = self._stato.get(log_filename)
+        if stato is None:
+            # Log già chiuso: come per i file, si riprende la sua ultima sessione
+            base, sessione = log_filename, self._ultima_sessione(log_filename)
+            if sessione is None:
+                raise FileNotFoundError(f"Log {log_filename} inesistente")
+        else:
+            if _nuovo_giorno(stato):
+                # Mezzanotte: si continua nel log del nuovo giorno
+                self._crea(stato["base"], stato["attributi_log"])
+                stato["sessione"] = self._nuova_sessione(stato["base"], stato["attributi_sessione"])
+            base, sessione = stato["base"], stato["sessione"]
+        return self._inserisci(base, sessione, entries)
+
+    def chiudi(self, log_filename):
+        self._stato.pop(log_filename, None)
+
+    def conserva(self, archivia_prima, elimina_prima):
+        # Niente da archiviare: un solo database (o la memoria) per tutti i giorni
+        if not elimina_prima:
+            return 0, 0
+        in_uso = {stato["base"] for stato in list(self._stato.values())}
+        return 0, self._elimina_prima(elimina_prima, in_uso)
+
+    def aperti(self):
+        return list(self._stato)
+
+    def giorno(self, log_filename):
+        stato = self._stato.get(log_filename)
+        return stato["base"] if stato else log_filename
+
+    def esiste(self, log_filename):
+        return self._esiste(log_filename)
+
+    def versione(self, log_filename):
+        snapshot = self._snapshot(log_filename)
+        return snapshot, snapshot
+
+    def prepara_export(self, log_filename, formato, ultime, intervallo, snapshot, filtro):
+        snapshot = snapshot or self._snapshot(log_filename)
+        righe = {"csv": _righe_csv, "txt": _righe_txt}.get(formato, _righe_xml)
+        if intervallo is not None:
+            ultime = 0
+        return (lambda: _a_blocchi(righe(self._eventi(log_filename, snapshot, filtro, ultime, intervallo)))), None
+
+class BackendMemoria(_ArchivioRecord):
+    """Log tenuti in memoria (persi all'uscita): per test e benchmark senza disco"""
+    nome = "memoria"
+
+    def __init__(self):
+        super().__init__()
+        # {log: {"attributi": {...}, "sessioni": [attributi], "entry": [(sessione, entry)]}}
+        # Le liste crescono solo in coda: uno snapshot è la loro lunghezza
+        self._log = {}
+
+    def _crea(self, base, attributi_log):
+        self._log.setdefault(base, {"attributi": dict(attributi_log), "sessioni": [], "entry": []})
+
+    def _nuova_sessione(self, base, attributi):
+        sessioni = self._log[base]["sessioni"]
+        sessioni.append(dict(attributi))
+        return len(sessioni) - 1
+
+    def _ultima_sessione(self, base):
+        log = self._log.get(base)
+        return len(log["sessioni"]) - 1 if log and log["sessioni"] else None
+
+    def _inserisci(self, base, sessione, entries):
+        self._log[base]["entry"].extend((sessione, entry) for entry in entries)
+        return sum(len("".join(map(str, entry[:4])).encode('utf-8')) for entry in entries)
+
+    def _esiste(self, base):
+        return base in self._log
+
+    def _elimina_prima(self, giorno, in_uso):
+        scaduti = [base for base in list(self._log)
+                   if base not in in_uso and (_giorno_del_file(base) or giorno) < giorno]
+        for base in scaduti:
+            del self._log[base]
+        return len(scaduti)
+
+    def _snapshot(self, base):
+        log = self._log.get(base)
+        if log is None:
+            raise FileNotFoundError(f"Log {base} inesistente")
+        return len(log["entry"]), len(log["sessioni"])
+
+    def _eventi(self, base, snapshot, filtro, ultime, intervallo):
+        log = self._log[base]
+        entries = log["entry"][:snapshot[0]]
+        sessioni = dict(enumerate(log["sessioni"][:snapshot[1]]))
+        tutte = True
+        if intervallo is not None:
+            da, a = intervallo
+            entries, tutte = entries[max(da, 1) - 1:a], False
+        elif ultime and filtro is None:
+            entries, ultime, tutte = entries[-ultime:], 0, False
+        return _eventi_filtrati(_eventi_archivio(log["attributi"], sessioni, entries, tutte), filtro, ultime)
+
+_SCHEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS log (
+    nome TEXT PRIMARY KEY,
+    attributi TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessione (
+    id INTEGER PRIMARY KEY,
+    log TEXT NOT NULL,
+    attributi TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry (
+    id INTEGER PRIMARY KEY,
+    log TEXT NOT NULL,
+    sessione INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    level TEXT NOT NULL COLLATE NOCASE,
+    type TEXT NOT NULL COLLATE NOCASE,
+    message TEXT NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS sessione_log ON sessione (log, id);
+CREATE INDEX IF NOT EXISTS entry_log ON entry (log, id);
+CREATE INDEX IF NOT EXISTS entry_level ON entry (log, level, id);
+CREATE INDEX IF NOT EXISTS entry_type ON entry (log, type, id);
+CREATE INDEX IF NOT EXISTS entry_timestamp ON entry (log, timestamp, id);
+"""
+
+def _condizioni_sql(criteri):
+    """Condizioni SQL (con parametri) equivalenti ai criteri di crea_filtro"""
+    condizioni, parametri = [], []
+    if criteri["livelli"]:
+        condizioni.append(f"level IN ({', '.join('?' * len(criteri['livelli']))})")
+        parametri.extend(sorted(criteri["livelli"]))
+    if criteri["tipi"] or criteri["prefissi"]:
+        alternative = []
+        if criteri["tipi"]:
+            alternative.append(f"type IN ({', '.join('?' * len(criteri['tipi']))})")
+            parametri.extend(sorted(criteri["tipi"]))
+        for prefisso in criteri["prefissi"]:
+            alternative.append("type LIKE ? ESCAPE '\\'")
+            parametri.append(re.sub(r"([\\%_])", r"\\\1", prefisso) + "%")
+        condizioni.append(f"({' OR '.join(alternative)})")
+    if criteri["dalle"]:
+        condizioni.append("timestamp >= ?")
+        parametri.append(criteri["dalle"])
+    if criteri["alle"]:
+        condizioni.append("timestamp <= ?")
+        parametri.append(criteri["alle"])
+    return condizioni, parametri
+
+class BackendSQLite(_ArchivioRecord):
+    """
+    Log in un database SQLite in modalità WAL: una connessione di scrittura
+    condivisa, una connessione per ogni esportazione (i lettori non bloccano
+    chi scrive). Filtri, ultime N e intervalli diventano query sugli indici
+    """
+    nome = "sqlite"
+
+    def __init__(self, percorso=None):
+        super().__init__()
+        self.percorso = percorso or LOG_SQLITE_FILE
+        Path(os.path.dirname(self.percorso) or ".").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = self._connetti()
+        self._db.executescript(_SCHEMA_SQLITE)
+
+    def _connetti(self):
+        """Nuova connessione al database"""
+        db = sqlite3.connect(self.percorso, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # Con il WAL basta sincronizzare ai checkpoint (vedi sincronizza)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _crea(self, base, attributi_log):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO log (nome, attributi) VALUES (?, ?)",
+                             (base, json.dumps(attributi_log)))
+
+    def _nuova_sessione(self, base, attributi):
+        with self._lock, self._db:
+            return self._db.execute("INSERT INTO sessione (log, attributi) VALUES (?, ?)",
+                                    (base, json.dumps(attributi))).lastrowid
+
+    def _ultima_sessione(self, base):
+        with self._lock:
+            return self._db.execute("SELECT MAX(id) FROM sessione WHERE log = ?", (base,)).fetchone()[0]
+
+    def _inserisci(self, base, sessione, entries):
+        righe = [(base, sessione, timestamp, level, log_type, message, json.dumps(extra) if extra else None)
+                 for timestamp, level, log_type, message, extra in entries]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO entry (log, sessione, timestamp, level, type, message, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", righe)
+        return sum(len("".join(riga[2:6]).encode('utf-8')) + len(riga[6] or "") for riga in righe)
+
+    def sincronizza(self, logs):
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def _esiste(self, base):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM log WHERE nome = ?", (base,)).fetchone() is not None
+
+    def _elimina_prima(self, giorno, in_uso):
+        # I nomi finiscono con "_AAAA-MM-GG.xml"
+        with self._lock, self._db:
+            scaduti = [(nome,) for nome, in self._db.execute(
+                "SELECT nome FROM log WHERE substr(nome, -14, 10) < ?", (giorno,)) if nome not in in_uso]
+            for tabella, colonna in (("entry", "log"), ("sessione", "log"), ("log", "nome")):
+                self._db.executemany(f"DELETE FROM {tabella} WHERE {colonna} = ?", scaduti)
+        return len(scaduti)
+
+    def _snapshot(self, base):
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM log WHERE nome = ?", (base,)).fetchone() is None:
+                raise FileNotFoundError(f"Log {base} inesistente")
+            ultima_entry = self._db.execute("SELECT MAX(id) FROM entry WHERE log = ?", (base,)).fetchone()[0]
+            ultima_sessione = self._db.execute("SELECT MAX(id) FROM sessione WHERE log = ?", (base,)).fetchone()[0]
+        return ultima_entry or 0, ultima_sessione or 0
+
+    def _eventi(self, base, snapshot, filtro, ultime, intervallo):
+        ultima_entry, ultima_sessione = snapshot
+        sorgente, parametri = "entry", []
+        if intervallo is not None:
+            # Entry numerate da 1 nel log, come negli indici dei file
+            da, a = intervallo
+            primo = max(da, 1) - 1
+            sorgente = "(SELECT * FROM entry WHERE log = ? AND id <= ? ORDER BY id LIMIT ? OFFSET ?)"
+            parametri = [base, ultima_entry, -1 if a is None else max(a - primo, 0), primo]
+        condizioni, parametri_filtro = _condizioni_sql(filtro.criteri) if filtro is not None else ([], [])
+        where = " AND ".join(["log = ?", "id <= ?"] + condizioni)
+        parametri += [base, ultima_entry] + parametri_filtro
+        query = (f"SELECT id, sessione, timestamp, level, type, message, extra "
+                 f"FROM {sorgente} WHERE {where} ORDER BY id")
+        if ultime:
+            query = f"SELECT * FROM ({query} DESC LIMIT ?) ORDER BY id"
+            parametri.append(ultime)
+        tutte = filtro is None and not ultime and intervallo is None
+
+        db = self._connetti()
         try:
-            tree = ET.parse(log_filename)
-            root = tree.getroot()
-            
-            sessions = root.findall("session")
-            if sessions:
-                current_session = sessions[-1]
+            attributi_log = json.loads(db.execute("SELECT attributi FROM log WHERE nome = ?", (base,)).fetchone()[0])
+            sessioni = {id_sessione: json.loads(attributi) for id_sessione, attributi in db.execute(
+                "SELECT id, attributi FROM sessione WHERE log = ? AND id <= ? ORDER BY id", (base, ultima_sessione))}
+            entries = ((sessione, (timestamp, level, log_type, message, json.loads(extra) if extra else {}))
+                       for _, sessione, timestamp, level, log_type, message, extra in db.execute(query, parametri))
+            yield from _eventi_archivio(attributi_log, sessioni, entries, tutte)
+        finally:
+            db.close()
+
+# Log consolidati: invece di un file per utente e giorno, tutti i log di un
+# giorno (server e client) finiscono in un unico segmento in sola aggiunta
+# "logs/consolidato_<data>.log", una riga JSON per record. L'indice
+# "<segmento>.idx" registra per ogni riga il log a cui appartiene, l'offset
+# e la lunghezza: LOG ed EX leggono solo le righe di quel log (quelle
+# contigue con un'unica lettura)
+
+CONSOLIDATO_GIORNI_IN_MEMORIA = 8      # Indici di giorni passati tenuti in memoria
+
+# Record dell'indice: tipo della riga, numero del log, offset, lunghezza,
+# byte del nome del log che seguono il record (solo per le righe "L")
+_RECORD_CONSOLIDATO = struct.Struct("<cIQIH")
+
+def _leggi_righe(f, offsets, lunghezze):
+    """Righe JSON del segmento alle posizioni indicate, leggendo insieme quelle contigue"""
+    i = 0
+    while i < len(offsets):
+        inizio = offsets[i]
+        fine = inizio + lunghezze[i]
+        j = i + 1
+        while j < len(offsets) and offsets[j] == fine and fine - inizio < DIMENSIONE_BLOCCO:
+            fine += lunghezze[j]
+            j += 1
+        f.seek(inizio)
+        dati = f.read(fine - inizio)
+        for k in range(i, j):
+            yield json.loads(dati[offsets[k] - inizio:offsets[k] - inizio + lunghezze[k]])
+        i = j
+
+class BackendConsolidato(_ArchivioRecord):
+    """
+    Un segmento per giorno condiviso da tutti i log, con un indice per log.
+    Righe: ["L", n, nome, attributi], ["S", n, id, attributi],
+    ["E", n, sessione, timestamp, level, type, message, extra]
+    (n è il numero del log nel segmento, in ordine di creazione)
+    """
+    nome = "consolidato"
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        # {segmento: {"dati", "indice": file in append (o None), "fine": byte di righe indicizzate,
+        #             "letto": byte dell'indice caricati, "nomi": [log per numero], "sessioni": quante,
+        #             "log": {log: {"numero", "intestazione": (offset, lunghezza),
+        #                           "sessioni": [(id, offset, lunghezza)], "offset", "lunghezze"}}}}
+        self._giorni = OrderedDict()
+
+    def _segmento(self, base):
+        """Segmento consolidato del giorno di un log"""
+        giorno = _giorno_del_file(base)
+        if giorno is None:
+            raise ValueError(f"Nome di log senza data: {base}")
+        return os.path.join(os.path.dirname(base), f"consolidato_{giorno}.log")
+
+    def _registra(self, giorno, tipo, numero, offset, lunghezza, nome=""):
+        """Aggiunge una riga all'indice in memoria; restituisce il suo record per il file"""
+        if tipo == b"L":
+            giorno["nomi"].append(nome)
+            giorno["log"][nome] = {"numero": numero, "intestazione": (offset, lunghezza), "sessioni": [],
+                                   "offset": array("Q"), "lunghezze": array("I")}
+        else:
+            log = giorno["log"][giorno["nomi"][numero]]
+            if tipo == b"S":
+                log["sessioni"].append((giorno["sessioni"], offset, lunghezza))
+                giorno["sessioni"] += 1
             else:
-                current_session = ET.SubElement(root, "session")
-                current_session.set("start_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            
-            entry = ET.SubElement(current_session, "entry")
-            entry.set("timestamp", datetime.now().strftime('%H:%M:%S'))
-            entry.set("level", level)
-            entry.set("type", log_type)
-            
-            msg_elem = ET.SubElement(entry, "message")
-            msg_elem.text = message
-            
-            ET.indent(tree, space="  ")
-            tree.write(log_filename, encoding='utf-8', xml_declaration=True)
-            
-            if level == "INFO":
-                level_colored = Colori.VERDE + level + Colori.RESET
-            elif level == "WARNING":
-                level_colored = Colori.GIALLO + level + Colori.RESET
-            elif level == "ERROR":
-                level_colored = Colori.ROSSO + level + Colori.RESET
+                log["offset"].append(offset)
+                log["lunghezze"].append(lunghezza)
+        giorno["fine"] = offset + lunghezza
+        nome = nome.encode('utf-8')
+        return _RECORD_CONSOLIDATO.pack(tipo, numero, offset, lunghezza, len(nome)) + nome
+
+    def _leggi_indice(self, segmento, giorno, dimensione=None):
+        """Carica i record dell'indice non ancora letti (fino alle righe entro dimensione byte)"""
+        try:
+            with open(segmento + ".idx", "rb") as f:
+                f.seek(giorno["letto"])
+                dati = f.read()
+        except FileNotFoundError:
+            return
+        posizione = 0
+        while posizione + _RECORD_CONSOLIDATO.size <= len(dati):
+            tipo, numero, offset, lunghezza, byte_nome = _RECORD_CONSOLIDATO.unpack_from(dati, posizione)
+            fine = posizione + _RECORD_CONSOLIDATO.size + byte_nome
+            if fine > len(dati) or (dimensione is not None and offset + lunghezza > dimensione):
+                break
+            nome = dati[posizione + _RECORD_CONSOLIDATO.size:fine].decode('utf-8')
+            self._registra(giorno, tipo, numero, offset, lunghezza, nome)
+            posizione = fine
+        giorno["letto"] += posizione
+
+    def _ripara(self, segmento, giorno):
+        """
+        Ricarica l'indice da zero allineandolo al segmento dopo un'interruzione:
+        scarta record e riga scritti a metà e indicizza le righe complete
+        rimaste fuori. True se ha dovuto correggere qualcosa
+        """
+        giorno.update(fine=0, letto=0, nomi=[], log={}, sessioni=0)
+        if not os.path.exists(segmento):
+            if os.path.exists(segmento + ".idx"):
+                os.remove(segmento + ".idx")
+            return False
+        dimensione = os.path.getsize(segmento)
+        self._leggi_indice(segmento, giorno, dimensione)
+        corretto = _dimensione_file(segmento + ".idx") != giorno["letto"]
+
+        record = []
+        with open(segmento, "rb+") as f:
+            f.seek(giorno["fine"])
+            offset = giorno["fine"]
+            for riga in f:
+                try:
+                    valori = json.loads(riga) if riga.endswith(b"\n") else None
+                except ValueError:
+                    valori = None
+                if valori is None:
+                    break
+                nome = valori[2] if valori[0] == "L" else ""
+                record.append(self._registra(giorno, valori[0].encode(), valori[1], offset, len(riga), nome))
+                offset += len(riga)
+            if offset != dimensione:
+                f.truncate(offset)
+                corretto = True
+        with open(segmento + ".idx", "ab") as indice:
+            indice.truncate(giorno["letto"])
+            indice.write(b"".join(record))
+        giorno["letto"] += sum(len(r) for r in record)
+        return corretto or bool(record)
+
+    def _carica(self, segmento, scrittura=False):
+        """Stato di un giorno con l'indice in pari, aperto in scrittura se serve (con self._lock)"""
+        giorno = self._giorni.get(segmento)
+        if giorno is None:
+            giorno = {"dati": None, "indice": None, "fine": 0, "letto": 0, "nomi": [], "log": {}, "sessioni": 0}
+            self._giorni[segmento] = giorno
+        self._giorni.move_to_end(segmento)
+        if giorno["dati"] is not None:
+            return giorno
+        if scrittura:
+            if (_dimensione_file(segmento) != giorno["fine"]
+                    or _dimensione_file(segmento + ".idx") != giorno["letto"]):
+                self._ripara(segmento, giorno)
+            Path(os.path.dirname(segmento) or ".").mkdir(exist_ok=True)
+            giorno["dati"] = open(segmento, "ab")
+            giorno["indice"] = open(segmento + ".idx", "ab")
+        else:
+            self._leggi_indice(segmento, giorno)
+
+        # Indici dei giorni passati letti di recente, entro il limite
+        in_lettura = [s for s, g in self._giorni.items() if g["dati"] is None]
+        for vecchio in in_lettura[:-CONSOLIDATO_GIORNI_IN_MEMORIA]:
+            del self._giorni[vecchio]
+        return giorno
+
+    def _chiudi_giorno(self, giorno):
+        """Chiude i file in scrittura di un giorno (l'indice in memoria resta)"""
+        if giorno["dati"] is not None:
+            giorno["dati"].close()
+            giorno["indice"].close()
+            giorno["dati"] = giorno["indice"] = None
+
+    def _aggiungi(self, base, tipo, valori):
+        """
+        Scrive le righe [valori, ...] di un tipo ("L", "S", "E") del log base
+        e le indicizza; restituisce (byte scritti, id della prima sessione
+        scritta). Le sessioni ricevono qui il loro id, in ordine nel segmento
+        """
+        segmento = self._segmento(base)
+        with self._lock:
+            giorno = self._carica(segmento, scrittura=True)
+            primo = giorno["sessioni"]
+            if tipo == "L":
+                if base in giorno["log"]:
+                    return 0, primo
+                numero = len(giorno["nomi"])
             else:
-                level_colored = level
-                
-            if log_type in ["CONNECTION", "ERROR", "DISCONNECTION", "AUTH", "REGISTRATION"]:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] [{level_colored}] {message}")
-        except Exception as e:
-            print(f"Errore scrittura XML log: {e}")
+                numero = giorno["log"][base]["numero"]
+            if tipo == "S":
+                valori = [[primo + i] + v for i, v in enumerate(valori)]
+            righe = [(json.dumps([tipo, numero] + v, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8')
+                     for v in valori]
+            # Prima le righe, poi l'indice: dopo un crash l'indice non punta mai oltre i dati
+            giorno["dati"].write(b"".join(righe))
+            giorno["dati"].flush()
+            record = []
+            offset = giorno["fine"]
+            for riga in righe:
+                record.append(self._registra(giorno, tipo.encode(), numero, offset, len(riga), base if tipo == "L" else ""))
+                offset += len(riga)
+            giorno["indice"].write(b"".join(record))
+            giorno["indice"].flush()
+            giorno["letto"] += sum(len(r) for r in record)
+        return sum(len(riga) for riga in righe), primo
+
+    def _log(self, base):
+        """Voce in memoria di un log (caricando l'indice del suo giorno), o None"""
+        segmento = self._segmento(base)
+        with self._lock:
+            if segmento not in self._giorni and not os.path.exists(segmento):
+                return None
+            return self._carica(segmento)["log"].get(base)
+
+    def _crea(self, base, attributi_log):
+        self._aggiungi(base, "L", [[base, attributi_log]])
+        # Un nuovo giorno: i file dei giorni precedenti non servono più aperti
+        segmento = self._segmento(base)
+        with self._lock:
+            for altro, giorno in self._giorni.items():
+                if altro != segmento:
+                    self._chiudi_giorno(giorno)
+
+    def _nuova_sessione(self, base, attributi):
+        _, id_sessione = self._aggiungi(base, "S", [[attributi]])
+        return id_sessione
 
+    def _ultima_sessione(self, base):
+        log = self._log(base)
+        return log["sessioni"][-1][0] if log and log["sessioni"] else None
+
+    def _inserisci(self, base, sessione, entries):
+        byte, _ = self._aggiungi(base, "E", [[sessione, timestamp, level, log_type, message, extra or None]
+                                              for timestamp, level, log_type, message, extra in entries])
+        return byte
+
+    def chiudi(self, log_filename):
+        super().chiudi(log_filename)
+        if not self._stato:
+            with self._lock:
+                for giorno in self._giorni.values():
+                    self._chiudi_giorno(giorno)
+
+    def sincronizza(self, logs):
+        with self._lock:
+            for giorno in self._giorni.values():
+                if giorno["dati"] is not None:
+                    os.fsync(giorno["dati"].fileno())
+                    os.fsync(giorno["indice"].fileno())
+
+    def _esiste(self, base):
+        return self._log(base) is not None
+
+    def _snapshot(self, base):
+        log = self._log(base)
+        if log is None:
+            raise FileNotFoundError(f"Log {base} inesistente")
+        return len(log["offset"]), len(log["sessioni"])
+
+    def _eventi(self, base, snapshot, filtro, ultime, intervallo):
+        entry_snapshot, sessioni_snapshot = snapshot
+        segmento = self._segmento(base)
+        with self._lock:
+            log = self._carica(segmento)["log"][base]
+            intestazione = log["intestazione"]
+            posizioni_sessioni = log["sessioni"][:sessioni_snapshot]
+            offsets = log["offset"][:entry_snapshot]
+            lunghezze = log["lunghezze"][:entry_snapshot]
+        tutte = True
+        if intervallo is not None:
+            da, a = intervallo
+            offsets, lunghezze, tutte = offsets[max(da, 1) - 1:a], lunghezze[max(da, 1) - 1:a], False
+        elif ultime and filtro is None:
+            offsets, lunghezze, ultime, tutte = offsets[-ultime:], lunghezze[-ultime:], 0, False
+
+        with open(segmento, "rb") as f:
+            attributi_log = next(_leggi_righe(f, [intestazione[0]], [intestazione[1]]))[3]
+            sessioni = {valori[2]: valori[3] for valori in _leggi_righe(
+                f, [offset for _, offset, _ in posizioni_sessioni], [lunghezza for _, _, lunghezza in posizioni_sessioni])}
+            entries = ((valori[2], (valori[3], valori[4], valori[5], valori[6], valori[7] or {}))
+                       for valori in _leggi_righe(f, offsets, lunghezze))
+            yield from _eventi_filtrati(_eventi_archivio(attributi_log, sessioni, entries, tutte), filtro, ultime)
+
+    def recupera(self):
+        riparati = []
+        for segmento in sorted(glob.glob(os.path.join("logs", "consolidato_*.log"))):
+            with self._lock:
+                giorno = self._carica(segmento)
+                if giorno["dati"] is None and self._ripara(segmento, giorno):
+                    riparati.append(segmento)
+        return riparati
+
+    def _elimina_prima(self, giorno, in_uso):
+        aperti = {self._segmento(base) for base in in_uso}
+        eliminati = 0
+        for segmento in glob.glob(os.path.join("logs", "consolidato_*.log")):
+            data = os.path.basename(segmento)[len("consolidato_"):-len(".log")]
+            if data >= giorno or segmento in aperti:
+                continue
+            with self._lock:
+                vecchio = self._giorni.pop(segmento, None)
+                if vecchio is not None:
+                    self._chiudi_giorno(vecchio)
+                os.remove(segmento)
+                if os.path.exists(segmento + ".idx"):
+                    os.remove(segmento + ".idx")
+            eliminati += 1
+        return eliminati
+
+_BACKEND = {"xml": BackendXML, "sqlite": BackendSQLite, "memoria": BackendMemoria,
+            "consolidato": BackendConsolidato}
+_backend = BackendXML()
+
+def configura_backend(nome=None, **opzioni):
+    """
+    Sceglie l'archivio dei log ("xml", "sqlite", "consolidato", "memoria"; opzioni: percorso
+    per sqlite). Da chiamare all'avvio, prima di aprire i log
+    """
+    global _backend, LOG_BACKEND
+    nome = (nome or LOG_BACKEND).lower()
+    if nome not in _BACKEND:
+        raise ValueError(f"Archivio di log non valido: {nome} (usa {', '.join(_BACKEND)})")
+    _backend = _BACKEND[nome](**opzioni)
+    LOG_BACKEND = nome
+    return _backend
+
+def esiste_log(log_filename):
+    """True se il log esiste nell'archivio attivo"""
+    return _backend.esiste(log_filename)
+
+def giorno_corrente(log_filename):
+    """
+    Log del giorno su cui sta scrivendo un log aperto con setup_*_log: dopo
+    la mezzanotte è quello del nuovo giorno, non il nome restituito dal setup
+    """
+    return _backend.giorno(log_filename)
+
+def recupera_log():
+    """Riparazione all'avvio dei log lasciati a metà da un crash (per i file XML)"""
+    return _backend.recupera()
+
+def _converti_su_file(xml_filename, estensione, genera):
+    """Scrive su file accanto al log il risultato di un convertitore"""
+    out_filename = xml_filename.replace(".xml", estensione)
+    with lock_log(out_filename), open(out_filename, "wb") as f:
+        for blocco in genera(blocchi_log(xml_filename)):
+            f.write(blocco)
+    return out_filename
 
 def converti_xml_in_csv(xml_filename):
     """Converte un file XML di log in formato CSV"""
-    csv_filename = xml_filename.replace(".xml", ".csv")
-    
     try:
-        tree = ET.parse(xml_filename)
-        root = tree.getroot()
-        
-        with open(csv_filename, "w", encoding='utf-8') as f:
-            f.write("timestamp,level,type,message\n")
-            for session in root.findall("session"):
-                for entry in session.findall("entry"):
-                    timestamp = entry.get("timestamp", "")
-                    level = entry.get("level", "")
-                    log_type = entry.get("type", "")
-                    message_elem = entry.find("message")
-                    message = message_elem.text if message_elem is not None else ""
-                    
-                    # Escape dei campi che contengono virgole
-                    if "," in message:
-                        message = f'"{message}"'
-                    
-                    f.write(f"{timestamp},{level},{log_type},{message}\n")
-        
-        return csv_filename
+        return _converti_su_file(xml_filename, ".csv", genera_csv)
     except Exception as e:
         print(f"Errore conversione XML in CSV: {e}")
         return None
 
 def converti_xml_in_txt(xml_filename):
     """Converte un file XML di log in formato TXT leggibile"""
-    txt_filename = xml_filename.replace(".xml", ".txt")
-    
     try:
-        tree = ET.parse(xml_filename)
-        root = tree.getroot()
-        
-        with open(txt_filename, "w", encoding='utf-8') as f:
-            for session in root.findall("session"):
-                start_time = session.get("start_time", "")
-                login_time = session.get("login_time", "")
-                f.write(f"Sessione iniziata: {start_time}, Login: {login_time}\n")
-                f.write("-" * 50 + "\n")
-                
-                for entry in session.findall("entry"):
-                    timestamp = entry.get("timestamp", "")
-                    level = entry.get("level", "")
-                    log_type = entry.get("type", "")
-                    message_elem = entry.find("message")
-                    message = message_elem.text if message_elem is not None else ""
-                    
-                    f.write(f"[{timestamp}] [{level}] [{log_type}] {message}\n")
-                
-                f.write("\n")
-        
-        return txt_filename
+        return _converti_su_file(xml_filename, ".txt", genera_txt)
     except Exception as e:
         print(f"Errore conversione XML in TXT: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+if __name__ == "__main__":
+    # Uso: python logger.py ricostruisci-indici [file.xml ...]  (default: tutti i log in logs/)
+    if len(sys.argv) >= 2 and sys.argv[1] == "ricostruisci-indici":
+        segmenti = sys.argv[2:] or sorted({
+            percorso[:-len(".gz")] if percorso.endswith(".gz") else percorso
+            for percorso in glob.glob("logs/*.xml") + glob.glob("logs/*.xml.gz")
+        })
+        for log_filename in segmenti:
+            try:
+                print(f"{log_filename}: {ricostruisci_indice(log_filename)} entry indicizzate")
+            except Exception as e:
+                print(f"{Colori.ROSSO}{log_filename}: errore ricostruzione indice: {e}{Colori.RESET}")
+    else:
+        print("Uso: python logger.py ricostruisci-indici [file.xml ...]")
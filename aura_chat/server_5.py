@@ -2,7 +2,7 @@ import authenticator
 import logger
 import socket
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 import xml.etree.ElementTree as ET
 import time
@@ -10,6 +10,9 @@ import os
 from colorama import Fore, Style, init
 import signal
 import platform
+import re
+import sys
+import zlib
 
 # Inizializza colorama per Windows
 init(autoreset=True)
@@ -29,6 +32,17 @@ class Colori:
 SECRET_TOKEN = "AURACHAT"  # TOKEN SEGRETO PER DISCOVERY
 DISCOVERY_PORT = 9999  # Porta UDP per discovery
 
+# Comandi riconosciuti (gli altri contano come "ALTRO" nelle statistiche di sessione)
+COMANDI = ("TIME", "NAME", "INFO", "LOG", "EX", "STATS", "COMPRESS", "EXIT")
+
+# --- COMPRESSIONE DEI TRASFERIMENTI ---
+# Facoltativa: il client la chiede dopo il login con "COMPRESS <zlib|gzip> [livello]"
+# e l'algoritmo viene annunciato in FILE_START. Chi non la chiede riceve i dati grezzi
+COMPRESSIONI = {"zlib": 15, "gzip": 31}  # wbits per zlib.compressobj
+COMPRESSIONE_LIVELLO = 6  # Default: 1 più veloce .. 9 più compresso
+
+LOG_GIORNI_MAX = 366  # Giorni massimi per "LOG <da> <a>"
+
 # Flag per shutdown controllato
 server_running = True
 
@@ -85,8 +99,7 @@ def gestisci_comando_info(comando_completo):
         )
         return risposta
     elif info_type == 2:
-        data = authenticator.carica_utenti()
-        num_utenti = len(data['users'])
+        num_utenti = authenticator.numero_utenti()
         risposta = (
             f"Utenti nel DB: {num_utenti}"
         )
@@ -96,8 +109,7 @@ def gestisci_comando_info(comando_completo):
     elif info_type == 4:
         return "CLIENT_HANDLE_INFO_4"
     elif info_type == 5:
-        data = authenticator.carica_utenti()
-        utenti_online = [u['username'] for u in data['users']]
+        utenti_online = authenticator.elenco_utenti()
         if not utenti_online:
             return "Nessun utente disponibile per chat al momento."
         # Sanifica usernames prima di loggare
@@ -132,7 +144,7 @@ def autenticazione(mio_socket, client_address, server_log_filename):
                         if username in authenticator.utenti_connessi:
                             mio_socket.send("AUTH_FAIL|Utente già connesso da un altro client!".encode('utf-8'))
                             logger.log_to_xml(server_log_filename, "WARNING", "AUTH", f"Tentativo login con utente già connesso: {username}")
-                            return False, None
+                            return False, None, None
                     
                     authenticator.aggiorna_ultimo_accesso(username)
                     mio_socket.send(f"AUTH_SUCCESS|Benvenuto {username}!".encode('utf-8'))
@@ -153,7 +165,7 @@ def autenticazione(mio_socket, client_address, server_log_filename):
                     
                     logger.log_to_xml(server_log_filename, "WARNING", "AUTH", f"Tentativo login fallito per username: {username}")
             
-            return False, None
+            return False, None, None
             
         elif risposta == "NO":
             # REGISTRAZIONE
@@ -176,10 +188,12 @@ def autenticazione(mio_socket, client_address, server_log_filename):
             
             if len(password) < 4:
                 mio_socket.send("REG_FAIL|Password troppo corta (minimo 4 caratteri)".encode('utf-8'))
-                return False, None
+                return False, None, None
             
-            # Registra utente
-            authenticator.registra_utente(username, password, client_address[0], client_address[1])
+            # Registra utente (un altro client può aver preso lo stesso nome nel frattempo)
+            if not authenticator.registra_utente(username, password, client_address[0], client_address[1]):
+                mio_socket.send("REG_FAIL|Username già esistente, registrazione annullata".encode('utf-8'))
+                return False, None, None
             mio_socket.send(f"REG_SUCCESS|Account creato! Benvenuto {username}!".encode('utf-8'))
 
             # Crea log specifico per questo client
@@ -198,77 +212,157 @@ def autenticazione(mio_socket, client_address, server_log_filename):
         return False, None, None
     
 
-def invia_file_log(socket_dest, nome_file, tipo_log, numero_log=0):
-    if not os.path.exists(nome_file):
-        return 
+def _invia_blocchi(socket_dest, blocchi, compressione=None):
+    """Spedisce i blocchi di byte, compressi al volo se il client l'ha chiesto"""
+    if not compressione:
+        for blocco in blocchi:
+            socket_dest.sendall(blocco)
+        return
 
-    with open(nome_file, "r", encoding="utf-8") as f:
-        contenuto = f.read()
+    algoritmo, livello = compressione
+    compressore = zlib.compressobj(livello, zlib.DEFLATED, COMPRESSIONI[algoritmo])
+    for blocco in blocchi:
+        compresso = compressore.compress(blocco)
+        if compresso:
+            socket_dest.sendall(compresso)
+    # Il flusso compresso si chiude da solo: il client sa dove finisce
+    socket_dest.sendall(compressore.flush())
 
-    da_inviare = ""
-    
-    # Capiamo il formato direttamente dall'estensione del file (.xml o altro)
-    is_xml = nome_file.lower().endswith(".xml")
+def invia_file_log(socket_dest, nome_file, tipo_log, formato="xml", numero_log=0, intervallo=None, usa_cache=False, compressione=None, filtro=None):
+    """
+    Invia un log al client nel formato richiesto, senza file temporanei.
+    Con numero_log (ultime N) o intervallo (da, a) legge solo le entry
+    richieste tramite l'indice degli offset; la conversione in csv/txt
+    avviene in streaming mentre i blocchi vengono spediti sul socket.
+    Con usa_cache l'esportazione viene condivisa tra le richieste uguali,
+    con filtro (logger.crea_filtro) partono solo le entry che lo soddisfano.
+    Con compressione (algoritmo, livello) l'header diventa
+    FILE_START:<tipo>:<dimensione>:<algoritmo>, dove la dimensione resta
+    quella dei dati non compressi. Restituisce False se la conversione fallisce
+    """
+    if not logger.esiste_log(nome_file):
+        return True
 
-    # --- SE E' XML ---
-    if is_xml:
-        if numero_log == 0:
-            da_inviare = contenuto # Se vuole tutto, mando tutto così com'è
+    try:
+        dati = None
+        if usa_cache:
+            dati = logger.export_in_cache(nome_file, formato, numero_log, intervallo)
+        if dati is not None:
+            genera, dimensione = (lambda: iter([dati])), len(dati)
         else:
-            # 1. Trova dove inizia la prima <entry>
-            idx = contenuto.find("<entry")
-            
-            if idx != -1:
-                # HEADER: Prendo tutto quello che c'è prima (Root + Session start)
-                header = contenuto[:idx] 
-                
-                # CORPO: Prendo il resto e lo spezzo usando la chiusura del tag
-                resto_del_file = contenuto[idx:]
-                blocchi = resto_del_file.split('</entry>')
-                
-                # Ricostruisco i blocchi validi (rimettendo </entry> che lo split toglie)
-                entries = [b + "</entry>" for b in blocchi if "<entry" in b]
-                
-                # Prendo solo gli ultimi N richiesti
-                ultime_entries = entries[-numero_log:]
-                
-                # 2. Unisco: Header + Entries Scelte + Chiusura Tag Root e Session
-                da_inviare = header + "\n".join(ultime_entries) + "\n  </session>\n</log>"
-            else:
-                da_inviare = contenuto # Caso raro: file senza entry
+            genera, dimensione = logger.prepara_export(nome_file, formato, numero_log, intervallo, filtro=filtro)
+            if dimensione is None:
+                genera, dimensione = _misura(genera)
+    except Exception as e:
+        logger.console(f"Errore conversione log {nome_file}: {e}", "ERROR")
+        return False
 
-    # --- SE E' CSV o TXT ---
-    else:
-        righe = contenuto.splitlines(keepends=True)
-        if numero_log == 0 or numero_log >= len(righe):
-            da_inviare = contenuto
-        else:
-            # Header (riga 0) + Ultime N righe
-            header = righe[0] 
-            body = righe[-numero_log:]
-            da_inviare = header + "".join(body)
-
-    # --- INVIO SUL SOCKET ---
-    if da_inviare:
-        dati_bytes = da_inviare.encode('utf-8')
-        dimensione = len(dati_bytes)
-        
+    _invia_con_header(socket_dest, tipo_log, genera, dimensione, compressione)
+    return True
+
+def _misura(genera):
+    """
+    Il protocollo annuncia la dimensione prima dei dati: una passata per contarla.
+    Se il risultato è piccolo (es. una ricerca filtrata) lo teniamo, senza convertire due volte
+    """
+    blocchi, dimensione = [], 0
+    for blocco in genera():
+        dimensione += len(blocco)
+        if blocchi is not None:
+            blocchi.append(blocco)
+            if dimensione > logger.EXPORT_CACHE_VOCE_MAX:
+                blocchi = None
+    if blocchi is not None:
+        return (lambda: iter(blocchi)), dimensione
+    return genera, dimensione
+
+def _invia_con_header(socket_dest, tipo_log, genera, dimensione, compressione=None):
+    """Handshake FILE_START / READY e invio dei blocchi"""
+    if dimensione:
         header = f"FILE_START:{tipo_log}:{dimensione}"
+        if compressione:
+            header += f":{compressione[0]}"
         
         socket_dest.send(header.encode('utf-8'))
         
         # Aspetto pronto
         ack = socket_dest.recv(1024).decode('utf-8')
         if ack.strip() == "READY":
-            socket_dest.sendall(dati_bytes)
+            _invia_blocchi(socket_dest, genera(), compressione)
         else:
-            print(f"Errore: Client non pronto. Ha risposto: {ack}")
+            logger.console(f"Errore: Client non pronto. Ha risposto: {ack}", "WARNING")
+
+def giorni_log(username, da, a):
+    """
+    Log giornalieri di un utente da una data all'altra (incluse), in ordine
+    cronologico, come coppie (data, file). ValueError se le date non sono valide
+    """
+    try:
+        inizio = datetime.strptime(da, "%Y-%m-%d")
+        fine = datetime.strptime(a, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError("Date non valide, usa il formato YYYY-MM-DD")
+    if fine < inizio:
+        raise ValueError(f"La data finale {a} precede quella iniziale {da}")
+    if (fine - inizio).days >= LOG_GIORNI_MAX:
+        raise ValueError(f"Intervallo troppo lungo (massimo {LOG_GIORNI_MAX} giorni)")
+
+    giorni = []
+    for n in range((fine - inizio).days + 1):
+        data_log = (inizio + timedelta(days=n)).strftime('%Y-%m-%d')
+        giorni.append((data_log, f"logs/client_{username}_{data_log}.xml"))
+    return giorni
+
+# Predicati di EX valutati sul server: level=WARNING type=AUTH from=14:00 to=15:00
+PREDICATI_EX = ("level", "type", "from", "to")
+
+def parametri_ex(parti):
+    """
+    Parametri del comando EX (parole del comando, "EX" compreso) come
+    (formato, numero, intervallo, target, filtro). ValueError se un predicato
+    non è tra PREDICATI_EX o non è valido: l'esportazione non va eseguita
+    """
+    # 1. IMPOSTAZIONE DEFAULT (Sempre eseguiti)
+    numero = 0       # 0 significa "tutti"
+    intervallo = None # (da, a) numeri di entry, a=None significa "fino alla fine"
+    target = "tutti" # può essere "client", "server" o "tutti"
+    formato = "xml"  # Formato base
+    predicati = {}
+
+    # 2. PARSING (Eseguito solo se ci sono parametri)
+    if len(parti) >= 2:
+        formato = parti[1].lower() # xml, csv, txt
+
+        # Analizza i parametri extra (es: EX csv 10 server)
+        for p in parti[2:]:
+            if p.isdigit():
+                numero = int(p)      # È il numero di log
+            elif re.fullmatch(r"\d+-\d*", p):
+                # Intervallo di entry: "100-200" oppure "100-" (dalla 100 in poi)
+                da, a = p.split("-")
+                intervallo = (int(da), int(a) if a else None)
+            elif p.lower() in ["client", "server"]:
+                target = p.lower()   # È il target
+            elif "=" in p:
+                chiave, valore = p.split("=", 1)
+                chiave = chiave.lower()
+                if chiave not in PREDICATI_EX:
+                    raise ValueError(f"Predicato sconosciuto: {chiave} (usa {', '.join(PREDICATI_EX)})")
+                predicati[chiave] = valore
+
+    if formato not in ("xml", "csv", "txt"):
+        formato = "xml"
+
+    filtro = logger.crea_filtro(predicati.get("level"), predicati.get("type"),
+                                predicati.get("from"), predicati.get("to"))
+    return formato, numero, intervallo, target, filtro
 
 def gestisci_client(mio_socket, client_address, server_log_filename):
     """Gestisce la comunicazione con un singolo client"""
     client_id = f"{client_address[0]}:{client_address[1]}"
     
-    # AUTENTICAZIONE
+    # AUTENTICAZIONE (le sue entry hanno un ID di richiesta proprio)
+    logger.nuova_richiesta()
     auth_ok, username, client_log_filename = autenticazione(mio_socket, client_address, server_log_filename)
     
     if not auth_ok:
@@ -282,11 +376,14 @@ def gestisci_client(mio_socket, client_address, server_log_filename):
 
     logger.log_to_xml(server_log_filename, "INFO", "CONNECTION", f"Utente {username} connesso da {client_id}")
     logger.log_to_xml(client_log_filename, "INFO", "CONNECTION", f"Connesso al server")
+    compressione = None # (algoritmo, livello) se il client ha chiesto COMPRESS
     try:
         while server_running:
             data = mio_socket.recv(1024).decode('utf-8', errors='ignore').strip()
+            # Nuovo ID per le entry di questo comando (log del client e del server)
+            logger.nuova_richiesta()
             if data:
-                print(f"[CLIENT {username}] Messaggio: {data}")
+                logger.console(f"[CLIENT {username}] Messaggio: {data}")
             
             if not data:
                 logger.log_to_xml(server_log_filename, "INFO", "DISCONNECTION", f"Utente {username} ha chiuso la connessione")
@@ -294,6 +391,9 @@ def gestisci_client(mio_socket, client_address, server_log_filename):
                 break
                 
             comando = data.upper()
+            # Comandi serviti nella sessione (statistiche del log del client)
+            nome_comando = comando.split()[0]
+            logger.conta_comando(client_log_filename, nome_comando if nome_comando in COMANDI else "ALTRO")
             
             if comando == "TIME":
                 current_time = datetime.now().strftime("%H:%M:%S")
@@ -317,6 +417,14 @@ def gestisci_client(mio_socket, client_address, server_log_filename):
                 logger.log_to_xml(client_log_filename, "INFO", "EXIT", "Comando EXIT eseguito")
                 break
                 
+            elif comando == "STATS":
+                # Contatori della sessione in corso, senza rileggere il log
+                statistiche = logger.statistiche_sessione(client_log_filename)
+                risposta = (f"Statistiche sessione: {logger.formatta_statistiche(statistiche)}"
+                            if statistiche else "Statistiche non disponibili")
+                mio_socket.send(risposta.encode('utf-8'))
+                logger.log_to_xml(client_log_filename, "INFO", "RESPONSE", f"Risposta STATS ricevuta")
+
             elif comando.startswith("INFO"):
                 risposta = gestisci_comando_info(data)
                 mio_socket.send(risposta.encode('utf-8'))
@@ -328,76 +436,109 @@ def gestisci_client(mio_socket, client_address, server_log_filename):
                     data_log = datetime.now().strftime('%Y-%m-%d')
                     if len(parti) > 1:
                         data_log = parti[1]
-                    
-                    nome_file_xml = f"logs/client_{username}_{data_log}.xml"
-                    
-                    if os.path.exists(nome_file_xml):
-                        nome_file_txt = logger.converti_xml_in_txt(nome_file_xml)
-                        with open(nome_file_txt, "r", encoding="utf-8") as f:
-                            testo_log = f.read()
-                        
+
+                    if len(parti) > 2:
+                        # LOG <da> <a>: tutti i giorni dell'intervallo in un unico invio
+                        try:
+                            giorni = giorni_log(username, parti[1], parti[2])
+                        except ValueError as e:
+                            mio_socket.send(f"ERRORE: {e}".encode('utf-8'))
+                            continue
+                    else:
+                        giorni = [(data_log, f"logs/client_{username}_{data_log}.xml")]
+                    logger.flush_log()
+
+                    # Il log del giorno può essere diviso in più segmenti, anche compressi.
+                    # I giorni senza log vengono saltati
+                    giorni = [(giorno, nome_file_xml) for giorno, nome_file_xml in giorni if logger.esiste_log(nome_file_xml)]
+                    if len(parti) > 2:
+                        prepara = lambda: ((lambda: logger.genera_txt_giorni(giorni)), None)
+                    else:
+                        # Dalla vista TXT tenuta aggiornata dallo scrittore, senza conversione
+                        prepara = lambda: logger.prepara_export(giorni[0][1], "txt")
+
+                    if giorni and compressione:
+                        # Con la compressione il testo passa dall'handshake FILE_START
+                        try:
+                            genera, dimensione = prepara()
+                            if dimensione is None:
+                                genera, dimensione = _misura(genera)
+                            _invia_con_header(mio_socket, "DISPLAY", genera, dimensione, compressione)
+                        except ET.ParseError as e:
+                            # Errore e terminatore in un solo invio: il client, fuori dallo
+                            # streaming, esce al primo messaggio e non deve lasciare FINE_INVIO
+                            mio_socket.send(f"\nERRORE: log non leggibile ({e})\nFINE_INVIO".encode('utf-8'))
+                        else:
+                            mio_socket.send("FINE_INVIO".encode('utf-8'))
+                    elif giorni:
                         # MANDIAMO UN SEGNALE DI INIZIO SPECIALE
                         mio_socket.send("START_DISPLAY_LOG".encode('utf-8'))
                         time.sleep(0.2) # Piccolo delay per non fondere i pacchetti
                         
-                        # Inviamo il testo (il client lo riceverà un pezzo alla volta)
-                        mio_socket.sendall(testo_log.encode('utf-8'))
+                        # Inviamo il testo convertito in streaming (il client lo riceverà un pezzo alla volta)
+                        try:
+                            genera, _ = prepara()
+                            for blocco in genera():
+                                mio_socket.sendall(blocco)
+                        except ET.ParseError as e:
+                            mio_socket.sendall(f"\nERRORE: log non leggibile ({e})\n".encode('utf-8'))
                         time.sleep(0.2) # Piccolo delay per non fondere i pacchetti
 
                         # MANDIAMO IL SEGNALE DI FINE (riutilizziamo quello che hai già)
                         mio_socket.send("FINE_INVIO".encode('utf-8'))
-                        
-                        if os.path.exists(nome_file_txt): os.remove(nome_file_txt)
+                    elif len(parti) > 2:
+                        mio_socket.send(f"ERRORE: Nessun log trovato dal {parti[1]} al {parti[2]}".encode('utf-8'))
                     else:
                         mio_socket.send(f"ERRORE: Nessun log trovato per la data {data_log}".encode('utf-8'))
 
             elif comando.startswith("EX"):
-                    parti = comando.split()
-    
-                    # 1. IMPOSTAZIONE DEFAULT (Sempre eseguiti)
-                    numero = 0       # 0 significa "tutti"
-                    target = "tutti" # può essere "client", "server" o "tutti"
-                    formato = "xml"  # Formato base
-                    
-                    # 2. PARSING (Eseguito solo se ci sono parametri)
-                    if len(parti) >= 2:
-                        formato = parti[1].lower() # xml, csv, txt
-
-                        # Analizza i parametri extra (es: EX csv 10 server)
-                        for p in parti[2:]:
-                            if p.isdigit():
-                                numero = int(p)      # È il numero di log
-                            elif p.lower() in ["client", "server"]:
-                                target = p.lower()   # È il target
+                    # 1-2. DEFAULT E PARSING (un predicato sconosciuto annulla l'esportazione)
+                    try:
+                        formato, numero, intervallo, target, filtro = parametri_ex(comando.split())
+                    except ValueError as e:
+                        mio_socket.send(f"ERRORE: {e}".encode('utf-8'))
+                        continue
 
                     # 3. SELEZIONE E CONVERSIONE FILE (Sempre eseguita)
-                    file_c = client_log_filename
-                    file_s = server_log_filename
-                    
-                    if formato == "csv":
-                        file_c = logger.converti_xml_in_csv(client_log_filename)
-                        file_s = logger.converti_xml_in_csv(server_log_filename)
-                    elif formato == "txt":
-                        file_c = logger.converti_xml_in_txt(client_log_filename)
-                        file_s = logger.converti_xml_in_txt(server_log_filename)
-
-                    # 4. ESECUZIONE INVIO (Sempre eseguita)
+                    logger.flush_log() # In modalità asincrona aspetta le entry in coda
+                    # Dopo la mezzanotte la sessione scrive sul log del nuovo giorno
+                    file_c = logger.giorno_corrente(client_log_filename)
+                    file_s = logger.giorno_corrente(server_log_filename)
+
+                    # 4. ESECUZIONE INVIO (Sempre eseguita, conversione in streaming)
                     # Se il target è "client" o "tutti"
                     if target == "client" or target == "tutti":
-                        if file_c:
-                            invia_file_log(mio_socket, file_c, "CLIENT", numero)
+                        invia_file_log(mio_socket, file_c, "CLIENT", formato, numero, intervallo, compressione=compressione, filtro=filtro)
                         
                     # Se il target è "server" o "tutti"
                     if target == "server" or target == "tutti":
-                        if file_s:
-                            invia_file_log(mio_socket, file_s, "SERVER", numero)
+                        # Il log del server è lo stesso per tutti: esportazione condivisa in cache (non le ricerche filtrate)
+                        invia_file_log(mio_socket, file_s, "SERVER", formato, numero, intervallo, usa_cache=filtro is None, compressione=compressione, filtro=filtro)
 
                     # 5. SEGNALE DI CHIUSURA (Fondamentale per non bloccare il client)
                     mio_socket.send("FINE_INVIO".encode('utf-8'))
 
+            elif comando.startswith("COMPRESS"):
+                    # Negoziazione: COMPRESS <zlib|gzip|off> [livello]
+                    parti = data.lower().split()
+                    algoritmo = parti[1] if len(parti) > 1 else ""
+                    livello = COMPRESSIONE_LIVELLO
+                    if len(parti) > 2 and parti[2].isdigit():
+                        livello = min(int(parti[2]), 9)
+
+                    if algoritmo in COMPRESSIONI:
+                        compressione = (algoritmo, livello)
+                        mio_socket.send(f"COMPRESS_OK|{algoritmo}|{livello}".encode('utf-8'))
+                    elif algoritmo == "off":
+                        compressione = None
+                        mio_socket.send("COMPRESS_OK|off|0".encode('utf-8'))
+                    else:
+                        mio_socket.send(f"COMPRESS_NO|Algoritmi supportati: {', '.join(COMPRESSIONI)}".encode('utf-8'))
+                    logger.log_to_xml(client_log_filename, "INFO", "RESPONSE", f"Compressione trasferimenti: {compressione[0] if compressione else 'off'}")
+
             else:
                 # Gestione comandi non riconosciuti
-                risposta = f"Comando '{comando}' non riconosciuto. Comandi: TIME, NAME, INFO, LOG, EX, EXIT"
+                risposta = f"Comando '{comando}' non riconosciuto. Comandi: {', '.join(COMANDI)}"
                 mio_socket.send(risposta.encode('utf-8'))
                 logger.log_to_xml(client_log_filename, "WARNING", "UNKNOWN_COMMAND", f"Comando non riconosciuto: {comando}")
 
@@ -420,6 +561,9 @@ def gestisci_client(mio_socket, client_address, server_log_filename):
         
         logger.log_to_xml(server_log_filename, "INFO", "THREAD_CLOSE", f"Chiusura thread per {username}")
         logger.log_to_xml(client_log_filename, "INFO", "SESSION_END", "Sessione terminata")
+        # Chiude i tag della sessione e rilascia il file del client
+        logger.chiudi_log(client_log_filename)
+        logger.fine_richiesta()
 # Gestione signal per CTRL+C
 signal_handler_called = False
 def signal_handler(sig, frame):
@@ -428,6 +572,8 @@ def signal_handler(sig, frame):
         print(f"\n{Colori.GIALLO}CTRL+C ricevuto - Chiusura server in corso...{Colori.RESET}")
         server_running = False
         signal_handler_called = True
+        # Porta su disco le entry in coda senza bloccare il signal handler
+        logger.richiedi_flush()
 
 
 def discovery_listener():
@@ -461,17 +607,17 @@ def discovery_listener():
                     # Invia risposta al client
                     udp_socket.sendto(risposta.encode('utf-8'), client_addr)
                     
-                    print(f"{Colori.CIANO}[DISCOVERY] Richiesta da {client_addr[0]} - Risposta inviata{Colori.RESET}")
+                    logger.console(f"{Colori.CIANO}[DISCOVERY] Richiesta da {client_addr[0]} - Risposta inviata{Colori.RESET}")
                 else:
                     # Token errato o messaggio invalido - ignora silenziosamente
-                    print(f"{Colori.GRIGIO}[DISCOVERY] Richiesta ignorata da {client_addr[0]} (token errato){Colori.RESET}")
+                    logger.console(f"{Colori.GRIGIO}[DISCOVERY] Richiesta ignorata da {client_addr[0]} (token errato){Colori.RESET}", "WARNING")
                     
             except socket.timeout:
                 # Nessun messaggio ricevuto, continua il loop
                 continue
             except Exception as e:
                 if server_running:  # Mostra errore solo se il server è ancora attivo
-                    print(f"{Colori.ROSSO}[DISCOVERY] Errore: {e}{Colori.RESET}")
+                    logger.console(f"{Colori.ROSSO}[DISCOVERY] Errore: {e}{Colori.RESET}", "ERROR")
                     
     except Exception as e:
         print(f"{Colori.ROSSO}Errore fatale discovery listener: {e}{Colori.RESET}")
@@ -484,10 +630,34 @@ def main():
     print("AVVIO SERVER TCP")
     print("=" * 60)
 
+    # Senza terminale (servizio, output rediretto) l'eco a console si può spegnere
+    if "--no-console" in sys.argv:
+        logger.configura_console(attiva=False)
+    # Archivio dei log: --log-backend=xml (predefinito) | sqlite | consolidato | memoria
+    for argomento in sys.argv[1:]:
+        if argomento.startswith("--log-backend="):
+            logger.configura_backend(argomento.split("=", 1)[1])
+
+    # Archivio utenti: --utenti-backend=json (predefinito) | sqlite
+    for argomento in sys.argv[1:]:
+        if argomento.startswith("--utenti-backend="):
+            authenticator.configura_utenti(argomento.split("=", 1)[1])
     authenticator.setup_config()
+    # Ultimi accessi scritti a blocchi invece che a ogni login
+    authenticator.avvia_salvataggio_accessi()
+    # Hash delle password calcolati in processi separati
+    authenticator.avvia_pool_hash()
+    # Segmenti lasciati aperti o troncati da un crash precedente
+    riparati = logger.recupera_log()
+    if riparati:
+        print(f"Log riparati dopo un'interruzione: {len(riparati)}")
     server_log_filename = logger.setup_xml_log()
-    print(f"Log SERVER: {server_log_filename}")
-    print(f"Config utenti: {authenticator.CONFIG_FILE}")
+    if logger.LOG_ASINCRONO:
+        logger.avvia_scrittore_asincrono()
+    # Archivio mensile e conservazione dei log dei giorni passati
+    logger.avvia_manutenzione()
+    print(f"Log SERVER: {server_log_filename} (archivio {logger.LOG_BACKEND})")
+    print(f"Config utenti: {authenticator.UTENTI_SQLITE_FILE if authenticator.UTENTI_BACKEND == 'sqlite' else authenticator.CONFIG_FILE}")
     print(f"Token Discovery: {SECRET_TOKEN}")
     
     logger.log_to_xml(server_log_filename, "INFO", "SERVER_START", "Server TCP avviato con sistema autenticazione")
@@ -526,7 +696,7 @@ def main():
                 )
                 thread_client.start()
                 
-                print(f"Thread attivi: {threading.active_count() - 1}")
+                logger.console(f"Thread attivi: {threading.active_count() - 1}")
             except socket.timeout:
                 continue
     
@@ -536,6 +706,15 @@ def main():
     finally:
         mio_server.close()
         logger.log_to_xml(server_log_filename, "INFO", "SERVER_SHUTDOWN", "Server chiuso correttamente")
+        logger.ferma_manutenzione()
+        authenticator.ferma_salvataggio_accessi()
+        authenticator.ferma_pool_hash()
+        # Svuota la coda del log asincrono prima di chiudere i file
+        logger.ferma_scrittore_asincrono()
+        logger.chiudi_tutti_i_log()
+        # Ultime righe rimaste nella coda della console
+        logger.ferma_console()
         print(f"{Colori.VERDE}Server chiuso correttamente{Colori.RESET}")
 
-main()
+if __name__ == "__main__":
+    main()
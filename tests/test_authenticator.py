@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat"))
+
+import authenticator
+
+
+class TestUtenti(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        for nome, valore in (("_utenti", {}), ("_versione_utenti", None), ("HASH_ITERAZIONI", 1000),
+                             ("UTENTI_BACKEND", "json"), ("UTENTI_SQLITE_FILE", "config/users.db"),
+                             ("_db", None)):
+            patch = mock.patch.object(authenticator, nome, valore)
+            patch.start()
+            self.addCleanup(patch.stop)
+        # Prima di ripristinare le variabili: chiude il database, se aperto
+        self.addCleanup(authenticator.configura_utenti, "json")
+        authenticator.setup_config()
+
+    def utenti_json(self):
+        """Registra due utenti nel file JSON (uno nello snapshot, uno nel journal)"""
+        self.assertTrue(authenticator.registra_utente("anna", "pw1234", "127.0.0.1", 5000))
+        authenticator.compatta_utenti()
+        self.assertTrue(authenticator.registra_utente("bruno", "pw5678", "127.0.0.1", 5001))
+
+    def test_migrazione_json_illeggibile(self):
+        self.utenti_json()
+        with open(authenticator.CONFIG_FILE, "r+", encoding="utf-8") as f:
+            dati = f.read()
+            f.seek(0)
+            f.truncate()
+            f.write(dati[:len(dati) // 2])
+
+        with self.assertRaises(ValueError):
+            authenticator.configura_utenti("sqlite")
+        self.assertTrue(os.path.exists(authenticator.CONFIG_FILE))
+        self.assertTrue(os.path.exists(authenticator.JOURNAL_FILE))
+        self.assertFalse(os.path.exists(authenticator.CONFIG_FILE + ".migrato"))
+        self.assertEqual(authenticator.UTENTI_BACKEND, "json")
+        self.assertIsNone(authenticator._db)
+
+        # Sistemato il file, la migrazione riparte da un database vuoto
+        with open(authenticator.CONFIG_FILE, "w", encoding="utf-8") as f:
+            f.write(dati)
+        authenticator.configura_utenti("sqlite")
+        self.assertEqual(authenticator.numero_utenti(), 2)
+        self.assertTrue(authenticator.verifica_credenziali("bruno", "pw5678"))
+        self.assertFalse(os.path.exists(authenticator.CONFIG_FILE))
+        self.assertTrue(os.path.exists(authenticator.CONFIG_FILE + ".migrato"))
+        self.assertTrue(os.path.exists(authenticator.JOURNAL_FILE + ".migrato"))
+
+    def test_migrazione_journal_illeggibile(self):
+        self.utenti_json()
+        with open(authenticator.JOURNAL_FILE, "rb") as f:
+            journal = f.read()
+        with open(authenticator.JOURNAL_FILE, "wb") as f:
+            f.write(b'{"username": "carla", rotto\n' + journal)
+
+        with self.assertRaises(ValueError):
+            authenticator.configura_utenti("sqlite")
+        self.assertTrue(os.path.exists(authenticator.CONFIG_FILE))
+        with open(authenticator.JOURNAL_FILE, "rb") as f:
+            self.assertTrue(f.read().endswith(journal))
+
+        # Una riga finale scritta a metà invece è un crash normale: si migra senza
+        with open(authenticator.JOURNAL_FILE, "wb") as f:
+            f.write(journal + b'{"userna')
+        authenticator.configura_utenti("sqlite")
+        self.assertEqual(sorted(authenticator.elenco_utenti()), ["anna", "bruno"])
+
+
+    def password_salvata(self, username):
+        return next(u["password"] for u in authenticator.carica_utenti()["users"] if u["username"] == username)
+
+    def test_password_in_chiaro_riscritta_al_login(self):
+        for backend in ("json", "sqlite"):
+            with self.subTest(backend=backend):
+                authenticator.configura_utenti("json")
+                utente = {"username": f"vecchio_{backend}", "password": "in_chiaro",
+                          "data_registrazione": "2025-01-01T00:00:00", "ultimo_accesso": "2025-01-01T00:00:00"}
+                with open(authenticator.CONFIG_FILE, "w", encoding="utf-8") as f:
+                    json.dump({"users": [utente]}, f)
+                if os.path.exists(authenticator.JOURNAL_FILE):
+                    os.remove(authenticator.JOURNAL_FILE)
+                authenticator.configura_utenti(backend)
+                username = utente["username"]
+
+                # Un tentativo sbagliato non tocca la password salvata
+                self.assertFalse(authenticator.verifica_credenziali(username, "sbagliata"))
+                self.assertEqual(self.password_salvata(username), "in_chiaro")
+
+                self.assertTrue(authenticator.verifica_credenziali(username, "in_chiaro"))
+                self.assertTrue(self.password_salvata(username).startswith("pbkdf2_sha256$1000$"))
+                self.assertTrue(authenticator.verifica_credenziali(username, "in_chiaro"))
+                self.assertFalse(authenticator.verifica_credenziali(username, "sbagliata"))
+
+                # Con un costo più alto l'hash viene rifatto al login successivo
+                with mock.patch.object(authenticator, "HASH_ITERAZIONI", 2000):
+                    self.assertTrue(authenticator.verifica_credenziali(username, "in_chiaro"))
+                    self.assertTrue(self.password_salvata(username).startswith("pbkdf2_sha256$2000$"))
+                    self.assertTrue(authenticator.verifica_credenziali(username, "in_chiaro"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import csv
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+CARTELLA_AURA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat")
+sys.path.insert(0, CARTELLA_AURA)
+
+import logger
+
+
+class TestRecupero(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logger.configura_backend("xml")
+        self.addCleanup(logger.chiudi_tutti_i_log)
+
+    def log_troncato(self, entry=20):
+        """Log di un client con entry righe CMD, tagliato a metà dell'ultima come dopo un crash"""
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        for i in range(entry):
+            logger.log_to_xml(log, "INFO", "CMD", f"entry {i}")
+        logger.chiudi_log(log)
+        with open(log, "rb") as f:
+            dati = f.read()
+        with open(log, "wb") as f:
+            f.write(dati[:dati.rindex(b"<entry", 0, dati.index(f"entry {entry - 1}<".encode())) + 30])
+        return log
+
+    def messaggi(self, log, ultime=0, solo_cmd=True):
+        """Messaggi delle entry esportate (solo_cmd: senza le statistiche di sessione)"""
+        filtro = logger.crea_filtro(None, "CMD") if solo_cmd else None
+        genera, _ = logger.prepara_export(log, "csv", ultime, filtro=filtro)
+        return [riga["message"] for riga in csv.DictReader(io.StringIO(b"".join(genera()).decode('utf-8')))]
+
+    def test_recupero_all_avvio(self):
+        log = self.log_troncato()
+        self.assertEqual(logger.recupera_log(), [log])
+
+        ET.parse(log)
+        attese = [f"entry {i}" for i in range(19)]
+        self.assertEqual(self.messaggi(log), attese)
+        # Indice e viste riallineati alla parte rimasta
+        self.assertEqual(logger.conta_entry(log), 19)
+        self.assertEqual(self.messaggi(log, 5, solo_cmd=False), attese[-5:])
+        genera, dimensione = logger.prepara_export(log, "txt")
+        vista = b"".join(genera())
+        self.assertEqual(dimensione, len(vista))
+        self.assertEqual(vista, b"".join(logger.genera_txt(logger.blocchi_log(log))))
+
+        # Il log si riapre e continua con una nuova sessione
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5001))
+        logger.log_to_xml(log, "INFO", "CMD", "dopo il crash")
+        self.assertEqual(self.messaggi(log), attese + ["dopo il crash"])
+        self.assertEqual(self.messaggi(log, 2), ["entry 18", "dopo il crash"])
+
+    def test_riapertura_senza_recupero(self):
+        log = self.log_troncato()
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5001))
+        logger.log_to_xml(log, "INFO", "CMD", "dopo il crash")
+        logger.chiudi_log(log)
+
+        ET.parse(log)
+        self.assertEqual(self.messaggi(log), [f"entry {i}" for i in range(19)] + ["dopo il crash"])
+        self.assertEqual(self.messaggi(log, 3), ["entry 17", "entry 18", "dopo il crash"])
+
+    def test_cli_ricostruisci_indici(self):
+        log = self.log_troncato()
+        logger.recupera_log()
+        os.remove(log + ".idx")
+
+        risultato = subprocess.run(
+            [sys.executable, os.path.join(CARTELLA_AURA, "logger.py"), "ricostruisci-indici", log],
+            capture_output=True, text=True, timeout=60)
+        self.assertEqual(risultato.returncode, 0, risultato.stderr)
+        self.assertIn(f"{log}: 19 entry indicizzate", risultato.stdout)
+        self.assertEqual(logger.conta_entry(log), 19)
+        self.assertEqual(self.messaggi(log, 4, solo_cmd=False), [f"entry {i}" for i in range(15, 19)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import csv
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat"))
+
+import logger
+
+
+class TestRipetute(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logger.configura_backend("memoria")
+        self.addCleanup(logger.configura_backend, "xml")
+        self.addCleanup(logger.fine_richiesta)
+
+    def righe(self, log):
+        genera, _ = logger.prepara_export(log, "csv")
+        return list(csv.DictReader(io.StringIO(b"".join(genera()).decode('utf-8'))))
+
+    def test_richieste_diverse_non_si_uniscono(self):
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        richieste = []
+        for _ in range(3):
+            richieste.append(logger.nuova_richiesta())
+            logger.log_to_xml(log, "INFO", "RESPONSE", "Risposta TIME ricevuta")
+        logger.chiudi_log(log)
+
+        risposte = [riga for riga in self.righe(log) if riga["type"] == "RESPONSE"]
+        self.assertEqual([riga["req"] for riga in risposte], richieste)
+
+    def test_ripetizioni_della_stessa_richiesta(self):
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        richiesta = logger.nuova_richiesta()
+        for _ in range(5):
+            logger.log_to_xml(log, "WARNING", "AUTH", "Tentativo fallito")
+        logger.chiudi_log(log)
+
+        tentativi = [riga for riga in self.righe(log) if riga["type"] == "AUTH"]
+        self.assertEqual([riga["count"] for riga in tentativi], ["1", "4"])
+        self.assertEqual({riga["req"] for riga in tentativi}, {richiesta})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat"))
+
+import logger
+
+
+class TestRotazione(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logger.configura_backend("xml")
+        for nome, valore in (("ROTAZIONE_MAX_BYTE", 3000), ("ROTAZIONE_GZIP", False)):
+            patch = mock.patch.object(logger, nome, valore)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_sessione_ruotata_resta_una(self):
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        for i in range(60):
+            logger.log_to_xml(log, "INFO", "CMD", f"entry {i}")
+        logger.chiudi_log(log)
+        self.assertGreaterEqual(len(logger.segmenti_log(log)), 3)
+
+        genera, dimensione = logger.prepara_export(log, "txt")
+        vista = b"".join(genera())
+        self.assertEqual(dimensione, len(vista))
+        self.assertEqual(vista.count(b"Sessione iniziata"), 1)
+        # Le viste danno gli stessi byte della conversione dell'XML
+        self.assertEqual(vista, b"".join(logger.genera_txt(logger.blocchi_log(log))))
+
+        # Le ultime entry, tutte nell'ultimo segmento, hanno comunque la loro sessione
+        genera, _ = logger.prepara_export(log, "txt", 3)
+        ultime = b"".join(genera())
+        self.assertEqual(ultime.count(b"Sessione iniziata"), 1)
+        self.assertEqual(ultime.count(b"[INFO]"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
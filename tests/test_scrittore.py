@@ -0,0 +1,48 @@
+import csv
+import glob
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat"))
+
+import logger
+
+
+class TestSpill(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logger.configura_backend("memoria")
+        self.addCleanup(logger.configura_backend, "xml")
+        self.addCleanup(logger.ferma_scrittore_asincrono)
+
+    def test_spill_di_un_processo_interrotto(self):
+        os.makedirs("logs")
+        with open(logger.LOG_SPILL_FILE, "w", encoding="utf-8") as f:
+            f.write('["logs/client_vecchio_2026-01-01.xml", ["10:00:00", "INFO", "CMD", "vecchia", {}]]\n')
+            f.write('["logs/client_vecchio_2026-01-01.xml", ["10:00:01", "IN')
+
+        logger.avvia_scrittore_asincrono(flush_intervallo=60, overflow="spill", dimensione_coda=5)
+        self.assertFalse(os.path.exists(logger.LOG_SPILL_FILE))
+        self.assertEqual(len(glob.glob(logger.LOG_SPILL_FILE + ".*.orfano")), 1)
+
+        log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        for i in range(50):
+            logger.log_to_xml(log, "INFO", "CMD", f"entry {i}")
+        self.assertTrue(logger.flush_log(10))
+
+        genera, _ = logger.prepara_export(log, "csv")
+        righe = list(csv.DictReader(io.StringIO(b"".join(genera()).decode('utf-8'))))
+        self.assertEqual([riga["message"] for riga in righe], [f"entry {i}" for i in range(50)])
+        self.assertFalse(os.path.exists(logger.LOG_SPILL_FILE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat"))
+
+import authenticator
+import logger
+import server_5
+from test_server_ex import SocketFinto
+
+
+class TestRegistrazione(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logger.configura_backend("memoria")
+        self.addCleanup(logger.configura_backend, "xml")
+        for nome, valore in (("_utenti", {}), ("_versione_utenti", None), ("HASH_ITERAZIONI", 1000)):
+            patch = mock.patch.object(authenticator, nome, valore)
+            patch.start()
+            self.addCleanup(patch.stop)
+        authenticator.setup_config()
+
+    def test_nome_preso_durante_la_registrazione(self):
+        server_log = logger.setup_xml_log()
+        self.assertTrue(authenticator.registra_utente("anna", "segreta", "127.0.0.1", 5000))
+        socket_finto = SocketFinto(["NO", "anna", "pw1234"])
+        # Un altro client registra "anna" tra il controllo del nome e la registrazione
+        with mock.patch.object(authenticator, "username_esiste", return_value=False):
+            server_5.gestisci_client(socket_finto, ("127.0.0.1", 5001), server_log)
+
+        self.assertTrue(socket_finto.inviati[-1].startswith("REG_FAIL"))
+        self.assertTrue(socket_finto.chiuso)
+        self.assertNotIn("anna", authenticator.utenti_connessi)
+        self.assertTrue(authenticator.verifica_credenziali("anna", "segreta"))
+        genera, _ = logger.prepara_export(server_log, "txt")
+        self.assertIn(b"AUTH_FAILED", b"".join(genera()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aura_chat"))
+
+import logger
+import server_5
+
+
+class SocketFinto:
+    """Socket che riceve i comandi indicati e registra ciò che il server invia"""
+
+    def __init__(self, comandi):
+        self.comandi = [c.encode('utf-8') for c in comandi]
+        self.inviati = []
+        self.chiuso = False
+
+    def recv(self, n):
+        return self.comandi.pop(0) if self.comandi else b""
+
+    def send(self, dati):
+        self.inviati.append(dati.decode('utf-8'))
+        return len(dati)
+
+    sendall = send
+
+    def close(self):
+        self.chiuso = True
+
+
+class TestPredicatiEx(unittest.TestCase):
+
+    def setUp(self):
+        self.cartella = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.cartella.name)
+        self.addCleanup(self.cartella.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logger.configura_backend("memoria")
+        self.addCleanup(logger.configura_backend, "xml")
+
+    def test_predicati_validi(self):
+        formato, numero, intervallo, target, filtro = server_5.parametri_ex(
+            "EX CSV 10 SERVER LEVEL=WARNING TYPE=AUTH*".split())
+        self.assertEqual((formato, numero, intervallo, target), ("csv", 10, None, "server"))
+        self.assertTrue(filtro(("10:00:00", "WARNING", "AUTH_FAILED", "", {})))
+        self.assertFalse(filtro(("10:00:00", "INFO", "AUTH_FAILED", "", {})))
+
+    def test_predicato_sconosciuto(self):
+        with self.assertRaisesRegex(ValueError, "lvl"):
+            server_5.parametri_ex("EX xml lvl=WARNING".split())
+
+    def test_ex_con_predicato_sconosciuto_risponde_errore(self):
+        server_log = logger.setup_xml_log()
+        client_log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        socket_finto = SocketFinto(["EX xml lvl=WARNING"])
+        with mock.patch.object(server_5, "autenticazione", return_value=(True, "anna", client_log)), \
+                mock.patch.object(server_5, "invia_file_log") as invia:
+            server_5.gestisci_client(socket_finto, ("127.0.0.1", 5000), server_log)
+
+        invia.assert_not_called()
+        self.assertEqual(len(socket_finto.inviati), 1)
+        self.assertTrue(socket_finto.inviati[0].startswith("ERRORE"))
+        self.assertIn("lvl", socket_finto.inviati[0])
+
+    def test_log_compresso_illeggibile_un_solo_terminatore(self):
+        server_log = logger.setup_xml_log()
+        client_log = logger.setup_client_log("anna", ("127.0.0.1", 5000))
+        socket_finto = SocketFinto(["COMPRESS zlib", "LOG"])
+        with mock.patch.object(server_5, "autenticazione", return_value=(True, "anna", client_log)), \
+                mock.patch.object(logger, "prepara_export", side_effect=ET.ParseError("entry rotta")):
+            server_5.gestisci_client(socket_finto, ("127.0.0.1", 5000), server_log)
+
+        # Il client esce al primo messaggio: errore e FINE_INVIO devono arrivare insieme
+        risposta = socket_finto.inviati[1:]
+        self.assertEqual(len(risposta), 1)
+        self.assertIn("ERRORE", risposta[0])
+        self.assertTrue(risposta[0].endswith("FINE_INVIO"))
+
+
+if __name__ == "__main__":
+    unittest.main()